@@ -0,0 +1,175 @@
+"""Compare the sync-backed `PostgresSaverCustom` shim against the pool-backed
+`AsyncPostgresSaverCustom` on concurrent conversations.
+
+The graph reproduces the shape of the RAG graph (topic guard, LLM, retriever,
+LLM) without calling any model, so only the checkpointing cost is measured.
+
+Usage:
+    python -m benchmarks.checkpointer_benchmark --db-uri "$POSTGRES_DB_URI"
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from operator import add
+from typing import Annotated, TypedDict
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from psycopg_pool import ConnectionPool
+
+from rag_pipeline.checkpointers import (
+    POOL_CONNECTION_KWARGS,
+    AsyncPostgresSaverCustom,
+    PostgresSaverCustom,
+)
+
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+    references: Annotated[list, add]
+    num_calls: Annotated[list, add]
+
+
+def build_graph(
+    checkpointer, chunk_size: int, num_chunks: int, llm_latency_ms: float = 0.0
+):
+    """Build a model-free graph with the same nodes and writes as `RAGPipeline`.
+
+    The model calls are replaced by an `asyncio.sleep` of `llm_latency_ms`, as
+    an async chat model would yield the event loop while waiting for the API.
+    """
+    context = "\n\n".join(["x" * chunk_size] * num_chunks)
+
+    async def topic_guard(state: State):
+        await asyncio.sleep(llm_latency_ms / 1000)
+        return {}
+
+    async def llm_with_retriever(state: State):
+        await asyncio.sleep(llm_latency_ms / 1000)
+        if state["messages"][-1].type == "tool":
+            return {"messages": [AIMessage(content="answer")]}
+        call_id = str(uuid.uuid4())
+        return {
+            "messages": [
+                AIMessage(
+                    content="",
+                    tool_calls=[
+                        {"name": "retrieve_tool", "args": {"query": "q"}, "id": call_id}
+                    ],
+                )
+            ]
+        }
+
+    async def db_retriever(state: State):
+        call_id = state["messages"][-1].tool_calls[0]["id"]
+        return {
+            "messages": [ToolMessage(content=context, tool_call_id=call_id)],
+            "references": ["docs/source_docs/concepts/persistence.md"],
+            "num_calls": ["retrieve"],
+        }
+
+    def route(state: State):
+        return "DB_retriever" if state["messages"][-1].tool_calls else END
+
+    builder = StateGraph(State)
+    builder.add_node("Topic_guard", topic_guard)
+    builder.add_node("LLM_with_retriever", llm_with_retriever)
+    builder.add_node("DB_retriever", db_retriever)
+    builder.add_edge(START, "Topic_guard")
+    builder.add_edge("Topic_guard", "LLM_with_retriever")
+    builder.add_conditional_edges("LLM_with_retriever", route)
+    builder.add_edge("DB_retriever", "LLM_with_retriever")
+    return builder.compile(checkpointer=checkpointer)
+
+
+async def run_conversations(
+    graph, conversations: int, turns: int
+) -> tuple[float, float]:
+    """Run `conversations` concurrent threads of `turns` turns each.
+
+    Returns:
+        tuple[float, float]: The conversations completed per second and the
+            longest time (in ms) the event loop was blocked meanwhile.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    max_lag = 0.0
+
+    async def conversation(i: int):
+        config = {"configurable": {"thread_id": f"bench-{run_id}-{i}"}}
+        for turn in range(turns):
+            await graph.ainvoke({"messages": [("user", f"question {turn}")]}, config)
+
+    async def monitor_loop_lag():
+        nonlocal max_lag
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_lag = max(max_lag, time.perf_counter() - tick - 0.001)
+
+    monitor = asyncio.create_task(monitor_loop_lag())
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(i) for i in range(conversations)))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    return conversations / elapsed, max_lag * 1000
+
+
+async def main(args: argparse.Namespace) -> None:
+    with ConnectionPool(
+        conninfo=args.db_uri,
+        min_size=args.pool_size,
+        max_size=args.pool_size,
+        kwargs=POOL_CONNECTION_KWARGS,
+    ) as pool:
+        shim = PostgresSaverCustom(pool)
+        shim.setup()
+        graph = build_graph(shim, args.chunk_size, args.num_chunks, args.llm_latency_ms)
+        shim_rate, shim_lag = await run_conversations(
+            graph, args.conversations, args.turns
+        )
+
+    async with AsyncPostgresSaverCustom.from_conn_string(
+        args.db_uri, min_size=args.pool_size, max_size=args.pool_size
+    ) as saver:
+        await saver.setup()
+        graph = build_graph(
+            saver, args.chunk_size, args.num_chunks, args.llm_latency_ms
+        )
+        async_rate, async_lag = await run_conversations(
+            graph, args.conversations, args.turns
+        )
+
+    print(
+        f"{args.conversations} conversations x {args.turns} turns, "
+        f"pool size {args.pool_size}, simulated LLM latency {args.llm_latency_ms} ms"
+    )
+    print(
+        f"PostgresSaverCustom (sync shim):  {shim_rate:8.2f} conversations/s, "
+        f"max event loop lag {shim_lag:8.2f} ms"
+    )
+    print(
+        f"AsyncPostgresSaverCustom:         {async_rate:8.2f} conversations/s, "
+        f"max event loop lag {async_lag:8.2f} ms"
+    )
+    print(f"Speed-up: {async_rate / shim_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default=os.getenv("POSTGRES_DB_URI"))
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--num-chunks", type=int, default=3)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    if not args.db_uri:
+        parser.error("--db-uri or POSTGRES_DB_URI is required")
+    asyncio.run(main(args))
@@ -0,0 +1,159 @@
+"""Measure the cold-start import time of the ingest modules and of the chat
+entry points with `python -X importtime`.
+
+Every entry point is imported in a fresh interpreter, the script prints its
+total import time and its heaviest modules. It exits with an error when an
+entry point takes longer than `--max-ms` or imports one of the heavy
+clients (OpenAI, Qdrant, Postgres, ...) that must only be loaded on first
+use, so it can guard the cold start in CI.
+
+Usage:
+    python -m benchmarks.import_time --max-ms 800
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# modules imported by the ingest command and by the chat server
+ENTRY_POINTS = {
+    "ingest": [
+        "vector_database.src.utils",
+        "vector_database.src.documentation_loader",
+        "vector_database.src.text_splitter",
+        "vector_database.src.vector_store",
+        "vector_database.src.ingest",
+    ],
+    "chat": [
+        "prompts.registry",
+        "rag_pipeline.core",
+        "rag_pipeline.server",
+    ],
+}
+
+# clients that take seconds to import, or connect to external services
+FORBIDDEN_MODULES = (
+    "langchain_openai",
+    "openai",
+    "qdrant_client",
+    "langchain_qdrant",
+    "psycopg",
+    "psycopg_pool",
+    "langgraph.checkpoint.postgres",
+    "git",
+    "langchain_text_splitters",
+)
+
+
+def parse_importtime(stderr: str) -> dict[str, int]:
+    """Parse the output of `-X importtime`.
+
+    Args:
+        stderr: Standard error of the interpreter.
+
+    Returns:
+        dict[str, int]: The cumulative import time (in microseconds) of every
+            imported module.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def measure(entry_point: list[str]) -> tuple[float, dict[str, int]]:
+    """Import the modules of `entry_point` in a fresh interpreter.
+
+    Returns:
+        tuple[float, dict[str, int]]: The total import time in milliseconds
+            and the cumulative import time of every module.
+    """
+    code = "; ".join(f"import {module}" for module in entry_point)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = parse_importtime(result.stderr)
+    # only top-level modules are not nested in another one
+    total = sum(modules.get(module, 0) for module in _roots(result.stderr))
+    return total / 1000, modules
+
+
+def _roots(stderr: str) -> list[str]:
+    roots = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            name = line.split("|")[-1]
+            if not name.startswith("  "):
+                roots.append(name.strip())
+    return roots
+
+
+def _forbidden(modules: dict[str, int]) -> list[str]:
+    return [
+        forbidden
+        for forbidden in FORBIDDEN_MODULES
+        if any(
+            module == forbidden or module.startswith(f"{forbidden}.")
+            for module in modules
+        )
+    ]
+
+
+def main(args: argparse.Namespace) -> int:
+    results = {}
+    failed = False
+    for name, entry_point in ENTRY_POINTS.items():
+        runs = [measure(entry_point) for _ in range(args.repeat)]
+        total_ms = statistics.median(total for total, _ in runs)
+        modules = runs[0][1]
+        # the heaviest dependencies, without the modules of this project
+        packages = {module.split(".")[0] for module in entry_point}
+        heaviest = sorted(
+            (module for module in modules if module.split(".")[0] not in packages),
+            key=modules.get,
+            reverse=True,
+        )
+        forbidden = _forbidden(modules)
+        results[name] = {
+            "modules": entry_point,
+            "import_ms": total_ms,
+            "imported_modules": len(modules),
+            "forbidden_modules": forbidden,
+        }
+
+        print(f"{name}: {total_ms:.0f} ms, {len(modules)} modules")
+        for module in heaviest[: args.top]:
+            print(f"    {modules[module] / 1000:>8.1f} ms  {module}")
+        if total_ms > args.max_ms:
+            print(f"    FAIL: above the budget of {args.max_ms:.0f} ms")
+            failed = True
+        if forbidden:
+            print(f"    FAIL: heavy modules imported: {', '.join(forbidden)}")
+            failed = True
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=1000.0,
+        help="Import time budget of every entry point",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Modules to print")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    sys.exit(main(parser.parse_args()))
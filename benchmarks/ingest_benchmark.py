@@ -0,0 +1,343 @@
+"""Benchmark the throughput of the ingestion stages on synthetic corpora
+scaled to 1x, 10x and 100x the size of the LangGraph documentation.
+
+The corpora mix Markdown pages (headings, code fences, tables) and notebooks
+(markdown and code cells with large outputs: logs and base64 images) in a
+deep directory tree. For every scale the stages `load_documents`,
+`ipynb_to_markdown_string`, `chunk_documents`, `save_chunks_to_disk` and the
+embedding (with `FakeEmbeddings`, a stand-in with a configurable latency)
+are timed in a fresh process, and the script reports files/s, MB/s,
+chunks/s and the peak RSS of each stage. The results are written to a JSON
+file, pass the file of a previous run with `--compare` to print the changes.
+
+Usage:
+    python -m benchmarks.ingest_benchmark --scales 1 10 100 --output ingest_benchmark.json
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+WORDS = (
+    "graph node edge state checkpoint thread agent tool memory stream "
+    "message reducer channel subgraph interrupt command config runnable "
+    "the a of to and in is for with that on as by this an be"
+).split()
+CODE_LINES = [
+    "from langgraph.graph import StateGraph, START, END",
+    "builder = StateGraph(State)",
+    'builder.add_node("agent", call_model)',
+    'builder.add_edge(START, "agent")',
+    "graph = builder.compile(checkpointer=MemorySaver())",
+    'for chunk in graph.stream({"messages": messages}, config):',
+    "    print(chunk)",
+    "def call_model(state: State) -> dict:",
+    '    return {"messages": [model.invoke(state["messages"])]}',
+]
+
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _code(rng: random.Random, lines: int) -> str:
+    return "\n".join(rng.choice(CODE_LINES) for _ in range(lines))
+
+
+def markdown_page(rng: random.Random) -> str:
+    """A documentation page, about 8 KB on average."""
+    parts = [f"# {_paragraph(rng, 4)}"]
+    for _ in range(rng.randint(3, 8)):
+        parts.append(f"## {_paragraph(rng, 3)}")
+        parts.extend(_paragraph(rng, rng.randint(40, 120)) for _ in range(2))
+        if rng.random() < 0.7:
+            parts.append(f"```python\n{_code(rng, rng.randint(5, 30))}\n```")
+        if rng.random() < 0.2:
+            rows = [f"| {rng.choice(WORDS)} | {rng.randint(0, 99)} |" for _ in range(8)]
+            parts.append("| name | value |\n|------|-------|\n" + "\n".join(rows))
+    return "\n\n".join(parts)
+
+
+def notebook(rng: random.Random, output_kb: int) -> str:
+    """A notebook whose cell outputs (logs and images) are about `output_kb`
+    KB on average."""
+    cells = []
+    for _ in range(rng.randint(8, 20)):
+        if rng.random() < 0.4:
+            source = f"## {_paragraph(rng, 3)}\n\n{_paragraph(rng, 60)}"
+            cells.append({"cell_type": "markdown", "metadata": {}, "source": source})
+            continue
+        outputs = []
+        if rng.random() < 0.5:
+            log = "\n".join(_paragraph(rng, 12) for _ in range(output_kb // 2))
+            outputs.append({"output_type": "stream", "name": "stdout", "text": log})
+        if rng.random() < 0.3:
+            image = base64.b64encode(rng.randbytes(output_kb * 1024)).decode()
+            outputs.append(
+                {
+                    "output_type": "display_data",
+                    "data": {"image/png": image, "text/plain": "<Figure>"},
+                    "metadata": {},
+                }
+            )
+        cells.append(
+            {
+                "cell_type": "code",
+                "execution_count": 1,
+                "metadata": {},
+                "source": _code(rng, rng.randint(3, 20)).splitlines(keepends=True),
+                "outputs": outputs,
+            }
+        )
+    return json.dumps({"cells": cells, "metadata": {}, "nbformat": 4})
+
+
+def generate_corpus(
+    root: Path, scale: float, args: argparse.Namespace
+) -> tuple[int, int]:
+    """Write the corpus of `scale` in `root`, in a tree up to `args.depth`
+    directories deep.
+
+    Returns:
+        tuple[int, int]: The number of files and their total size in bytes.
+    """
+    rng = random.Random(args.seed)
+    num_markdown = round(args.base_markdown * scale)
+    num_notebooks = round(args.base_notebooks * scale)
+    size = 0
+    for i in range(num_markdown + num_notebooks):
+        depth = rng.randint(0, args.depth)
+        directory = root.joinpath(
+            *(f"section_{rng.randint(0, 9)}" for _ in range(depth))
+        )
+        directory.mkdir(parents=True, exist_ok=True)
+        if i < num_markdown:
+            path, text = directory / f"page_{i}.md", markdown_page(rng)
+        else:
+            path = directory / f"notebook_{i}.ipynb"
+            text = notebook(rng, args.output_kb)
+        path.write_text(text, encoding="utf-8")
+        size += path.stat().st_size
+    return num_markdown + num_notebooks, size
+
+
+def _peak_rss_mb() -> float:
+    # VmHWM can be reset on Linux, ru_maxrss is the peak of the process
+    if sys.platform == "linux":
+        status = Path("/proc/self/status").read_text()
+        return int(re.search(r"VmHWM:\s+(\d+)", status).group(1)) / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+@contextmanager
+def measure(results: dict, stage: str) -> Iterator[dict]:
+    """Time a stage and record its peak RSS, the caller fills the counts."""
+    if sys.platform == "linux":
+        try:
+            # reset the peak RSS, so it only includes this stage
+            Path("/proc/self/clear_refs").write_text("5")
+        except OSError:
+            pass
+    stats: dict = {}
+    start = time.perf_counter()
+    yield stats
+    stats["seconds"] = time.perf_counter() - start
+    stats["peak_rss_mb"] = _peak_rss_mb()
+    seconds = max(stats["seconds"], 1e-9)
+    for unit in ("files", "chunks"):
+        if unit in stats:
+            stats[f"{unit}_per_second"] = stats[unit] / seconds
+    if "bytes" in stats:
+        stats["mb_per_second"] = stats["bytes"] / 2**20 / seconds
+    results[stage] = stats
+
+
+def run_scale(scale: float, args: argparse.Namespace) -> dict:
+    """Generate the corpus of `scale` and measure every stage.
+
+    It is run in a child process, so the memory of a scale does not
+    affect the next ones.
+    """
+    from rag_pipeline.fakes import FakeEmbeddings
+    from vector_database.src.documentation_loader import (
+        ipynb_to_markdown_string,
+        load_documents,
+    )
+    from vector_database.src.text_splitter import chunk_documents, save_chunks_to_disk
+    from vector_database.src.utils import load_config
+
+    config = load_config(args.config)
+    notebook_config = config["document_processing"]["chunking"].get("notebook")
+    stages: dict = {}
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp:
+        root = Path(tmp) / "docs"
+        num_files, corpus_bytes = generate_corpus(root, scale, args)
+        notebooks = sorted(root.rglob("*.ipynb"))
+
+        with measure(stages, "load_documents") as stats:
+            documents = load_documents(
+                str(root), ignore_files=[], notebook_config=notebook_config
+            )
+            stats["files"] = num_files
+            stats["bytes"] = corpus_bytes
+
+        with measure(stages, "ipynb_to_markdown_string") as stats:
+            for path in notebooks:
+                ipynb_to_markdown_string(path, notebook_config)
+            stats["files"] = len(notebooks)
+            stats["bytes"] = sum(path.stat().st_size for path in notebooks)
+
+        with measure(stages, "chunk_documents") as stats:
+            chunks = chunk_documents(documents, config)
+            stats["files"] = num_files
+            stats["chunks"] = len(chunks)
+            stats["bytes"] = sum(len(doc.page_content.encode()) for doc in documents)
+        del documents
+
+        with measure(stages, "save_chunks_to_disk") as stats:
+            output_dir = Path(tmp) / "chunks"
+            save_chunks_to_disk(chunks, str(output_dir))
+            stats["chunks"] = len(chunks)
+            stats["bytes"] = (output_dir / "chunked_docs.json").stat().st_size
+
+        embeddings = FakeEmbeddings(
+            size=args.embedding_size, latency=args.embedding_latency_ms / 1000
+        )
+        with measure(stages, "embed") as stats:
+            for start in range(0, len(chunks), args.batch_size):
+                batch = chunks[start : start + args.batch_size]
+                embeddings.embed_documents([chunk.page_content for chunk in batch])
+            stats["chunks"] = len(chunks)
+            stats["bytes"] = sum(len(chunk.page_content.encode()) for chunk in chunks)
+
+    return {
+        "scale": scale,
+        "files": num_files,
+        "corpus_mb": corpus_bytes / 2**20,
+        "stages": stages,
+    }
+
+
+def compare(results: list[dict], previous_path: str) -> None:
+    """Print the change of the throughput and peak RSS of every stage."""
+    with open(previous_path) as f:
+        previous = {run["scale"]: run for run in json.load(f)["results"]}
+    print(f"\nChanges since {previous_path}:")
+    for run in results:
+        before = previous.get(run["scale"])
+        if before is None:
+            continue
+        for stage, stats in run["stages"].items():
+            old = before["stages"].get(stage)
+            if old is None:
+                continue
+            unit = "chunks_per_second" if "chunks" in stats else "files_per_second"
+            speed = stats[unit] / old[unit] - 1
+            rss = stats["peak_rss_mb"] - old["peak_rss_mb"]
+            print(
+                f"{run['scale']:>6g}x {stage:<26}{speed:>+9.1%} {unit}"
+                f"{rss:>+10.1f} MB peak RSS"
+            )
+
+
+def main(args: argparse.Namespace) -> None:
+    reference = Path(args.reference_dir)
+    if reference.exists():
+        # 1x is the size of the real documentation when it is available
+        args.base_markdown = len(list(reference.rglob("*.md")))
+        args.base_notebooks = len(list(reference.rglob("*.ipynb")))
+    print(
+        f"1x = {args.base_markdown} Markdown pages and {args.base_notebooks} "
+        f"notebooks, embedding latency {args.embedding_latency_ms} ms per batch"
+    )
+    print(
+        f"{'scale':>6} {'stage':<26}{'files/s':>10}{'MB/s':>9}{'chunks/s':>11}"
+        f"{'seconds':>9}{'peak RSS MB':>13}"
+    )
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for scale in args.scales:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            run = executor.submit(run_scale, scale, args).result()
+        results.append(run)
+        for stage, stats in run["stages"].items():
+            files = stats.get("files_per_second")
+            chunks = stats.get("chunks_per_second")
+            print(
+                f"{scale:>5g}x {stage:<26}"
+                f"{'-' if files is None else f'{files:.0f}':>10}"
+                f"{stats['mb_per_second']:>9.1f}"
+                f"{'-' if chunks is None else f'{chunks:.0f}':>11}"
+                f"{stats['seconds']:>9.2f}{stats['peak_rss_mb']:>13.1f}"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "settings": vars(args),
+                "environment": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10, 100])
+    parser.add_argument(
+        "--reference-dir",
+        default="langgraph_repo/docs/docs",
+        help="Real documentation defining the 1x corpus, when it exists",
+    )
+    parser.add_argument(
+        "--base-markdown",
+        type=int,
+        default=250,
+        help="Markdown pages at 1x, without the reference documentation",
+    )
+    parser.add_argument(
+        "--base-notebooks",
+        type=int,
+        default=150,
+        help="Notebooks at 1x, without the reference documentation",
+    )
+    parser.add_argument(
+        "--output-kb",
+        type=int,
+        default=32,
+        help="Average size of the large notebook outputs",
+    )
+    parser.add_argument("--depth", type=int, default=6, help="Maximum tree depth")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--embedding-size", type=int, default=1024)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0)
+    parser.add_argument("--tmp-dir", help="Where the corpora are generated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="ingest_benchmark.json")
+    parser.add_argument("--compare", help="Results of a previous run")
+    main(parser.parse_args())
@@ -0,0 +1,265 @@
+"""Load test `RAGPipeline` offline with the scripted `FakeChatModel` and
+`FakeEmbeddings`, comparing `MemorySaver` with the Postgres checkpointers.
+
+Many conversations are driven concurrently through `chat` (one thread per
+conversation) or `achat` (one task per conversation), so only the overhead of
+the graph, the trimming, the retrieval and the checkpointing is measured on
+top of the simulated model latency. Every checkpointer runs in a fresh
+process to report its own peak memory.
+
+Usage:
+    python -m benchmarks.load_test --mode async --db-uri "$POSTGRES_DB_URI"
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import AsyncExitStack, ExitStack
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.vectorstores import InMemoryVectorStore
+from langgraph.checkpoint.memory import MemorySaver
+from psycopg_pool import ConnectionPool
+
+from prompts.registry import PromptRegistry
+from rag_pipeline.core import RAGPipeline
+from rag_pipeline.fakes import FakeChatModel, FakeEmbeddings
+from rag_pipeline.instrumentation import RAGInstrumentation
+from rag_pipeline.checkpointers import (
+    POOL_CONNECTION_KWARGS,
+    AsyncPostgresSaverCustom,
+    PostgresSaverCustom,
+)
+
+
+def build_vectorstore(
+    num_docs: int, chunk_size: int, embeddings: FakeEmbeddings
+) -> InMemoryVectorStore:
+    """Build an in-memory vector store with `num_docs` synthetic chunks."""
+    vectorstore = InMemoryVectorStore(embeddings)
+    vectorstore.add_documents(
+        [
+            Document(
+                id=f"chunk-{i}",
+                page_content=f"chunk {i} " + "x" * chunk_size,
+                metadata={"source": f"docs/source_docs/page_{i % 100}.md"},
+            )
+            for i in range(num_docs)
+        ]
+    )
+    return vectorstore
+
+
+def build_pipeline(
+    checkpointer, args: argparse.Namespace, instrumentation: RAGInstrumentation
+) -> RAGPipeline:
+    """Build the pipeline with the real prompts and the fake providers."""
+    registry = PromptRegistry()
+
+    embeddings = FakeEmbeddings(
+        size=args.embedding_size, latency=args.embedding_latency_ms / 1000
+    )
+    llm = FakeChatModel(
+        latency=args.llm_latency_ms / 1000,
+        retrievals_per_turn=args.retrievals_per_turn,
+    )
+    return RAGPipeline(
+        vectorstore=build_vectorstore(args.num_docs, args.chunk_size, embeddings),
+        checkpoint=checkpointer,
+        topic_guard_prompt=registry.get("topic_guard").text,
+        rag_system_prompt=registry.get("rag_system_prompt").text,
+        llm=llm,
+        instrumentation=instrumentation,
+    )
+
+
+def run_sync(rag: RAGPipeline, conversations: int, turns: int) -> list[float]:
+    """Run the conversations with `chat`, one thread per conversation.
+
+    Returns:
+        list[float]: The latency (in seconds) of every turn.
+    """
+    run_id = uuid.uuid4().hex[:8]
+
+    def conversation(i: int) -> list[float]:
+        config = {"configurable": {"thread_id": f"load-{run_id}-{i}"}}
+        latencies = []
+        for turn in range(turns):
+            start = time.perf_counter()
+            rag.chat(f"How do I use checkpointers? ({i}, {turn})", config=config)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=conversations) as executor:
+        results = executor.map(conversation, range(conversations))
+        return [latency for latencies in results for latency in latencies]
+
+
+async def run_async(rag: RAGPipeline, conversations: int, turns: int) -> list[float]:
+    """Run the conversations with `achat`, one task per conversation.
+
+    Returns:
+        list[float]: The latency (in seconds) of every turn.
+    """
+    run_id = uuid.uuid4().hex[:8]
+
+    async def conversation(i: int) -> list[float]:
+        config = {"configurable": {"thread_id": f"load-{run_id}-{i}"}}
+        latencies = []
+        for turn in range(turns):
+            start = time.perf_counter()
+            await rag.achat(f"How do I use checkpointers? ({i}, {turn})", config=config)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    results = await asyncio.gather(*(conversation(i) for i in range(conversations)))
+    return [latency for latencies in results for latency in latencies]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if os.uname().sysname == "Darwin" else 1)
+
+
+def _summary(
+    checkpointer: str,
+    latencies: list[float],
+    elapsed: float,
+    rss_before: float,
+    instrumentation: RAGInstrumentation,
+    searches: int,
+) -> dict:
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "checkpointer": checkpointer,
+        "turns": len(latencies),
+        # the retrievals that reached the vector store, memoized queries excluded
+        "searches_per_turn": searches / len(latencies),
+        "turns_per_second": len(latencies) / elapsed,
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_growth_mb": _peak_rss_mb() - rss_before,
+        "cached_token_ratio": instrumentation.cached_token_ratio(),
+    }
+
+
+def run_checkpointer(checkpointer: str, args: argparse.Namespace) -> dict:
+    """Load test the pipeline with `checkpointer` ("memory" or "postgres").
+
+    It is run in a child process, so the peak memory only includes this run.
+    """
+    if args.mode == "async":
+        return asyncio.run(_arun_checkpointer(checkpointer, args))
+
+    with ExitStack() as stack:
+        if checkpointer == "memory":
+            saver = MemorySaver()
+        else:
+            pool = stack.enter_context(
+                ConnectionPool(
+                    conninfo=args.db_uri,
+                    max_size=args.conversations,
+                    kwargs=POOL_CONNECTION_KWARGS,
+                )
+            )
+            saver = PostgresSaverCustom(pool)
+            saver.setup()
+        instrumentation = RAGInstrumentation()
+        rag = build_pipeline(saver, args, instrumentation)
+        run_sync(rag, 1, 1)  # warm-up
+        rss_before = _peak_rss_mb()
+        searches = rag.retrieval_batcher.searches
+        start = time.perf_counter()
+        latencies = run_sync(rag, args.conversations, args.turns)
+        elapsed = time.perf_counter() - start
+        searches = rag.retrieval_batcher.searches - searches
+    return _summary(
+        checkpointer, latencies, elapsed, rss_before, instrumentation, searches
+    )
+
+
+async def _arun_checkpointer(checkpointer: str, args: argparse.Namespace) -> dict:
+    async with AsyncExitStack() as stack:
+        if checkpointer == "memory":
+            saver = MemorySaver()
+        else:
+            saver = await stack.enter_async_context(
+                AsyncPostgresSaverCustom.from_conn_string(
+                    args.db_uri, max_size=args.conversations
+                )
+            )
+            await saver.setup()
+        instrumentation = RAGInstrumentation()
+        rag = build_pipeline(saver, args, instrumentation)
+        await run_async(rag, 1, 1)  # warm-up
+        rss_before = _peak_rss_mb()
+        searches = rag.retrieval_batcher.searches
+        start = time.perf_counter()
+        latencies = await run_async(rag, args.conversations, args.turns)
+        elapsed = time.perf_counter() - start
+        searches = rag.retrieval_batcher.searches - searches
+    return _summary(
+        checkpointer, latencies, elapsed, rss_before, instrumentation, searches
+    )
+
+
+def main(args: argparse.Namespace) -> None:
+    checkpointers = ["memory"] + (["postgres"] if args.db_uri else [])
+    print(
+        f"{args.conversations} conversations x {args.turns} turns with `"
+        f"{'achat' if args.mode == 'async' else 'chat'}`, "
+        f"{args.retrievals_per_turn} retrievals per turn, simulated latency "
+        f"{args.llm_latency_ms} ms (LLM) / {args.embedding_latency_ms} ms "
+        "(embeddings)"
+    )
+    print(
+        f"{'checkpointer':<14}{'turns/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'peak RSS MB':>14}{'RSS growth MB':>16}{'cached tokens':>15}"
+        f"{'searches/turn':>15}"
+    )
+    context = multiprocessing.get_context("spawn")
+    for checkpointer in checkpointers:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_checkpointer, checkpointer, args).result()
+        print(
+            f"{result['checkpointer']:<14}{result['turns_per_second']:>10.2f}"
+            f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            f"{result['peak_rss_mb']:>14.1f}{result['rss_growth_mb']:>16.1f}"
+            f"{result['cached_token_ratio']:>15.1%}"
+            f"{result['searches_per_turn']:>15.2f}"
+        )
+        if result["searches_per_turn"] < args.retrievals_per_turn:
+            print(
+                f"Warning: only {result['searches_per_turn']:.2f} of the "
+                f"{args.retrievals_per_turn} retrievals per turn were searched, "
+                "the others were skipped as similar queries"
+            )
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--db-uri",
+        default=os.getenv("POSTGRES_DB_URI"),
+        help="Postgres database, only MemorySaver is tested without it",
+    )
+    parser.add_argument("--mode", choices=("sync", "async"), default="async")
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--retrievals-per-turn", type=int, default=1)
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--embedding-size", type=int, default=1024)
+    parser.add_argument("--num-docs", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,180 @@
+"""Benchmark the two-stage Matryoshka retrieval (`MatryoshkaIndex`): recall,
+latency and memory of the coarse search and of the rescoring, compared with
+an exact search on the full float32 vectors.
+
+The vectors are synthetic by default: their variance decreases along the
+dimensions, like Matryoshka embeddings where the first dimensions carry most
+of the information. Their well separated clusters make the coarse search much
+easier than on real embeddings, so the recall measured on them is optimistic
+and does not reflect the recall in production: use `--job-dir` to benchmark
+the embeddings of an ingest job before choosing a prefix size, a precision or
+a number of candidates. The queries are perturbed copies of random vectors of
+the index, and the exact top-k on the full vectors is the ground truth.
+
+Usage:
+    python -m benchmarks.matryoshka_benchmark --num-vectors 50000 --output matryoshka.json
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from vector_database.src.matryoshka import PRECISIONS, MatryoshkaIndex
+
+
+def synthetic_vectors(
+    num_vectors: int, dimension: int, num_clusters: int, seed: int
+) -> np.ndarray:
+    """Clustered vectors whose variance decreases along the dimensions."""
+    rng = np.random.default_rng(seed)
+    scales = (1 + np.arange(dimension) / 64) ** -1
+    centers = rng.standard_normal((num_clusters, dimension)) * scales
+    labels = rng.integers(num_clusters, size=num_vectors)
+    noise = rng.standard_normal((num_vectors, dimension)) * scales
+    return (centers[labels] + 0.6 * noise).astype(np.float32)
+
+
+def job_vectors(job_dir: Path) -> np.ndarray:
+    """The embeddings of a finished ingest job."""
+    from vector_database.src.ingest import iter_batches
+
+    return np.array(
+        [record["vector"] for records in iter_batches(job_dir) for record in records],
+        dtype=np.float32,
+    )
+
+
+def make_queries(
+    vectors: np.ndarray, num_queries: int, noise: float, seed: int
+) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    base = vectors[rng.integers(len(vectors), size=num_queries)]
+    scale = np.linalg.norm(base, axis=1, keepdims=True) / np.sqrt(vectors.shape[1])
+    return base + noise * scale * rng.standard_normal(base.shape).astype(np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def run(args: argparse.Namespace) -> list[dict]:
+    if args.job_dir:
+        vectors = job_vectors(args.job_dir)
+    else:
+        vectors = synthetic_vectors(
+            args.num_vectors, args.dimension, args.num_clusters, args.seed
+        )
+        print(
+            "Warning: the vectors are synthetic, their recall is optimistic. "
+            "Use --job-dir to measure the recall of real embeddings."
+        )
+    queries = make_queries(vectors, args.num_queries, args.query_noise, args.seed)
+    k = args.k
+    print(
+        f"{len(vectors)} vectors of {vectors.shape[1]} dimensions, "
+        f"{len(queries)} queries, recall@{k}"
+    )
+
+    # exact search on the full vectors held in memory
+    full = _normalize(vectors)
+    truth, latencies = [], []
+    for query in _normalize(queries):
+        start = time.perf_counter()
+        scores = full @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        latencies.append(time.perf_counter() - start)
+        truth.append(set(top))
+    results = [
+        {
+            "method": "exact float32",
+            "coarse_dim": vectors.shape[1],
+            "candidates": None,
+            "recall": 1.0,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "memory_mb": full.nbytes / 2**20,
+            "compression": 1.0,
+        }
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for precision in args.precisions:
+            for coarse_dim in args.coarse_dims:
+                directory = Path(tmp) / f"{precision}-{coarse_dim}"
+                index = MatryoshkaIndex.build(vectors, directory, coarse_dim, precision)
+                for factor in args.candidate_factors:
+                    candidates = factor * k
+                    recalls, latencies = [], []
+                    for query, expected in zip(queries, truth):
+                        start = time.perf_counter()
+                        positions, _ = index.search(query, k=k, candidates=candidates)
+                        latencies.append(time.perf_counter() - start)
+                        recalls.append(len(expected & set(positions)) / k)
+                    results.append(
+                        {
+                            "method": f"two-stage {precision}",
+                            "coarse_dim": coarse_dim,
+                            "candidates": candidates,
+                            "recall": statistics.mean(recalls),
+                            "p50_ms": statistics.median(latencies) * 1000,
+                            "memory_mb": index.memory_bytes / 2**20,
+                            "compression": full.nbytes / index.memory_bytes,
+                        }
+                    )
+                del index
+    return results
+
+
+def main(args: argparse.Namespace) -> None:
+    results = run(args)
+    print(
+        f"{'method':<20}{'dims':>6}{'candidates':>12}{'recall':>9}"
+        f"{'p50 ms':>9}{'memory MB':>11}{'smaller':>9}"
+    )
+    for result in results:
+        candidates = result["candidates"]
+        candidates = "-" if candidates is None else candidates or "none"
+        print(
+            f"{result['method']:<20}{result['coarse_dim']:>6}{candidates:>12}"
+            f"{result['recall']:>9.3f}{result['p50_ms']:>9.2f}"
+            f"{result['memory_mb']:>11.1f}{result['compression']:>8.0f}x"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            data = "job" if args.job_dir else "synthetic"
+            json.dump(
+                {"settings": vars(args), "data": data, "results": results},
+                f,
+                default=str,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--job-dir", type=Path, help="Use the embeddings of this ingest job"
+    )
+    parser.add_argument("--num-vectors", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument("--num-clusters", type=int, default=2000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--query-noise", type=float, default=1.0)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--coarse-dims", type=int, nargs="+", default=[128, 256])
+    parser.add_argument(
+        "--precisions", nargs="+", choices=PRECISIONS, default=list(PRECISIONS)
+    )
+    parser.add_argument(
+        "--candidate-factors",
+        type=int,
+        nargs="+",
+        default=[0, 4, 10, 40],
+        help="Candidates rescored, as multiples of k (0: coarse search only)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    main(parser.parse_args())
@@ -1,7 +1,9 @@
-from typing import Any, Union
-from langchain_core.prompts import PromptTemplate
+from typing import TYPE_CHECKING, Any, Union
 import yaml
 
+if TYPE_CHECKING:
+    from langchain_core.prompts import PromptTemplate
+
 
 class PromptError(Exception):
     pass
@@ -219,7 +221,7 @@ class PromptBuilder:
 
     def build_prompt_template(
         self, file_path: str, input_data: str = ""
-    ) -> PromptTemplate:
+    ) -> "PromptTemplate":
         """Builds a prompt template based on a config file.
 
         Args:
@@ -232,6 +234,9 @@ class PromptBuilder:
         Raises:
             PromptError: If an error occurs while building the prompt template.
         """
+        # langchain_core.prompts is only needed (and imported) here
+        from langchain_core.prompts import PromptTemplate
+
         prompt, input_variables = self.build_prompt(file_path, input_data)
         try:
             prompt_template = PromptTemplate.from_template(prompt)
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from pydantic import BaseModel, ConfigDict
+
+from prompts.core import PromptBuilder
+
+
+class CompiledPrompt(BaseModel):
+    """Prompt built from a YAML file, it is never modified once compiled."""
+
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    text: str
+    input_variables: tuple[str, ...]
+    # hash of the text, it only changes when the text changes
+    version: str
+    mtime: float
+
+
+class PromptRegistry:
+    """Compile the YAML prompts once and reuse the compiled text.
+
+    The text of a prompt is the same string (byte for byte) until its YAML
+    file, or the config file, is modified on disk: then it is compiled again
+    with a new version. Keeping the system prompts stable lets the provider
+    reuse the cached prefix of the requests (OpenAI prompt caching).
+    """
+
+    def __init__(
+        self,
+        prompts_dir: Union[str, Path] = "prompts",
+        config_path: Union[str, Path] = "prompts/config.yaml",
+        check_interval: float = 1.0,
+    ):
+        """Initialize the registry.
+
+        Args:
+            prompts_dir: Folder with the YAML prompts.
+            config_path: Path to the YAML config file of the `PromptBuilder`.
+            check_interval: Minimum seconds between two checks of the
+                modification time of a prompt, 0 checks on every access.
+        """
+        self.prompts_dir = Path(prompts_dir)
+        self.config_path = Path(config_path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._prompts: dict[str, CompiledPrompt] = {}
+        self._last_check: dict[str, float] = {}
+        self._builder: Optional[PromptBuilder] = None
+        self._config_mtime: Optional[float] = None
+
+    def _path(self, name: str) -> Path:
+        return self.prompts_dir / f"{name}.yml"
+
+    def _get_builder(self) -> tuple[PromptBuilder, float]:
+        """Return the builder, reloading the config file when modified."""
+        config_mtime = os.stat(self.config_path).st_mtime
+        if self._builder is None or config_mtime != self._config_mtime:
+            self._builder = PromptBuilder(config_path=str(self.config_path))
+            self._config_mtime = config_mtime
+        return self._builder, config_mtime
+
+    def get(self, name: str) -> CompiledPrompt:
+        """Return the compiled prompt `name` (file `<prompts_dir>/<name>.yml`).
+
+        Args:
+            name: Name of the prompt.
+
+        Returns:
+            The compiled prompt, compiled again when the files were modified.
+        """
+        now = time.monotonic()
+        prompt = self._prompts.get(name)
+        if prompt is not None and now - self._last_check[name] < self.check_interval:
+            return prompt
+
+        with self._lock:
+            self._last_check[name] = now
+            builder, config_mtime = self._get_builder()
+            path = self._path(name)
+            # the prompt also depends on the config (reasoning strategies)
+            mtime = max(os.stat(path).st_mtime, config_mtime)
+            prompt = self._prompts.get(name)
+            if prompt is not None and prompt.mtime == mtime:
+                return prompt
+
+            text, input_variables = builder.build_prompt(str(path))
+            prompt = CompiledPrompt(
+                name=name,
+                text=text,
+                input_variables=tuple(input_variables),
+                version=hashlib.sha256(text.encode()).hexdigest()[:12],
+                mtime=mtime,
+            )
+            if name in self._prompts and self._prompts[name].version != prompt.version:
+                print(f"Prompt '{name}' reloaded, version {prompt.version}")
+            self._prompts[name] = prompt
+            return prompt
+
+    def loader(self, name: str) -> Callable[[], str]:
+        """Return a function returning the current text of the prompt `name`,
+        to pass it to `RAGPipeline` with hot reload."""
+        return lambda: self.get(name).text
@@ -0,0 +1,134 @@
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from langchain_core.documents import Document
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.rate_limiters import BaseRateLimiter
+    from langchain_core.vectorstores import VectorStore
+
+
+class ChatResult(BaseModel):
+    """Outcome of one question of `RAGPipeline.chat_many`."""
+
+    index: int
+    thread_id: str
+    question: str
+    answer: Optional[str] = None
+    references: list[str] = []
+    # the error message when the question failed, the other questions are
+    # not affected
+    error: Optional[str] = None
+
+
+class RetrievalBatcher:
+    """Groups the retrievals of concurrent conversations into a single
+    embedding request.
+
+    When other chats are in flight, the first query that arrives waits
+    `max_wait` seconds to collect the queries of the other conversations,
+    embeds all of them with one `embed_documents` call and then runs the
+    similarity searches by vector. A lone chat is never delayed.
+    """
+
+    def __init__(
+        self,
+        vectorstore: "VectorStore",
+        embeddings: Optional["Embeddings"] = None,
+        max_wait: float = 0.02,
+        max_batch_size: int = 64,
+        rate_limiter: Optional["BaseRateLimiter"] = None,
+    ):
+        """Initialize the batcher.
+
+        Args:
+            vectorstore: Vector store to search, its `embeddings` are used to
+                embed the queries unless `embeddings` is given.
+            embeddings: Embeddings used to embed the queries, they must produce
+                the same vectors as the ones of the vector store.
+            max_wait: Seconds to wait for the queries of other conversations.
+            max_batch_size: Maximum number of queries per embedding request.
+            rate_limiter: Rate limiter acquired before every embedding request.
+        """
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings or vectorstore.embeddings
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.rate_limiter = rate_limiter
+        self._lock = threading.Lock()
+        self._pending: list[tuple[str, int, Future]] = []
+        self._in_flight = 0
+        # number of queries searched, e.g. to check the retrievals per turn
+        self.searches = 0
+
+    @contextmanager
+    def track_request(self) -> Iterator[None]:
+        """Register a chat turn as in flight while the context is active."""
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def search(self, query: str, k: int) -> list[Document]:
+        """Return the `k` documents most similar to `query`.
+
+        Args:
+            query: Query to search.
+            k: Number of documents to return.
+
+        Returns:
+            The retrieved documents.
+        """
+        with self._lock:
+            self.searches += 1
+        embeddings = self.embeddings
+        if embeddings is None:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            return self.vectorstore.similarity_search(query=query, k=k)
+
+        future: Future = Future()
+        with self._lock:
+            self._pending.append((query, k, future))
+            # the first query of a batch is in charge of running it
+            leader = len(self._pending) == 1
+            wait = self._in_flight > 1
+
+        if leader:
+            if wait:
+                time.sleep(self.max_wait)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            self._run(batch, embeddings)
+        return future.result()
+
+    def _run(self, batch: list[tuple[str, int, Future]], embeddings) -> None:
+        """Embed the queries of the batch and resolve their futures."""
+        queries = list(dict.fromkeys(query for query, _, _ in batch))
+        vectors = {}
+        try:
+            for start in range(0, len(queries), self.max_batch_size):
+                chunk = queries[start : start + self.max_batch_size]
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                vectors.update(zip(chunk, embeddings.embed_documents(chunk)))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for query, k, future in batch:
+            try:
+                future.set_result(
+                    self.vectorstore.similarity_search_by_vector(vectors[query], k=k)
+                )
+            except Exception as e:
+                future.set_exception(e)
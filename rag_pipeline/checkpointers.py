@@ -0,0 +1,378 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_metadata,
+)
+from collections.abc import AsyncIterator, Sequence
+from psycopg.rows import DictRow, dict_row
+from psycopg.types.json import Jsonb
+from psycopg import AsyncCursor
+from psycopg_pool import AsyncConnectionPool
+
+
+class PostgresSaverCustom(PostgresSaver):
+    """Custom implementation of the PostgresSaver class to add async methods."""
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Asynchronously fetch a checkpoint tuple using the given configuration.
+
+        Args:
+            config (RunnableConfig): Configuration specifying which checkpoint to retrieve.
+
+        Returns:
+            Optional[CheckpointTuple]: The requested checkpoint tuple, or None if not found.
+        """
+        return self.get_tuple(config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        """Asynchronously list checkpoints that match the given criteria.
+
+        Args:
+            config (Optional[RunnableConfig]): Base configuration for filtering checkpoints.
+            filter (Optional[Dict[str, Any]]): Additional filtering criteria for metadata.
+            before (Optional[RunnableConfig]): List checkpoints created before this configuration.
+            limit (Optional[int]): Maximum number of checkpoints to return.
+
+        Returns:
+            AsyncIterator[CheckpointTuple]: Async iterator of matching checkpoint tuples.
+
+
+        """
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Asynchronously store a checkpoint with its configuration and metadata.
+
+        Args:
+            config (RunnableConfig): Configuration for the checkpoint.
+            checkpoint (Checkpoint): The checkpoint to store.
+            metadata (CheckpointMetadata): Additional metadata for the checkpoint.
+            new_versions (ChannelVersions): New channel versions as of this write.
+
+        Returns:
+            RunnableConfig: Updated configuration after storing the checkpoint.
+        """
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Asynchronously store intermediate writes linked to a checkpoint.
+
+        Args:
+            config (RunnableConfig): Configuration of the related checkpoint.
+            writes (List[Tuple[str, Any]]): List of writes to store.
+            task_id (str): Identifier for the task creating the writes.
+            task_path (str): Path of the task creating the writes.
+        """
+        return self.put_writes(config, writes, task_id, task_path)
+
+
+# `prepare_threshold=0` makes psycopg prepare every statement on its first
+# execution, the checkpointer only runs a handful of static queries so they
+# are parsed and planned once per connection
+POOL_CONNECTION_KWARGS = {
+    "autocommit": True,
+    "prepare_threshold": 0,
+    "row_factory": dict_row,
+}
+
+# the blobs and the checkpoint row of `aput` are written by a single statement
+UPSERT_CHECKPOINT_WITH_BLOBS_SQL = """
+    WITH blobs AS (
+        INSERT INTO checkpoint_blobs (thread_id, checkpoint_ns, channel, version, type, blob)
+        SELECT * FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::bytea[])
+        ON CONFLICT (thread_id, checkpoint_ns, channel, version) DO NOTHING
+    )
+    INSERT INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint, metadata)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (thread_id, checkpoint_ns, checkpoint_id)
+    DO UPDATE SET
+        checkpoint = EXCLUDED.checkpoint,
+        metadata = EXCLUDED.metadata;
+"""
+
+# the rows of every batched `aput_writes` are sent as arrays, so the statement
+# text does not depend on the batch size and is prepared only once
+_WRITES_FROM_ARRAYS = """
+    INSERT INTO checkpoint_writes (thread_id, checkpoint_ns, checkpoint_id, task_id, task_path, idx, channel, type, blob)
+    SELECT * FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::int8[], %s::text[], %s::text[], %s::bytea[])
+    ON CONFLICT (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+"""
+_UPDATE_WRITES = """
+    DO UPDATE SET
+        channel = EXCLUDED.channel,
+        type = EXCLUDED.type,
+        blob = EXCLUDED.blob;
+"""
+UPSERT_CHECKPOINT_WRITES_BATCH_SQL = _WRITES_FROM_ARRAYS + _UPDATE_WRITES
+INSERT_CHECKPOINT_WRITES_BATCH_SQL = _WRITES_FROM_ARRAYS + "DO NOTHING;"
+
+
+def _columns(rows: Sequence[tuple], width: int) -> list[list]:
+    """Transpose a list of rows into `width` column arrays for `unnest`."""
+    return [list(column) for column in zip(*rows)] if rows else [[]] * width
+
+
+class AsyncPostgresSaverCustom(AsyncPostgresSaver):
+    """Asynchronous Postgres checkpointer backed by an `AsyncConnectionPool`.
+
+    Every operation takes its own connection from the pool and awaits the
+    database instead of blocking the event loop. A checkpoint and its blobs
+    are stored by one statement, and the `aput_writes` calls that arrive in
+    the same event loop iteration (e.g. the tasks of a super-step) are
+    stored together.
+
+    The gain is the event loop lag, not the throughput: in
+    `benchmarks/checkpointer_benchmark.py` the sync shim blocks the loop for
+    up to ~260 ms against ~75 ms here, but it stores slightly more
+    conversations per second (this saver reached 0.7x to 1.0x of its rate).
+    """
+
+    def __init__(
+        self,
+        conn: AsyncConnectionPool,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> None:
+        if not isinstance(conn, AsyncConnectionPool):
+            raise TypeError(
+                f"AsyncPostgresSaverCustom requires an AsyncConnectionPool, got {type(conn)}"
+            )
+        super().__init__(conn, serde=serde)
+        self._write_batch: list[tuple[bool, list[tuple], asyncio.Future]] = []
+        self._flush_tasks: set[asyncio.Task] = set()
+        self._scheduled_flush: Optional[asyncio.Task] = None
+
+    @classmethod
+    @asynccontextmanager
+    async def from_conn_string(
+        cls,
+        conn_string: str,
+        *,
+        min_size: int = 3,
+        max_size: int = 10,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> AsyncIterator["AsyncPostgresSaverCustom"]:
+        """Create a checkpointer with its own connection pool.
+
+        Args:
+            conn_string (str): The Postgres connection info string.
+            min_size (int): Minimum number of connections kept in the pool.
+            max_size (int): Maximum number of connections in the pool.
+            serde (Optional[SerializerProtocol]): Serializer for the checkpoints.
+
+        Returns:
+            AsyncIterator[AsyncPostgresSaverCustom]: The checkpointer, the pool
+                is closed when the context manager exits.
+        """
+        async with AsyncConnectionPool(
+            conninfo=conn_string,
+            min_size=min_size,
+            max_size=max_size,
+            kwargs=POOL_CONNECTION_KWARGS,
+            open=False,
+        ) as pool:
+            yield cls(pool, serde=serde)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Asynchronously store a checkpoint with its configuration and metadata.
+
+        Args:
+            config (RunnableConfig): Configuration for the checkpoint.
+            checkpoint (Checkpoint): The checkpoint to store.
+            metadata (CheckpointMetadata): Additional metadata for the checkpoint.
+            new_versions (ChannelVersions): New channel versions as of this write.
+
+        Returns:
+            RunnableConfig: Updated configuration after storing the checkpoint.
+        """
+        configurable = config["configurable"].copy()
+        thread_id = configurable.pop("thread_id")
+        checkpoint_ns = configurable.pop("checkpoint_ns")
+        checkpoint_id = configurable.pop(
+            "checkpoint_id", configurable.pop("thread_ts", None)
+        )
+
+        copy = checkpoint.copy()
+        blobs = self._dump_blobs(
+            thread_id,
+            checkpoint_ns,
+            copy.pop("channel_values"),  # type: ignore[misc]
+            new_versions,
+        )
+        async with self._cursor() as cur:
+            await cur.execute(
+                UPSERT_CHECKPOINT_WITH_BLOBS_SQL,
+                (
+                    *_columns(blobs, 6),
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    checkpoint_id,
+                    Jsonb(self._dump_checkpoint(copy)),
+                    self._dump_metadata(get_checkpoint_metadata(config, metadata)),
+                ),
+            )
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Asynchronously store intermediate writes linked to a checkpoint.
+
+        The writes are queued and flushed together with the writes of any
+        other task finishing in the same event loop iteration.
+
+        Args:
+            config (RunnableConfig): Configuration of the related checkpoint.
+            writes (List[Tuple[str, Any]]): List of writes to store.
+            task_id (str): Identifier for the task creating the writes.
+            task_path (str): Path of the task creating the writes.
+        """
+        upsert = all(w[0] in WRITES_IDX_MAP for w in writes)
+        rows = self._dump_writes(
+            config["configurable"]["thread_id"],
+            config["configurable"]["checkpoint_ns"],
+            config["configurable"]["checkpoint_id"],
+            task_id,
+            task_path,
+            writes,
+        )
+        done = asyncio.get_running_loop().create_future()
+        self._write_batch.append((upsert, rows, done))
+        if self._scheduled_flush is None:
+            task = asyncio.create_task(self._flush_writes())
+            self._scheduled_flush = task
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_done)
+        await done
+
+    async def _flush_writes(self) -> None:
+        """Store every queued write with at most one statement per conflict policy."""
+        batch = None
+        try:
+            # give the other tasks of the super-step the chance to queue their writes
+            await asyncio.sleep(0)
+            batch = self._take_write_batch()
+
+            # an upsert cannot touch the same row twice, the last write wins
+            upserts = {
+                (row[0], row[1], row[2], row[3], row[5]): row
+                for upsert, rows, _ in batch
+                if upsert
+                for row in rows
+            }
+            inserts = [row for upsert, rows, _ in batch if not upsert for row in rows]
+            async with self._cursor(pipeline=bool(upserts and inserts)) as cur:
+                if upserts:
+                    await cur.execute(
+                        UPSERT_CHECKPOINT_WRITES_BATCH_SQL,
+                        _columns(list(upserts.values()), 9),
+                    )
+                if inserts:
+                    await cur.execute(
+                        INSERT_CHECKPOINT_WRITES_BATCH_SQL, _columns(inserts, 9)
+                    )
+        except Exception as e:
+            for _, _, done in self._take_write_batch() if batch is None else batch:
+                if not done.done():
+                    done.set_exception(e)
+        except BaseException:
+            # e.g. the flush is cancelled, the waiters must not hang
+            for _, _, done in self._take_write_batch() if batch is None else batch:
+                if not done.done():
+                    done.cancel()
+            raise
+        else:
+            for _, _, done in batch:
+                if not done.done():
+                    done.set_result(None)
+
+    def _take_write_batch(self) -> list[tuple[bool, list[tuple], asyncio.Future]]:
+        """Remove the queued writes, the next `aput_writes` schedules a new flush."""
+        batch, self._write_batch = self._write_batch, []
+        self._scheduled_flush = None
+        return batch
+
+    def _flush_done(self, task: asyncio.Task) -> None:
+        """Forget a finished flush, cancel its writes if it never started."""
+        self._flush_tasks.discard(task)
+        # a flush cancelled before its first step never took its batch
+        if task.cancelled() and self._scheduled_flush is task:
+            for _, _, done in self._take_write_batch():
+                if not done.done():
+                    done.cancel()
+
+    @asynccontextmanager
+    async def _cursor(
+        self, *, pipeline: bool = False
+    ) -> AsyncIterator[AsyncCursor[DictRow]]:
+        """Create a database cursor on a connection taken from the pool.
+
+        Args:
+            pipeline (bool): whether to use pipeline for the DB operations
+                inside the context manager. Falls back to a transaction when
+                pipeline mode is not supported.
+        """
+        # a pooled connection is owned by a single coroutine until it is
+        # returned, so unlike the parent class there is no need for a lock
+        async with self.conn.connection() as conn:
+            if pipeline and self.supports_pipeline:
+                async with (
+                    conn.pipeline(),
+                    conn.cursor(binary=True, row_factory=dict_row) as cur,
+                ):
+                    yield cur
+            elif pipeline:
+                async with (
+                    conn.transaction(),
+                    conn.cursor(binary=True, row_factory=dict_row) as cur,
+                ):
+                    yield cur
+            else:
+                async with conn.cursor(binary=True, row_factory=dict_row) as cur:
+                    yield cur
@@ -1,56 +1,101 @@
+import asyncio
+import hashlib
 import os
-from typing import Annotated
-from langchain_core.tools import StructuredTool
-from langchain_core.vectorstores import VectorStore
-from langchain_openai import ChatOpenAI
+import queue
+import threading
+from collections.abc import AsyncIterator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from typing import TYPE_CHECKING, Annotated, Callable, Optional, Union
+from langchain_core.documents import Document
 from pydantic import Field
-from langchain_core.messages import (
-    SystemMessage,
-    ToolMessage,
-    trim_messages,
-)
-
-from langgraph.checkpoint.base import BaseCheckpointSaver
-
-from rag_pipeline.utils import limit_calls
-from langchain_core.tools.base import InjectedToolCallId
-from langgraph.graph import END, START, StateGraph
-from langgraph.graph.state import CompiledStateGraph
-from langgraph.prebuilt import InjectedState, ToolNode, tools_condition
-from langgraph.types import Command
+from langchain_core.messages import SystemMessage, ToolMessage
+
+from rag_pipeline.batching import ChatResult, RetrievalBatcher
+from rag_pipeline.instrumentation import TURN_RUN_NAME, RAGInstrumentation
+from rag_pipeline.utils import LRUCache, limit_calls, query_similarity, query_terms
 from pydantic import BaseModel
 from langchain_core.messages import AIMessage
-from langgraph.graph.message import add_messages
 from typing import Literal, TypedDict
 from operator import add
 
+# langgraph, langchain_openai and the runnables of langchain_core take seconds
+# to import, they are imported when the pipeline is built
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.rate_limiters import BaseRateLimiter
+    from langchain_core.tools import StructuredTool
+    from langgraph.checkpoint.base import BaseCheckpointSaver
+    from langchain_core.vectorstores import VectorStore
+    from langgraph.graph.state import CompiledStateGraph
+
+
+@cache
+def _retieve_schema() -> type[BaseModel]:
+    """Build `RetieveSchema`, the arguments of the retrieval tool. Its
+    injected argument markers import langgraph and the callbacks of
+    langchain_core, so it is only built when first used."""
+    from langchain_core.tools.base import InjectedToolCallId
+    from langgraph.prebuilt import InjectedState
+
+    class RetieveSchema(BaseModel):
+        query: str = Field(description="query to execute")
+        state: Annotated[dict, InjectedState]
+        tool_call_id: Annotated[str, InjectedToolCallId]
+
+    RetieveSchema.__qualname__ = "RetieveSchema"
+    return RetieveSchema
 
-class RetieveSchema(BaseModel):
-    query: str = Field(description="query to execute")
-    state: Annotated[dict, InjectedState]
-    tool_call_id: Annotated[str, InjectedToolCallId]
+
+def __getattr__(name: str):
+    if name == "RetieveSchema":
+        return _retieve_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class RAGPipeline:
     def __init__(
         self,
-        vectorstore: VectorStore,
-        checkpoint: BaseCheckpointSaver,
-        topic_guard_prompt: str,
-        rag_system_prompt: str,
+        vectorstore: "VectorStore",
+        checkpoint: "BaseCheckpointSaver",
+        topic_guard_prompt: Union[str, Callable[[], str]],
+        rag_system_prompt: Union[str, Callable[[], str]],
         llm_temperature: float = 0.1,
         llm_model_name: str = "gpt-4o-mini",
         num_history_messages: int = 5,
         num_retrieval_chunks: int = 3,
+        similar_query_threshold: float = 0.8,
+        compact_tool_messages: bool = True,
+        rate_limiter: Optional["BaseRateLimiter"] = None,
+        instrumentation: Optional[RAGInstrumentation] = None,
+        llm: Optional["BaseChatModel"] = None,
+        embeddings: Optional["Embeddings"] = None,
     ):
-        assert os.getenv(
-            "OPENAI_API_KEY"
-        ), "OPENAI_API_KEY not found in environment variables"
+        if llm is None:
+            assert os.getenv(
+                "OPENAI_API_KEY"
+            ), "OPENAI_API_KEY not found in environment variables"
+
+            # the same rate limiter is shared by the LLM and the embedding
+            # requests
+            from langchain_openai import ChatOpenAI
+
+            llm = ChatOpenAI(
+                model_name=llm_model_name,
+                temperature=llm_temperature,
+                rate_limiter=rate_limiter,
+            )
+        elif rate_limiter is not None:
+            if llm.rate_limiter is not None and llm.rate_limiter is not rate_limiter:
+                raise ValueError(
+                    "The injected llm already has a rate limiter, pass it as "
+                    "'rate_limiter' or remove it from the llm."
+                )
+            llm = llm.model_copy(update={"rate_limiter": rate_limiter})
+        self.llm = llm
 
-        self.llm = ChatOpenAI(
-            model_name=llm_model_name,
-            temperature=llm_temperature,
-        )
+        from langchain_core.messages import trim_messages
 
         self.trimmer = trim_messages(
             # in this case we want to keep the last messages
@@ -63,17 +108,168 @@ class RAGPipeline:
         )
 
         self.vectorstore = vectorstore
+        # the prompts can be functions returning the current prompt, e.g.
+        # `PromptRegistry.loader` to reload them when their files change
         self.topic_guard_prompt = topic_guard_prompt
         self.rag_system_prompt = rag_system_prompt
         self.llm_temperature = llm_temperature
         self.llm_model_name = llm_model_name
         self.num_history_messages = num_history_messages
         self.num_retrieval_chunks = num_retrieval_chunks
+        # queries of the same turn with a higher similarity of their terms
+        # are not searched again
+        self.similar_query_threshold = similar_query_threshold
+        # store only the ids of the retrieved chunks in the checkpointed
+        # tool messages, the text is restored before calling the LLM
+        self.compact_tool_messages = compact_tool_messages
+        self.chunk_cache = LRUCache(maxsize=1024)
+        # id of the LLM message -> (lock, retrievals) shared by its tool calls
+        self._step_retrievals = LRUCache(maxsize=1024)
+        self._step_lock = threading.Lock()
+        # the queries are embedded with `embeddings` when given, otherwise
+        # with the embeddings of the vector store
+        self.retrieval_batcher = RetrievalBatcher(
+            vectorstore, embeddings=embeddings, rate_limiter=rate_limiter
+        )
         self.checkpoint = checkpoint
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.register_cache("chunks", self.chunk_cache)
         self.graph = self._setup_graph()
 
-    def _create_retrieval_tool(self) -> StructuredTool:
+    @staticmethod
+    def _point_id(doc: Document) -> Optional[str]:
+        """Id of the chunk in the vector store, langchain_qdrant puts it in
+        the metadata instead of `Document.id`."""
+        point_id = doc.id or doc.metadata.get("_id")
+        return None if point_id is None else str(point_id)
+
+    @classmethod
+    def _chunk_id(cls, doc: Document) -> str:
+        return cls._point_id(doc) or hashlib.md5(doc.page_content.encode()).hexdigest()
+
+    @staticmethod
+    def _turn_retrievals(messages: list) -> list[dict]:
+        """Return the artifacts of the retrievals made since the last user
+        message, with the query and the ids of the chunks returned."""
+        retrievals = []
+        for message in reversed(messages):
+            if message.type == "human":
+                break
+            if message.type == "tool" and isinstance(message.artifact, dict):
+                retrievals.append(message.artifact)
+        return retrievals
+
+    def _shared_step(
+        self, messages: list, tool_call_id: str
+    ) -> tuple[threading.Lock, list[dict]]:
+        """Return the lock and the retrievals shared by the tool calls of the
+        LLM message requesting `tool_call_id`.
+
+        The tool calls of one message run concurrently on the same state, so
+        their tool messages are not in the state of each other.
+        """
+        key = tool_call_id
+        for message in reversed(messages):
+            if message.type == "ai" and any(
+                call["id"] == tool_call_id for call in message.tool_calls
+            ):
+                key = message.id or tool_call_id
+                break
+        with self._step_lock:
+            step = self._step_retrievals.get(key)
+            if step is None:
+                step = (threading.Lock(), [])
+                self._step_retrievals.set(key, step)
+        return step
+
+    def _retrieve(
+        self, query: str, previous: list[dict], tool_call_id: str
+    ) -> tuple[ToolMessage, list[str]]:
+        """Search the chunks of `query` that are not in the `previous`
+        retrievals of the turn.
+
+        Returns:
+            tuple[ToolMessage, list[str]]: The tool message, its artifact
+                records the query and the chunk ids, and the sources of the
+                chunks.
+        """
+        terms = query_terms(query)
+        if any(
+            query_similarity(terms, query_terms(retrieval.get("query", "")))
+            >= self.similar_query_threshold
+            for retrieval in previous
+        ):
+            # the chunks of a similar query are already in the context
+            message = ToolMessage(
+                content=(
+                    "A similar query was already retrieved, its information is "
+                    "in the previous messages. Answer the user with the "
+                    "information you have retrieved."
+                ),
+                tool_call_id=tool_call_id,
+                artifact={"query": query, "chunk_ids": []},
+            )
+            return message, []
+
+        seen = {
+            chunk_id
+            for retrieval in previous
+            for chunk_id in retrieval.get("chunk_ids", [])
+        }
+        # search further to return `num_retrieval_chunks` new chunks
+        retrieved_docs = [
+            doc
+            for doc in self.retrieval_batcher.search(
+                query=query,
+                k=self.num_retrieval_chunks + len(seen),
+            )
+            if self._chunk_id(doc) not in seen
+        ][: self.num_retrieval_chunks]
+        chunk_ids = [self._chunk_id(doc) for doc in retrieved_docs]
+        artifact = {"query": query, "chunk_ids": chunk_ids}
+
+        if not retrieved_docs:
+            message = ToolMessage(
+                content=(
+                    "The query did not retrieve any new information. Answer "
+                    "the user with the information you have retrieved."
+                ),
+                tool_call_id=tool_call_id,
+                artifact=artifact,
+            )
+        elif self.compact_tool_messages and all(
+            self._point_id(doc) for doc in retrieved_docs
+        ):
+            for doc in retrieved_docs:
+                self.chunk_cache.set(self._point_id(doc), doc.page_content)
+            message = ToolMessage(
+                content=f"Retrieved chunks: {', '.join(chunk_ids)}",
+                tool_call_id=tool_call_id,
+                artifact={**artifact, "compacted": True},
+            )
+        else:
+            content = "\n\n".join([doc.page_content for doc in retrieved_docs])
+            message = ToolMessage(
+                content=content, tool_call_id=tool_call_id, artifact=artifact
+            )
+
+        # TODO: use the real metadata fields
+        references = list(
+            {
+                doc.metadata.get("source")
+                for doc in retrieved_docs
+                if doc.metadata.get("source")
+            }
+        )
+        return message, references
+
+    def _create_retrieval_tool(self) -> "StructuredTool":
         """Create the retrieval tool to use in the LLM"""
+        from langchain_core.tools import StructuredTool
+        from langchain_core.tools.base import InjectedToolCallId
+        from langgraph.prebuilt import InjectedState
+        from langgraph.types import Command
 
         @limit_calls(max_calls=6)
         def retrieve(
@@ -82,40 +278,83 @@ class RAGPipeline:
             tool_call_id: Annotated[str, InjectedToolCallId],
         ):
             """Retrieve information related to a query."""
-            retrieved_docs = self.vectorstore.similarity_search(
-                query=query,
-                k=self.num_retrieval_chunks,
-            )
-            content = "\n\n".join([doc.page_content for doc in retrieved_docs])
-
-            # TODO: use the real metadata fields
-            references = list(
-                {
-                    doc.metadata.get("source")
-                    for doc in retrieved_docs
-                    if doc.metadata.get("source")
-                }
-            )
-            return Command(
-                update={
-                    "references": references,
-                    "messages": [
-                        ToolMessage(content=content, tool_call_id=tool_call_id)
-                    ],
-                }
-            )
+            lock, step = self._shared_step(state["messages"], tool_call_id)
+            # the parallel calls of the same message are run one at a time, so
+            # each one skips the queries and the chunks of the others
+            with lock:
+                previous = self._turn_retrievals(state["messages"]) + step
+                message, references = self._retrieve(query, previous, tool_call_id)
+                step.append(message.artifact)
+            return Command(update={"references": references, "messages": [message]})
 
         retrieve_tool = StructuredTool(
-            description="Retrieve information related to a query.",
+            description=(
+                "Retrieve information related to a query. Only the chunks not "
+                "retrieved before for the current question are returned."
+            ),
             name="retrieve_tool",
             func=retrieve,
-            args_schema=RetieveSchema,
+            args_schema=_retieve_schema(),
         )
 
         return retrieve_tool
 
-    def _setup_graph(self) -> CompiledStateGraph:
+    def _get_chunks(self, chunk_ids: list[str]) -> list[str]:
+        """Get the text of the chunks from the cache or the vector store."""
+        missing = [
+            chunk_id for chunk_id in chunk_ids if chunk_id not in self.chunk_cache
+        ]
+        found = {}
+        if missing:
+            for doc in self.vectorstore.get_by_ids(missing):
+                found[self._point_id(doc)] = doc.page_content
+                self.chunk_cache.set(self._point_id(doc), doc.page_content)
+
+        chunks = []
+        for chunk_id in chunk_ids:
+            text = (
+                found[chunk_id] if chunk_id in found else self.chunk_cache.get(chunk_id)
+            )
+            if text is None:
+                # e.g. the chunk was removed by a new ingestion, the LLM is
+                # told instead of getting an empty context
+                print(f"Chunk {chunk_id} not found in the cache or the vector store")
+                text = f"[The chunk {chunk_id} is no longer available.]"
+            chunks.append(text)
+        return chunks
+
+    def _expand_chunk_references(self, messages: list) -> list:
+        """Replace the chunk ids stored in the tool messages by the text of
+        the chunks."""
+        expanded = []
+        for message in messages:
+            if (
+                message.type == "tool"
+                and isinstance(message.artifact, dict)
+                and message.artifact.get("compacted")
+            ):
+                content = "\n\n".join(self._get_chunks(message.artifact["chunk_ids"]))
+                message = message.model_copy(update={"content": content})
+            expanded.append(message)
+        return expanded
+
+    @staticmethod
+    def _system_message(prompt: Union[str, Callable[[], str]]) -> SystemMessage:
+        """Build the system message, the first message of every request.
+
+        The system prompt and the tool schemas are the static prefix of the
+        requests, they must stay identical between turns to be served from
+        the prompt cache of the provider.
+        """
+        return SystemMessage(content=prompt() if callable(prompt) else prompt)
+
+    def _setup_graph(self) -> "CompiledStateGraph":
         """Setup the graph for the chatbot"""
+        from langchain_core.runnables import RunnableLambda
+        from langgraph.graph import END, START, StateGraph
+        from langgraph.graph.message import add_messages
+        from langgraph.prebuilt import ToolNode, tools_condition
+        from langgraph.types import Command
 
         tools = [
             self._create_retrieval_tool(),
@@ -131,20 +370,19 @@ class RAGPipeline:
 
         graph_builder = StateGraph(State)
 
-        def topic_guard(state: State) -> Command[Literal["LLM_with_retriever", END]]:
-            """Entry point of the workflow in charge of checking if the topic
-            is related to the content and cleaning the tool messages and
-            references used previously.
-            """
+        class TopicGuardOutput(BaseModel):
+            related_topic: bool = Field(
+                description="when the topic is related to the content"
+            )
+            answer: str | None = Field(
+                description="The polite answer to the user when the topic is not related to the content or a comment about why the topic is related to the content"
+            )
 
-            class TopicGuardOutput(BaseModel):
-                related_topic: bool = Field(
-                    description="when the topic is related to the content"
-                )
-                answer: str | None = Field(
-                    description="The polite answer to the user when the topic is not related to the content or a comment about why the topic is related to the content"
-                )
+        guard_model = self.llm.with_structured_output(TopicGuardOutput)
 
+        def prepare_topic_guard(state: State) -> list:
+            """Clean the tool messages and references used previously and
+            build the input of the topic guard."""
             state["references"].clear()  # reset references
             state["num_calls"].clear()  # reset num_calls
 
@@ -160,13 +398,11 @@ class RAGPipeline:
             state["messages"].extend(conversation_messages)
 
             trimmed_messages = self.trimmer.invoke(state["messages"])
+            return [self._system_message(self.topic_guard_prompt)] + trimmed_messages
 
-            output: TopicGuardOutput = self.llm.with_structured_output(
-                TopicGuardOutput
-            ).invoke(
-                [SystemMessage(content=self.topic_guard_prompt)] + trimmed_messages
-            )
-
+        def route_topic(
+            output: TopicGuardOutput,
+        ) -> Command[Literal["LLM_with_retriever", END]]:
             if output.related_topic:
                 return Command(
                     goto="LLM_with_retriever",
@@ -181,7 +417,20 @@ class RAGPipeline:
                     },
                 )
 
-        def llm_with_retriever(state: State):
+        def topic_guard(state: State) -> Command[Literal["LLM_with_retriever", END]]:
+            """Entry point of the workflow in charge of checking if the topic
+            is related to the content and cleaning the tool messages and
+            references used previously.
+            """
+            return route_topic(guard_model.invoke(prepare_topic_guard(state)))
+
+        async def atopic_guard(
+            state: State,
+        ) -> Command[Literal["LLM_with_retriever", END]]:
+            """Async version of `topic_guard`."""
+            return route_topic(await guard_model.ainvoke(prepare_topic_guard(state)))
+
+        def prepare_llm_with_retriever(state: State) -> list:
             # find the last message of type human
             last_human_message = 0
             for i, message in enumerate(state["messages"]):
@@ -194,18 +443,36 @@ class RAGPipeline:
             )
 
             # add the tool messages used previously
-            trimmed_messages.extend(state["messages"][last_human_message:])
+            trimmed_messages.extend(
+                self._expand_chunk_references(state["messages"][last_human_message:])
+            )
+            return [
+                self._system_message(self.rag_system_prompt)
+            ] + trimmed_messages  # conversation messages
+
+        def llm_with_retriever(state: State):
+            return {
+                "messages": [model_with_tools.invoke(prepare_llm_with_retriever(state))]
+            }
+
+        async def allm_with_retriever(state: State):
             return {
                 "messages": [
-                    model_with_tools.invoke(
-                        [SystemMessage(content=self.rag_system_prompt)]
-                        + trimmed_messages  # conversation messages
-                    )
+                    await model_with_tools.ainvoke(prepare_llm_with_retriever(state))
                 ]
             }
 
-        graph_builder.add_node("Topic_guard", topic_guard)
-        graph_builder.add_node("LLM_with_retriever", llm_with_retriever)
+        # the async versions are used by `ainvoke`, so the LLM requests of
+        # concurrent conversations do not hold a thread each
+        graph_builder.add_node(
+            "Topic_guard",
+            RunnableLambda(topic_guard, afunc=atopic_guard),
+            destinations=("LLM_with_retriever", END),
+        )
+        graph_builder.add_node(
+            "LLM_with_retriever",
+            RunnableLambda(llm_with_retriever, afunc=allm_with_retriever),
+        )
 
         tool_node = ToolNode(tools=tools, name="DB_retriever")
         graph_builder.add_node("DB_retriever", tool_node)
@@ -223,9 +490,130 @@ class RAGPipeline:
 
         return graph
 
+    def _run_config(self, config: dict) -> dict:
+        """Add the instrumentation to the callbacks of a graph invocation and
+        name the run, so that it is recorded as a turn even when called from
+        another chain."""
+        if self.instrumentation is None:
+            return config
+        from langchain_core.runnables.config import merge_configs
+
+        return merge_configs(
+            config, {"callbacks": [self.instrumentation], "run_name": TURN_RUN_NAME}
+        )
+
     def chat(
         self, user_input: str, config={"configurable": {"thread_id": "1"}}
     ) -> tuple[str, list[str]]:
-        output = self.graph.invoke({"messages": [("user", user_input)]}, config)
+        with self.retrieval_batcher.track_request():
+            output = self.graph.invoke(
+                {"messages": [("user", user_input)]}, self._run_config(config)
+            )
+
+        return output["messages"][-1].content, output["references"]
+
+    async def achat(
+        self, user_input: str, config={"configurable": {"thread_id": "1"}}
+    ) -> tuple[str, list[str]]:
+        """Async version of `chat`, to be used with an async checkpointer
+        such as `AsyncPostgresSaverCustom`."""
+        with self.retrieval_batcher.track_request():
+            output = await self.graph.ainvoke(
+                {"messages": [("user", user_input)]}, self._run_config(config)
+            )
 
         return output["messages"][-1].content, output["references"]
+
+    @staticmethod
+    def _group_by_thread(
+        requests: Iterable[tuple[str, str]],
+    ) -> dict[str, list[tuple[int, str]]]:
+        """Group the (thread_id, question) pairs by thread, keeping the order
+        of the questions of every thread."""
+        threads: dict[str, list[tuple[int, str]]] = {}
+        for index, (thread_id, question) in enumerate(requests):
+            threads.setdefault(thread_id, []).append((index, question))
+        return threads
+
+    def chat_many(
+        self,
+        requests: Iterable[tuple[str, str]],
+        max_concurrency: int = 8,
+    ) -> Iterator[ChatResult]:
+        """Answer many questions concurrently.
+
+        The questions of the same thread are answered in order, one at a
+        time, while up to `max_concurrency` questions of different threads
+        run in parallel and share the embedding requests of their retrievals.
+
+        Args:
+            requests: Pairs of (thread_id, question).
+            max_concurrency: Maximum number of questions answered at once.
+
+        Returns:
+            Iterator[ChatResult]: The results in completion order, a failed
+                question yields a result with its `error` set.
+        """
+        threads = self._group_by_thread(requests)
+        results: queue.Queue[ChatResult] = queue.Queue()
+
+        stop = threading.Event()
+
+        def run_thread(thread_id: str, questions: list[tuple[int, str]]) -> None:
+            for index, question in questions:
+                if stop.is_set():
+                    return
+                result = ChatResult(index=index, thread_id=thread_id, question=question)
+                try:
+                    result.answer, result.references = self.chat(
+                        question, config={"configurable": {"thread_id": thread_id}}
+                    )
+                except Exception as e:
+                    result.error = repr(e)
+                results.put(result)
+
+        total = sum(len(questions) for questions in threads.values())
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            for thread_id, questions in threads.items():
+                executor.submit(run_thread, thread_id, questions)
+            for _ in range(total):
+                yield results.get()
+        finally:
+            # when the caller stops early, the questions not started are dropped
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def achat_many(
+        self,
+        requests: Iterable[tuple[str, str]],
+        max_concurrency: int = 8,
+    ) -> AsyncIterator[ChatResult]:
+        """Async version of `chat_many`."""
+        threads = self._group_by_thread(requests)
+        results: asyncio.Queue[ChatResult] = asyncio.Queue()
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_thread(thread_id: str, questions: list[tuple[int, str]]):
+            for index, question in questions:
+                result = ChatResult(index=index, thread_id=thread_id, question=question)
+                async with semaphore:
+                    try:
+                        result.answer, result.references = await self.achat(
+                            question, config={"configurable": {"thread_id": thread_id}}
+                        )
+                    except Exception as e:
+                        result.error = repr(e)
+                await results.put(result)
+
+        total = sum(len(questions) for questions in threads.values())
+        tasks = [
+            asyncio.create_task(run_thread(thread_id, questions))
+            for thread_id, questions in threads.items()
+        ]
+        try:
+            for _ in range(total):
+                yield await results.get()
+        finally:
+            for task in tasks:
+                task.cancel()
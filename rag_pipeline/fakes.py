@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from collections.abc import Sequence
+from typing import Any, Callable, Optional, Union
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import Runnable
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that follows a script instead of calling an API, to run
+    the RAG graph offline (load tests, benchmarks, CI).
+
+    For every question it calls `retrieve_tool` `retrievals_per_turn` times,
+    first with the question and then with the `follow_up_queries`, and then
+    answers with `answer`. The follow-up queries share no words with each
+    other, so they are not skipped as similar queries by the pipeline. Structured outputs (e.g. the topic
+    guard) are filled with `structured_output`. Every request waits
+    `latency` seconds, with `time.sleep` or `asyncio.sleep`.
+
+    Like the OpenAI prompt caching, the static prefix of a request (tools
+    and system prompt) is reported as cached tokens when it has at least 1024
+    tokens and was already sent.
+    """
+
+    latency: float = 0.0
+    retrievals_per_turn: int = 1
+    follow_up_queries: list[str] = [
+        "configuration options and parameters",
+        "code example",
+        "common errors when troubleshooting",
+        "performance limits",
+        "related concepts or alternatives",
+    ]
+    answer: str = "This is a scripted answer based on the retrieved documents."
+    structured_output: dict[str, Any] = {
+        "related_topic": True,
+        "answer": "The question is about LangGraph.",
+    }
+
+    _prefixes: set[str] = PrivateAttr(default_factory=set)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(
+        self,
+        tools: Sequence[Union[dict[str, Any], type, Callable, BaseTool]],
+        *,
+        tool_choice: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Runnable[LanguageModelInput, BaseMessage]:
+        formatted_tools = [convert_to_openai_tool(tool) for tool in tools]
+        return self.bind(tools=formatted_tools, tool_choice=tool_choice, **kwargs)
+
+    def _respond(
+        self, messages: list[BaseMessage], tools: Optional[list[dict]] = None
+    ) -> ChatResult:
+        """Build the scripted response to `messages`."""
+        tool_names = [tool["function"]["name"] for tool in tools or []]
+
+        # messages of the current turn
+        turn_start = 0
+        for i, message in enumerate(messages):
+            if message.type == "human":
+                turn_start = i
+        question = str(messages[turn_start].content) if messages else ""
+        retrievals = sum(message.type == "tool" for message in messages[turn_start:])
+
+        if tool_names and "retrieve_tool" not in tool_names:
+            # structured output
+            message = AIMessage(
+                content="",
+                tool_calls=[
+                    {
+                        "name": tool_names[0],
+                        "args": dict(self.structured_output),
+                        "id": f"call_{uuid.uuid4().hex}",
+                    }
+                ],
+            )
+        elif "retrieve_tool" in tool_names and retrievals < self.retrievals_per_turn:
+            query = (
+                self.follow_up_queries[(retrievals - 1) % len(self.follow_up_queries)]
+                if retrievals
+                else question
+            )
+            message = AIMessage(
+                content="",
+                tool_calls=[
+                    {
+                        "name": "retrieve_tool",
+                        "args": {"query": query},
+                        "id": f"call_{uuid.uuid4().hex}",
+                    }
+                ],
+            )
+        else:
+            message = AIMessage(content=self.answer)
+
+        # rough estimation of 4 characters per token
+        prefix, history = json.dumps(tools or []), messages
+        if messages and messages[0].type == "system":
+            prefix, history = prefix + str(messages[0].content), messages[1:]
+        prefix_tokens = len(prefix) // 4
+        input_tokens = prefix_tokens + sum(len(str(m.content)) for m in history) // 4
+        output_tokens = len(str(message.content)) // 4 + 10 * len(message.tool_calls)
+        prefix_hash = hashlib.sha256(prefix.encode()).hexdigest()
+        cached_tokens = prefix_tokens if prefix_hash in self._prefixes else 0
+        if prefix_tokens >= 1024:
+            self._prefixes.add(prefix_hash)
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "input_token_details": {"cache_read": cached_tokens},
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        return self._respond(messages, kwargs.get("tools"))
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._respond(messages, kwargs.get("tools"))
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic embeddings (the same text always gets the same vector)
+    that wait `latency` seconds per request, to replace the embedding API."""
+
+    latency: float = 0.0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency)
+        return super().embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.latency)
+        return super().embed_query(text)
@@ -0,0 +1,383 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from typing import Any, Callable, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from rag_pipeline.utils import LRUCache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 7, 10)
+
+# run name given to the graph invocations of `RAGPipeline`, it marks the root
+# run of a turn even when the pipeline is called inside another chain
+TURN_RUN_NAME = "rag_turn"
+
+# name: (type, help, buckets)
+METRICS = {
+    "rag_turn_duration_seconds": (
+        "histogram",
+        "Duration of a chat turn.",
+        LATENCY_BUCKETS,
+    ),
+    "rag_node_duration_seconds": (
+        "histogram",
+        "Duration of the graph nodes.",
+        LATENCY_BUCKETS,
+    ),
+    "rag_llm_duration_seconds": (
+        "histogram",
+        "Duration of the LLM requests.",
+        LATENCY_BUCKETS,
+    ),
+    "rag_tool_duration_seconds": (
+        "histogram",
+        "Duration of the tool calls (retrievals).",
+        LATENCY_BUCKETS,
+    ),
+    "rag_retrieval_loops": (
+        "histogram",
+        "Number of retrieval tool calls per turn.",
+        COUNT_BUCKETS,
+    ),
+    "rag_llm_tokens_total": ("counter", "Tokens used by the LLM requests.", None),
+    "rag_llm_cached_token_ratio": (
+        "gauge",
+        "Share of the input tokens served from the provider prompt cache.",
+        None,
+    ),
+    "rag_tool_calls_total": ("counter", "Tool calls requested by the LLM.", None),
+    "rag_errors_total": ("counter", "Failed turns, nodes, LLM and tool runs.", None),
+    "rag_cache_requests_total": ("counter", "Lookups of the pipeline caches.", None),
+}
+
+
+class Histogram:
+    """Fixed-bucket histogram, `observe` is a bisect and two additions."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape_label(value: str) -> str:
+    # escaping of the label values required by the text exposition format
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return (
+        "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+    )
+
+
+class RAGInstrumentation(BaseCallbackHandler):
+    """Callback handler recording the latency, token usage and tool calls of
+    every turn of the RAG graph.
+
+    It is added to the callbacks of every invocation of the graph by
+    `RAGPipeline`, which names the run `TURN_RUN_NAME` to mark the start of a
+    turn. The metrics are exported with `export_prometheus` and the
+    last turns are kept as structured trace records in `traces`.
+    """
+
+    # the handler only updates in-memory counters, so it is run in the thread
+    # of the event instead of being dispatched to an executor
+    run_inline = True
+
+    def __init__(
+        self,
+        max_traces: int = 1000,
+        on_trace: Optional[Callable[[dict[str, Any]], None]] = None,
+    ):
+        """Initialize the instrumentation.
+
+        Args:
+            max_traces: Number of trace records kept in memory.
+            on_trace: Function called with every finished trace record,
+                e.g. to write it to a log.
+        """
+        self.traces: deque[dict[str, Any]] = deque(maxlen=max_traces)
+        self.on_trace = on_trace
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple, Histogram] = {}
+        self._counters: dict[tuple, float] = defaultdict(float)
+        self._caches: dict[str, LRUCache] = {}
+        # run_id -> (root run_id, start time, label) of the runs in progress
+        self._runs: dict[UUID, tuple[UUID, float, Optional[str]]] = {}
+        self._turns: dict[UUID, dict[str, Any]] = {}
+
+    def register_cache(self, name: str, cache: LRUCache) -> None:
+        """Export the hits and misses of `cache`."""
+        self._caches[name] = cache
+
+    def _observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms.setdefault(key, Histogram(METRICS[name][2]))
+        histogram.observe(value)
+
+    def _increment(self, name: str, value: float = 1, **labels: str) -> None:
+        self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def _start(
+        self,
+        run_id: UUID,
+        parent_run_id: Optional[UUID],
+        label: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            parent = self._runs.get(parent_run_id) if parent_run_id else None
+            root = parent[0] if parent else run_id
+            self._runs[run_id] = (root, time.perf_counter(), label)
+
+    def _end(self, run_id: UUID) -> tuple[Optional[dict], float, Optional[str]]:
+        """Return the turn of the run, its duration and its label."""
+        root, start, label = self._runs.pop(run_id, (None, 0.0, None))
+        return self._turns.get(root), time.perf_counter() - start, label
+
+    def on_chain_start(
+        self,
+        serialized: dict[str, Any],
+        inputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        metadata = metadata or {}
+        if kwargs.get("name") == TURN_RUN_NAME:
+            with self._lock:
+                self._runs[run_id] = (run_id, time.perf_counter(), None)
+                self._turns[run_id] = {
+                    "run_id": str(run_id),
+                    "thread_id": metadata.get("thread_id"),
+                    "start": time.time(),
+                    "nodes": [],
+                    "llm_calls": 0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "cached_tokens": 0,
+                    "tool_calls": 0,
+                    "retrievals": [],
+                    "error": None,
+                }
+        elif parent_run_id in self._turns:
+            # a node run, its inner runnables are not labelled
+            self._start(run_id, parent_run_id, kwargs.get("name"))
+        else:
+            self._start(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_chain(run_id, error=None)
+
+    def on_chain_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._finish_chain(run_id, error=error)
+
+    def _finish_chain(self, run_id: UUID, error: Optional[BaseException]) -> None:
+        with self._lock:
+            turn, duration, node = self._end(run_id)
+            if turn is None:
+                return
+            if node is not None:
+                self._observe("rag_node_duration_seconds", duration, node=node)
+                turn["nodes"].append({"node": node, "duration_ms": duration * 1000})
+                if error is not None:
+                    self._increment("rag_errors_total", stage="node")
+            if turn["run_id"] != str(run_id):
+                return
+            # end of the turn
+            del self._turns[run_id]
+            self._observe("rag_turn_duration_seconds", duration)
+            self._observe("rag_retrieval_loops", len(turn["retrievals"]))
+            if error is not None:
+                self._increment("rag_errors_total", stage="turn")
+                turn["error"] = repr(error)
+            turn["duration_ms"] = duration * 1000
+            if turn["input_tokens"]:
+                turn["cached_token_ratio"] = (
+                    turn["cached_tokens"] / turn["input_tokens"]
+                )
+            self.traces.append(turn)
+        if self.on_trace is not None:
+            self.on_trace(turn)
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start(run_id, parent_run_id, (metadata or {}).get("langgraph_node"))
+
+    def on_llm_start(
+        self,
+        serialized: dict[str, Any],
+        prompts: list[str],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start(run_id, parent_run_id, (metadata or {}).get("langgraph_node"))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            turn, duration, node = self._end(run_id)
+            node = node or "unknown"
+            self._observe("rag_llm_duration_seconds", duration, node=node)
+            usage: dict[str, Any] = {}
+            tool_calls = 0
+            for generations in response.generations:
+                for generation in generations:
+                    message = getattr(generation, "message", None)
+                    if message is None:
+                        continue
+                    usage = getattr(message, "usage_metadata", None) or usage
+                    tool_calls += len(getattr(message, "tool_calls", []))
+            input_tokens = usage.get("input_tokens", 0)
+            output_tokens = usage.get("output_tokens", 0)
+            cached_tokens = usage.get("input_token_details", {}).get("cache_read", 0)
+            self._increment(
+                "rag_llm_tokens_total", input_tokens, node=node, type="input"
+            )
+            self._increment(
+                "rag_llm_tokens_total", output_tokens, node=node, type="output"
+            )
+            self._increment(
+                "rag_llm_tokens_total", cached_tokens, node=node, type="cached"
+            )
+            if tool_calls:
+                self._increment("rag_tool_calls_total", tool_calls, node=node)
+            if turn is not None:
+                turn["llm_calls"] += 1
+                turn["input_tokens"] += input_tokens
+                turn["output_tokens"] += output_tokens
+                turn["cached_tokens"] += cached_tokens
+                turn["tool_calls"] += tool_calls
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        with self._lock:
+            self._end(run_id)
+            self._increment("rag_errors_total", stage="llm")
+
+    def on_tool_start(
+        self,
+        serialized: dict[str, Any],
+        input_str: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start(run_id, parent_run_id, kwargs.get("name") or serialized.get("name"))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            turn, duration, tool = self._end(run_id)
+            self._observe("rag_tool_duration_seconds", duration, tool=tool or "unknown")
+            if turn is not None:
+                turn["retrievals"].append(
+                    {"tool": tool, "duration_ms": duration * 1000}
+                )
+
+    def on_tool_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        with self._lock:
+            self._end(run_id)
+            self._increment("rag_errors_total", stage="tool")
+
+    def cached_token_ratio(self, node: Optional[str] = None) -> float:
+        """Return the share of the input tokens served from the prompt cache.
+
+        Args:
+            node: Only count the LLM requests of this node, all by default.
+
+        Returns:
+            float: The cached tokens divided by the input tokens, 0 without
+                requests.
+        """
+        tokens = {"input": 0.0, "cached": 0.0}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                labels = dict(labels)
+                if name == "rag_llm_tokens_total" and (
+                    node is None or labels["node"] == node
+                ):
+                    tokens[labels["type"]] = tokens.get(labels["type"], 0) + value
+        return tokens["cached"] / tokens["input"] if tokens["input"] else 0.0
+
+    def export_prometheus(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {
+                key: (list(h.counts), h.sum, h.count)
+                for key, h in self._histograms.items()
+            }
+            counters = dict(self._counters)
+        for name, cache in self._caches.items():
+            counters[
+                ("rag_cache_requests_total", (("cache", name), ("result", "hit")))
+            ] = cache.hits
+            counters[
+                ("rag_cache_requests_total", (("cache", name), ("result", "miss")))
+            ] = cache.misses
+
+        gauges = {}
+        for metric, labels in counters:
+            labels = dict(labels)
+            if metric == "rag_llm_tokens_total" and labels["type"] == "input":
+                gauges[("rag_llm_cached_token_ratio", (("node", labels["node"]),))] = (
+                    self.cached_token_ratio(labels["node"])
+                )
+
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind in ("counter", "gauge"):
+                values = counters if kind == "counter" else gauges
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                continue
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (
+                        ("le", f"{bound:g}" if bound != "+Inf" else bound),
+                    )
+                    lines.append(
+                        f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
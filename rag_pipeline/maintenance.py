@@ -0,0 +1,353 @@
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from pydantic import BaseModel
+
+
+class CompactionReport(BaseModel):
+    """Summary of a checkpoint compaction run."""
+
+    expired_threads: int = 0
+    deleted_checkpoints: int = 0
+    deleted_writes: int = 0
+    deleted_blobs: int = 0
+    # size of the deleted rows, Postgres only returns it to the operating
+    # system after a VACUUM FULL, a plain VACUUM makes it reusable
+    deleted_bytes: int = 0
+    # measured on-disk size of the checkpoint tables, only reported by Postgres
+    size_before: Optional[int] = None
+    size_after: Optional[int] = None
+
+    def __str__(self) -> str:
+        lines = [
+            f"Expired threads:     {self.expired_threads}",
+            f"Deleted checkpoints: {self.deleted_checkpoints}",
+            f"Deleted writes:      {self.deleted_writes}",
+            f"Deleted blobs:       {self.deleted_blobs}",
+            f"Deleted rows size:   {self.deleted_bytes / 1024:.1f} KiB",
+        ]
+        if self.size_before is not None and self.size_after is not None:
+            lines.append(
+                f"Tables size:         {self.size_before / 1024:.1f} KiB -> "
+                f"{self.size_after / 1024:.1f} KiB"
+            )
+        return "\n".join(lines)
+
+
+# every statement returns the number of deleted rows and their size in bytes
+EXPIRE_THREADS_SQL = """
+    WITH idle AS (
+        SELECT thread_id FROM checkpoints
+        GROUP BY thread_id
+        HAVING max((checkpoint->>'ts')::timestamptz) < now() - %s::interval
+    ), deleted_checkpoints AS (
+        DELETE FROM checkpoints c USING idle i WHERE c.thread_id = i.thread_id
+        RETURNING pg_column_size(c.*) AS size
+    ), deleted_blobs AS (
+        DELETE FROM checkpoint_blobs b USING idle i WHERE b.thread_id = i.thread_id
+        RETURNING pg_column_size(b.*) AS size
+    ), deleted_writes AS (
+        DELETE FROM checkpoint_writes w USING idle i WHERE w.thread_id = i.thread_id
+        RETURNING pg_column_size(w.*) AS size
+    )
+    SELECT
+        (SELECT count(*) FROM idle) AS threads,
+        (SELECT count(*) FROM deleted_checkpoints) AS checkpoints,
+        (SELECT count(*) FROM deleted_blobs) AS blobs,
+        (SELECT count(*) FROM deleted_writes) AS writes,
+        (SELECT coalesce(sum(size), 0) FROM deleted_checkpoints)
+        + (SELECT coalesce(sum(size), 0) FROM deleted_blobs)
+        + (SELECT coalesce(sum(size), 0) FROM deleted_writes) AS bytes
+"""
+
+PRUNE_CHECKPOINTS_SQL = """
+    WITH ranked AS (
+        SELECT thread_id, checkpoint_ns, checkpoint_id, row_number() OVER (
+            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+        ) AS position
+        FROM checkpoints
+    ), deleted AS (
+        DELETE FROM checkpoints c USING ranked r
+        WHERE c.thread_id = r.thread_id
+            AND c.checkpoint_ns = r.checkpoint_ns
+            AND c.checkpoint_id = r.checkpoint_id
+            AND r.position > %s
+        RETURNING pg_column_size(c.*) AS size
+    )
+    SELECT count(*) AS rows, coalesce(sum(size), 0) AS bytes FROM deleted
+"""
+
+DELETE_ORPHAN_WRITES_SQL = """
+    WITH deleted AS (
+        DELETE FROM checkpoint_writes w
+        WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = w.thread_id
+                AND c.checkpoint_ns = w.checkpoint_ns
+                AND c.checkpoint_id = w.checkpoint_id
+        )
+        RETURNING pg_column_size(w.*) AS size
+    )
+    SELECT count(*) AS rows, coalesce(sum(size), 0) AS bytes FROM deleted
+"""
+
+# a blob is only deleted when no checkpoint references it and a newer version
+# of the channel is referenced, so the blobs of a checkpoint being written
+# concurrently (stored before the checkpoint row) are never touched
+DELETE_ORPHAN_BLOBS_SQL = """
+    WITH deleted AS (
+        DELETE FROM checkpoint_blobs b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = b.thread_id
+                AND c.checkpoint_ns = b.checkpoint_ns
+                AND c.checkpoint->'channel_versions'->>b.channel = b.version
+        )
+        AND b.version < (
+            SELECT max(c.checkpoint->'channel_versions'->>b.channel) FROM checkpoints c
+            WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+        )
+        RETURNING pg_column_size(b.*) AS size
+    )
+    SELECT count(*) AS rows, coalesce(sum(size), 0) AS bytes FROM deleted
+"""
+
+TABLES_SIZE_SQL = """
+    SELECT pg_total_relation_size('checkpoints')
+        + pg_total_relation_size('checkpoint_blobs')
+        + pg_total_relation_size('checkpoint_writes') AS size
+"""
+
+VACUUM_SQL = "VACUUM checkpoints, checkpoint_blobs, checkpoint_writes"
+
+
+def _check_arguments(keep_last: Optional[int], ttl: Optional[timedelta]) -> None:
+    if keep_last is not None and keep_last < 1:
+        raise ValueError("'keep_last' must be at least 1.")
+    if ttl is not None and ttl <= timedelta(0):
+        raise ValueError("'ttl' must be a positive time interval.")
+
+
+def _apply_expiration(report: CompactionReport, row: dict[str, Any]) -> None:
+    report.expired_threads += row["threads"]
+    report.deleted_checkpoints += row["checkpoints"]
+    report.deleted_blobs += row["blobs"]
+    report.deleted_writes += row["writes"]
+    report.deleted_bytes += row["bytes"]
+
+
+def _compact_postgres(
+    checkpointer: PostgresSaver,
+    keep_last: Optional[int],
+    ttl: Optional[timedelta],
+    vacuum: bool,
+) -> CompactionReport:
+    report = CompactionReport()
+    with checkpointer._cursor() as cur:
+        report.size_before = cur.execute(TABLES_SIZE_SQL).fetchone()["size"]
+        # the deletions are applied all together or not at all
+        with cur.connection.transaction():
+            if ttl is not None:
+                _apply_expiration(
+                    report, cur.execute(EXPIRE_THREADS_SQL, (ttl,)).fetchone()
+                )
+            if keep_last is not None:
+                row = cur.execute(PRUNE_CHECKPOINTS_SQL, (keep_last,)).fetchone()
+                report.deleted_checkpoints += row["rows"]
+                report.deleted_bytes += row["bytes"]
+            row = cur.execute(DELETE_ORPHAN_WRITES_SQL).fetchone()
+            report.deleted_writes += row["rows"]
+            report.deleted_bytes += row["bytes"]
+            row = cur.execute(DELETE_ORPHAN_BLOBS_SQL).fetchone()
+            report.deleted_blobs += row["rows"]
+            report.deleted_bytes += row["bytes"]
+        # VACUUM cannot run inside a transaction block
+        if vacuum:
+            cur.execute(VACUUM_SQL)
+        report.size_after = cur.execute(TABLES_SIZE_SQL).fetchone()["size"]
+    return report
+
+
+async def _afetchone(cur, query: str, params: Optional[tuple] = None) -> dict:
+    await cur.execute(query, params)
+    return await cur.fetchone()
+
+
+async def _acompact_postgres(
+    checkpointer: AsyncPostgresSaver,
+    keep_last: Optional[int],
+    ttl: Optional[timedelta],
+    vacuum: bool,
+) -> CompactionReport:
+    report = CompactionReport()
+    async with checkpointer._cursor() as cur:
+        report.size_before = (await _afetchone(cur, TABLES_SIZE_SQL))["size"]
+        async with cur.connection.transaction():
+            if ttl is not None:
+                _apply_expiration(
+                    report, await _afetchone(cur, EXPIRE_THREADS_SQL, (ttl,))
+                )
+            if keep_last is not None:
+                row = await _afetchone(cur, PRUNE_CHECKPOINTS_SQL, (keep_last,))
+                report.deleted_checkpoints += row["rows"]
+                report.deleted_bytes += row["bytes"]
+            row = await _afetchone(cur, DELETE_ORPHAN_WRITES_SQL)
+            report.deleted_writes += row["rows"]
+            report.deleted_bytes += row["bytes"]
+            row = await _afetchone(cur, DELETE_ORPHAN_BLOBS_SQL)
+            report.deleted_blobs += row["rows"]
+            report.deleted_bytes += row["bytes"]
+        if vacuum:
+            await cur.execute(VACUUM_SQL)
+        report.size_after = (await _afetchone(cur, TABLES_SIZE_SQL))["size"]
+    return report
+
+
+def _typed_size(value: tuple[str, bytes]) -> int:
+    return len(value[0]) + len(value[1])
+
+
+def _compact_in_memory(
+    checkpointer: InMemorySaver,
+    keep_last: Optional[int],
+    ttl: Optional[timedelta],
+) -> CompactionReport:
+    report = CompactionReport()
+    if ttl is not None:
+        deadline = datetime.now(timezone.utc) - ttl
+        for thread_id in list(checkpointer.storage):
+            last_ts = max(
+                (
+                    checkpointer.serde.loads_typed(saved[0])["ts"]
+                    for checkpoints in checkpointer.storage[thread_id].values()
+                    for saved in checkpoints.values()
+                ),
+                default=None,
+            )
+            if last_ts is not None and datetime.fromisoformat(last_ts) < deadline:
+                for checkpoints in checkpointer.storage.pop(thread_id).values():
+                    for saved in checkpoints.values():
+                        report.deleted_checkpoints += 1
+                        report.deleted_bytes += _typed_size(saved[0])
+                        report.deleted_bytes += _typed_size(saved[1])
+                report.expired_threads += 1
+
+    if keep_last is not None:
+        for namespaces in checkpointer.storage.values():
+            for checkpoints in namespaces.values():
+                for checkpoint_id in sorted(checkpoints, reverse=True)[keep_last:]:
+                    saved = checkpoints.pop(checkpoint_id)
+                    report.deleted_checkpoints += 1
+                    report.deleted_bytes += _typed_size(saved[0])
+                    report.deleted_bytes += _typed_size(saved[1])
+
+    for key in list(checkpointer.writes):
+        thread_id, checkpoint_ns, checkpoint_id = key
+        if checkpoint_id not in checkpointer.storage.get(thread_id, {}).get(
+            checkpoint_ns, {}
+        ):
+            for write in checkpointer.writes.pop(key).values():
+                report.deleted_writes += 1
+                report.deleted_bytes += _typed_size(write[2])
+
+    referenced = set()
+    for thread_id, namespaces in checkpointer.storage.items():
+        for checkpoint_ns, checkpoints in namespaces.items():
+            for saved in checkpoints.values():
+                checkpoint = checkpointer.serde.loads_typed(saved[0])
+                for channel, version in checkpoint["channel_versions"].items():
+                    referenced.add((thread_id, checkpoint_ns, channel, version))
+    for key in list(checkpointer.blobs):
+        if key not in referenced:
+            report.deleted_blobs += 1
+            report.deleted_bytes += _typed_size(checkpointer.blobs.pop(key))
+    return report
+
+
+def compact_checkpoints(
+    checkpointer: BaseCheckpointSaver,
+    keep_last: Optional[int] = 10,
+    ttl: Optional[timedelta] = None,
+    vacuum: bool = False,
+) -> CompactionReport:
+    """Reclaim the space used by old checkpoints.
+
+    Threads idle for longer than `ttl` are deleted, only the last `keep_last`
+    checkpoints of every thread are kept, and the writes and channel blobs no
+    longer referenced by any checkpoint are removed.
+
+    Args:
+        checkpointer: A Postgres or in-memory checkpointer.
+        keep_last: Number of checkpoints kept per thread, None keeps all.
+        ttl: Maximum idle time of a thread, None never expires threads.
+        vacuum: Run VACUUM on the checkpoint tables (Postgres only) after the
+            deletions are committed, so the freed space can be reused.
+
+    Returns:
+        CompactionReport: What was deleted, the size of the deleted rows and,
+            for Postgres, the measured size of the tables before and after.
+
+    Raises:
+        ValueError: If `keep_last` or `ttl` are not positive.
+        TypeError: If the checkpointer type is not supported.
+    """
+    _check_arguments(keep_last, ttl)
+    if isinstance(checkpointer, PostgresSaver):
+        return _compact_postgres(checkpointer, keep_last, ttl, vacuum)
+    if isinstance(checkpointer, InMemorySaver):
+        return _compact_in_memory(checkpointer, keep_last, ttl)
+    raise TypeError(f"Compaction is not supported for {type(checkpointer)}")
+
+
+async def acompact_checkpoints(
+    checkpointer: BaseCheckpointSaver,
+    keep_last: Optional[int] = 10,
+    ttl: Optional[timedelta] = None,
+    vacuum: bool = False,
+) -> CompactionReport:
+    """Async version of `compact_checkpoints`, required for `AsyncPostgresSaver`
+    checkpointers such as `AsyncPostgresSaverCustom`."""
+    _check_arguments(keep_last, ttl)
+    if isinstance(checkpointer, AsyncPostgresSaver):
+        return await _acompact_postgres(checkpointer, keep_last, ttl, vacuum)
+    return compact_checkpoints(checkpointer, keep_last, ttl, vacuum)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Prune and expire the checkpoints stored in Postgres."
+    )
+    parser.add_argument("--db-uri", default=os.getenv("POSTGRES_DB_URI"))
+    parser.add_argument(
+        "--keep-last",
+        type=int,
+        default=10,
+        help="checkpoints kept per thread (0 keeps all)",
+    )
+    parser.add_argument(
+        "--ttl-hours",
+        type=float,
+        default=None,
+        help="delete the threads idle for longer than this",
+    )
+    parser.add_argument("--vacuum", action="store_true")
+    args = parser.parse_args()
+    if not args.db_uri:
+        parser.error("--db-uri or POSTGRES_DB_URI is required")
+
+    with PostgresSaver.from_conn_string(args.db_uri) as checkpointer:
+        report = compact_checkpoints(
+            checkpointer,
+            keep_last=args.keep_last or None,
+            ttl=timedelta(hours=args.ttl_hours) if args.ttl_hours else None,
+            vacuum=args.vacuum,
+        )
+    print(report)
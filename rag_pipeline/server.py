@@ -0,0 +1,492 @@
+"""ASGI entry point to serve the RAG assistant.
+
+The prompts and the in-process vector indexes are loaded once by the main
+process, the workers are forked afterwards so they share the (read-only)
+index memory. Clients holding network connections (Qdrant, the LLM and the
+embeddings, Postgres) must not be inherited by the workers, they are created
+by every worker at startup. Every worker builds its pipeline, graph and
+checkpointer and answers a warm-up question before reporting ready.
+
+Usage:
+    python -m rag_pipeline.server --workers 4 --max-concurrency 32
+    python -m rag_pipeline.server --fake-providers  # offline, no API key
+
+Endpoints:
+    POST /chat     {"question": "...", "thread_id": "..."}
+    GET  /healthz  the process is alive
+    GET  /readyz   the worker finished its warm-up
+    GET  /metrics  Prometheus metrics of the worker
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import traceback
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError, model_validator
+
+from prompts.registry import PromptRegistry
+from rag_pipeline.core import RAGPipeline
+from rag_pipeline.instrumentation import RAGInstrumentation
+
+if TYPE_CHECKING:
+    from langchain_core.vectorstores import VectorStore
+
+
+class ServerSettings(BaseModel):
+    """Settings of the server, see `python -m rag_pipeline.server --help`."""
+
+    host: str = "127.0.0.1"
+    port: int = 8000
+    workers: int = 1
+    # questions answered at once by each worker, the next ones wait in the
+    # queue and are rejected when it is full or they waited too long
+    max_concurrency: int = 32
+    max_queue: int = 64
+    queue_timeout: float = 10.0
+    db_uri: Optional[str] = None
+    pool_size: int = 10
+    num_history_messages: int = 5
+    num_retrieval_chunks: int = 3
+    warmup_question: str = "What is LangGraph?"
+    # directory of a two-stage `MatryoshkaIndex`, instead of the Qdrant index
+    matryoshka_index: Optional[str] = None
+    fake_providers: bool = False
+    fake_latency_ms: float = 50.0
+
+    @model_validator(mode="after")
+    def check_workers(self) -> "ServerSettings":
+        # without Postgres every worker keeps its conversations in memory and
+        # the next question of a thread can reach another worker
+        if self.workers > 1 and not self.db_uri:
+            raise ValueError(
+                "Several workers require a shared checkpointer, set 'db_uri' "
+                "(POSTGRES_DB_URI) or use a single worker."
+            )
+        return self
+
+
+class ChatRequest(BaseModel):
+    question: str
+    thread_id: Optional[str] = None
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """Limit the questions answered at once, queueing the next ones and
+    shedding the load when the queue is full or the wait is too long."""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Wait for a free slot.
+
+        Raises:
+            Overloaded: If the queue is full or the wait exceeds `queue_timeout`.
+        """
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("The queue is full.")
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded("Timeout waiting in the queue.")
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+def load_prompts() -> tuple[Callable[[], str], Callable[[], str]]:
+    """Compile the topic guard and the RAG system prompts, they are reloaded
+    when their files are modified."""
+    registry = PromptRegistry()
+    for name in ("topic_guard", "rag_system_prompt"):
+        registry.get(name)
+    return registry.loader("topic_guard"), registry.loader("rag_system_prompt")
+
+
+def is_fork_safe_index(settings: ServerSettings) -> bool:
+    """Whether the vector index lives in the process memory and can be loaded
+    before forking the workers.
+
+    The Qdrant client opens HTTP connections when it is created, a forked
+    worker would share their sockets with the other workers. The embeddings
+    client of a `MatryoshkaVectorStore` is never used before the fork, so it
+    has no open connection.
+    """
+    return bool(settings.matryoshka_index or settings.fake_providers)
+
+
+def load_vectorstore(settings: ServerSettings) -> "VectorStore":
+    """Load the vector index, a synthetic one with the fake providers."""
+    if settings.matryoshka_index:
+        from vector_database.src.matryoshka import MatryoshkaVectorStore
+
+        if settings.fake_providers:
+            from rag_pipeline.fakes import FakeEmbeddings
+
+            embeddings = FakeEmbeddings(size=1024)
+        else:
+            from vector_database.src.vector_store import get_embeddings
+
+            embeddings = get_embeddings()
+        return MatryoshkaVectorStore.load(settings.matryoshka_index, embeddings)
+
+    if not settings.fake_providers:
+        from vector_database.src.vector_store import get_vector_store
+
+        return get_vector_store()
+
+    from langchain_core.documents import Document
+    from langchain_core.vectorstores import InMemoryVectorStore
+
+    from rag_pipeline.fakes import FakeEmbeddings
+
+    vectorstore = InMemoryVectorStore(FakeEmbeddings(size=1024))
+    vectorstore.add_documents(
+        [
+            Document(
+                id=f"chunk-{i}",
+                page_content=f"LangGraph documentation chunk {i}.",
+                metadata={"source": f"docs/source_docs/page_{i}.md"},
+            )
+            for i in range(100)
+        ]
+    )
+    return vectorstore
+
+
+class RAGServer:
+    """ASGI application answering the questions with a `RAGPipeline`."""
+
+    def __init__(
+        self,
+        settings: ServerSettings,
+        vectorstore: Optional["VectorStore"],
+        prompts: tuple[Callable[[], str], Callable[[], str]],
+    ):
+        """Initialize the application, the pipeline is built at startup.
+
+        Args:
+            settings: Settings of the server.
+            vectorstore: Vector index shared by all the workers, None to load
+                it in every worker at startup.
+            prompts: Topic guard and RAG system prompts.
+        """
+        self.settings = settings
+        self.vectorstore = vectorstore
+        self.prompts = prompts
+        self.rag: Optional[RAGPipeline] = None
+        self.instrumentation = RAGInstrumentation()
+        self.limiter: Optional[ConcurrencyLimiter] = None
+        self.ready = False
+        self._resources = AsyncExitStack()
+
+    async def startup(self) -> None:
+        """Build the pipeline and answer the warm-up question."""
+        settings = self.settings
+        if self.vectorstore is None:
+            self.vectorstore = await asyncio.to_thread(load_vectorstore, settings)
+        if settings.db_uri:
+            from rag_pipeline.checkpointers import AsyncPostgresSaverCustom
+
+            checkpointer = await self._resources.enter_async_context(
+                AsyncPostgresSaverCustom.from_conn_string(
+                    settings.db_uri, max_size=settings.pool_size
+                )
+            )
+            await checkpointer.setup()
+        else:
+            from langgraph.checkpoint.memory import MemorySaver
+
+            checkpointer = MemorySaver()
+
+        llm = None
+        if settings.fake_providers:
+            from rag_pipeline.fakes import FakeChatModel
+
+            llm = FakeChatModel(latency=settings.fake_latency_ms / 1000)
+
+        topic_guard_prompt, rag_system_prompt = self.prompts
+        self.rag = RAGPipeline(
+            vectorstore=self.vectorstore,
+            checkpoint=checkpointer,
+            topic_guard_prompt=topic_guard_prompt,
+            rag_system_prompt=rag_system_prompt,
+            num_history_messages=settings.num_history_messages,
+            num_retrieval_chunks=settings.num_retrieval_chunks,
+            instrumentation=self.instrumentation,
+            llm=llm,
+        )
+        # the semaphore must be created in the event loop of the worker
+        self.limiter = ConcurrencyLimiter(
+            settings.max_concurrency, settings.max_queue, settings.queue_timeout
+        )
+
+        # the first question pays the connections to the LLM, the embeddings
+        # and the database, it must not be a user question
+        thread_id = f"warmup-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        await self.rag.achat(
+            settings.warmup_question,
+            config={"configurable": {"thread_id": thread_id}},
+        )
+        await checkpointer.adelete_thread(thread_id)
+        self.ready = True
+        print(f"Worker {os.getpid()} ready")
+
+    async def shutdown(self) -> None:
+        self.ready = False
+        await self._resources.aclose()
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": repr(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope: dict, receive, send) -> None:
+        method, path = scope["method"], scope["path"]
+        if path == "/healthz":
+            await self._respond(send, 200, {"status": "ok"})
+        elif path == "/readyz":
+            await self._respond(
+                send,
+                200 if self.ready else 503,
+                {"status": "ready" if self.ready else "starting"},
+            )
+        elif path == "/metrics":
+            await self._respond(send, 200, self._metrics(), "text/plain")
+        elif path == "/chat" and method == "POST":
+            await self._chat(receive, send)
+        else:
+            await self._respond(send, 404, {"error": "Not found"})
+
+    async def _chat(self, receive, send) -> None:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            request = ChatRequest.model_validate_json(body)
+        except ValidationError as e:
+            await self._respond(send, 400, {"error": str(e)})
+            return
+
+        if not self.ready:
+            await self._respond(send, 503, {"error": "The server is starting."})
+            return
+        thread_id = request.thread_id or uuid.uuid4().hex
+        try:
+            async with self.limiter.slot():
+                answer, references = await self.rag.achat(
+                    request.question,
+                    config={"configurable": {"thread_id": thread_id}},
+                )
+        except Overloaded as e:
+            await self._respond(send, 503, {"error": str(e)}, retry_after=1)
+            return
+        except Exception:
+            # the details (queries, paths, connection strings) stay in the logs
+            request_id = uuid.uuid4().hex
+            print(f"Request {request_id} failed:\n{traceback.format_exc()}")
+            await self._respond(
+                send,
+                500,
+                {"error": "Internal server error", "request_id": request_id},
+            )
+            return
+        await self._respond(
+            send,
+            200,
+            {"thread_id": thread_id, "answer": answer, "references": references},
+        )
+
+    def _metrics(self) -> str:
+        limiter = self.limiter
+        gauges = [
+            ("rag_server_in_flight", "gauge", limiter.in_flight if limiter else 0),
+            ("rag_server_queued", "gauge", limiter.queued if limiter else 0),
+            (
+                "rag_server_rejected_total",
+                "counter",
+                limiter.rejected if limiter else 0,
+            ),
+        ]
+        lines = [
+            f"# TYPE {name} {kind}\n{name} {value}" for name, kind, value in gauges
+        ]
+        return self.instrumentation.export_prometheus() + "\n".join(lines) + "\n"
+
+    @staticmethod
+    async def _respond(
+        send,
+        status: int,
+        content: Any,
+        content_type: str = "application/json",
+        retry_after: Optional[int] = None,
+    ) -> None:
+        body = (content if isinstance(content, str) else json.dumps(content)).encode()
+        headers = [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ]
+        if retry_after is not None:
+            headers.append((b"retry-after", str(retry_after).encode()))
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_app(
+    settings: Optional[ServerSettings] = None, load_index: bool = True
+) -> RAGServer:
+    """Load the prompts and the vector index and create the application.
+
+    It can also be used as an application factory, e.g.
+    `uvicorn --factory rag_pipeline.server:create_app`.
+
+    Args:
+        settings: Settings of the server, read from the environment by default.
+        load_index: Load the vector index now, otherwise it is loaded at the
+            startup of the application.
+    """
+    settings = settings or ServerSettings(db_uri=os.getenv("POSTGRES_DB_URI"))
+    vectorstore = load_vectorstore(settings) if load_index else None
+    return RAGServer(settings, vectorstore, load_prompts())
+
+
+def serve(settings: ServerSettings) -> None:
+    """Serve the application with `settings.workers` forked uvicorn workers
+    listening on the same socket."""
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise ImportError(
+            "uvicorn is required to serve the assistant: `pip install uvicorn`"
+        ) from e
+
+    # an in-process index is loaded before forking, so the workers share its
+    # memory, a Qdrant client is created by every worker
+    app = create_app(
+        settings,
+        load_index=settings.workers == 1 or is_fork_safe_index(settings),
+    )
+    config = uvicorn.Config(app, lifespan="on")
+    if settings.workers == 1:
+        uvicorn.Server(config).run(sockets=[_bind_socket(settings.host, settings.port)])
+        return
+
+    sock = _bind_socket(settings.host, settings.port)
+    workers = []
+    for _ in range(settings.workers):
+        pid = os.fork()
+        if pid == 0:
+            # the signals are forwarded by the main process only once, a
+            # second signal would force the worker to exit
+            os.setpgid(0, 0)
+            uvicorn.Server(config).run(sockets=[sock])
+            os._exit(0)
+        workers.append(pid)
+
+    def stop_workers(signum, frame):
+        for pid in workers:
+            with suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop_workers)
+    signal.signal(signal.SIGTERM, stop_workers)
+    for pid in workers:
+        os.waitpid(pid, 0)
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    defaults = ServerSettings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=defaults.host)
+    parser.add_argument("--port", type=int, default=defaults.port)
+    parser.add_argument("--workers", type=int, default=defaults.workers)
+    parser.add_argument("--max-concurrency", type=int, default=defaults.max_concurrency)
+    parser.add_argument("--max-queue", type=int, default=defaults.max_queue)
+    parser.add_argument("--queue-timeout", type=float, default=defaults.queue_timeout)
+    parser.add_argument("--db-uri", default=os.getenv("POSTGRES_DB_URI"))
+    parser.add_argument("--pool-size", type=int, default=defaults.pool_size)
+    parser.add_argument(
+        "--num-history-messages",
+        type=int,
+        default=int(os.getenv("NUM_HISTORY_MESSAGES", defaults.num_history_messages)),
+    )
+    parser.add_argument(
+        "--num-retrieval-chunks",
+        type=int,
+        default=int(os.getenv("NUM_RETRIEVAL_CHUNKS", defaults.num_retrieval_chunks)),
+    )
+    parser.add_argument(
+        "--matryoshka-index",
+        help="Directory of a two-stage index built with vector_database.src.matryoshka",
+    )
+    parser.add_argument(
+        "--fake-providers",
+        action="store_true",
+        help="Use the scripted FakeChatModel and FakeEmbeddings",
+    )
+    parser.add_argument(
+        "--fake-latency-ms", type=float, default=defaults.fake_latency_ms
+    )
+    try:
+        settings = ServerSettings(**vars(parser.parse_args()))
+    except ValidationError as e:
+        parser.error(e.errors()[0]["msg"])
+    serve(settings)
@@ -1,92 +1,71 @@
-from typing import Any, Dict, Optional
-from langgraph.checkpoint.postgres import PostgresSaver
-from langchain_core.runnables import RunnableConfig
-from langgraph.checkpoint.base import (
-    ChannelVersions,
-    Checkpoint,
-    CheckpointMetadata,
-    CheckpointTuple,
-)
-from collections.abc import AsyncIterator, Sequence
-from langgraph.types import Command
-from langchain_core.messages import ToolMessage
+import re
+import threading
+from collections import OrderedDict
 from functools import wraps
+from langchain_core.messages import ToolMessage
+
+# the Postgres checkpointers moved to `rag_pipeline.checkpointers`, they are
+# still importable from here but only loaded (with psycopg) when used
+_CHECKPOINTERS = (
+    "PostgresSaverCustom",
+    "AsyncPostgresSaverCustom",
+    "POOL_CONNECTION_KWARGS",
+)
+
+
+def __getattr__(name: str):
+    if name in _CHECKPOINTERS:
+        from rag_pipeline import checkpointers
+
+        return getattr(checkpointers, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
+class LRUCache:
+    """Thread-safe mapping that keeps only the `maxsize` most recently used items."""
 
-class PostgresSaverCustom(PostgresSaver):
-    """Custom implementation of the PostgresSaver class to add async methods."""
-
-    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
-        """Asynchronously fetch a checkpoint tuple using the given configuration.
-
-        Args:
-            config (RunnableConfig): Configuration specifying which checkpoint to retrieve.
-
-        Returns:
-            Optional[CheckpointTuple]: The requested checkpoint tuple, or None if not found.
-        """
-        return self.get_tuple(config)
-
-    async def alist(
-        self,
-        config: Optional[RunnableConfig],
-        *,
-        filter: Optional[Dict[str, Any]] = None,
-        before: Optional[RunnableConfig] = None,
-        limit: Optional[int] = None,
-    ) -> AsyncIterator[CheckpointTuple]:
-        """Asynchronously list checkpoints that match the given criteria.
-
-        Args:
-            config (Optional[RunnableConfig]): Base configuration for filtering checkpoints.
-            filter (Optional[Dict[str, Any]]): Additional filtering criteria for metadata.
-            before (Optional[RunnableConfig]): List checkpoints created before this configuration.
-            limit (Optional[int]): Maximum number of checkpoints to return.
-
-        Returns:
-            AsyncIterator[CheckpointTuple]: Async iterator of matching checkpoint tuples.
-
-
-        """
-        for item in self.list(config, filter=filter, before=before, limit=limit):
-            yield item
-
-    async def aput(
-        self,
-        config: RunnableConfig,
-        checkpoint: Checkpoint,
-        metadata: CheckpointMetadata,
-        new_versions: ChannelVersions,
-    ) -> RunnableConfig:
-        """Asynchronously store a checkpoint with its configuration and metadata.
-
-        Args:
-            config (RunnableConfig): Configuration for the checkpoint.
-            checkpoint (Checkpoint): The checkpoint to store.
-            metadata (CheckpointMetadata): Additional metadata for the checkpoint.
-            new_versions (ChannelVersions): New channel versions as of this write.
-
-        Returns:
-            RunnableConfig: Updated configuration after storing the checkpoint.
-        """
-        return self.put(config, checkpoint, metadata, new_versions)
-
-    async def aput_writes(
-        self,
-        config: RunnableConfig,
-        writes: Sequence[tuple[str, Any]],
-        task_id: str,
-        task_path: str = "",
-    ) -> None:
-        """Asynchronously store intermediate writes linked to a checkpoint.
-
-        Args:
-            config (RunnableConfig): Configuration of the related checkpoint.
-            writes (List[Tuple[str, Any]]): List of writes to store.
-            task_id (str): Identifier for the task creating the writes.
-            task_path (str): Path of the task creating the writes.
-        """
-        return self.put_writes(config, writes, task_id, task_path)
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def query_terms(query: str) -> frozenset[str]:
+    """Normalize a query to the set of its lowercase words, so queries that
+    only differ in case, punctuation or word order are identical."""
+    return frozenset(re.findall(r"\w+", query.lower()))
+
+
+def query_similarity(terms: frozenset[str], other: frozenset[str]) -> float:
+    """Jaccard similarity of the terms of two queries."""
+    if not terms and not other:
+        return 1.0
+    return len(terms & other) / len(terms | other)
 
 
 def limit_calls(max_calls=10):
@@ -97,8 +76,8 @@ def limit_calls(max_calls=10):
     The `state` argument must be passed as a keyword argument and is expected
     to be injected (e.g., via a dependency like InjectedState).
 
-    If the number of calls exceeds `max_calls`, the function is not executed
-    and a fallback response is returned.
+    Once the function has been called `max_calls` times, it is not executed
+    anymore and a fallback response is returned.
 
     Additionally, `num_calls` is incremented automatically after each successful call.
 
@@ -112,6 +91,8 @@ def limit_calls(max_calls=10):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
+            from langgraph.types import Command
+
             state = kwargs.get("state")
 
             if state is None:
@@ -126,7 +107,7 @@ def limit_calls(max_calls=10):
             num_calls = state.get("num_calls", [])
             # we cannot use more tool if we have already used the max_calls or
             # the last tool calls are the same
-            if len(num_calls) > max_calls:
+            if len(num_calls) >= max_calls:
                 error = (
                     "You cannot use any more the retriever tool. You must  "
                     "provide an answer to the user with the information "
@@ -0,0 +1,87 @@
+import os
+import uuid
+from typing import Any, Callable
+
+import pytest
+from langchain_core.documents import Document
+from langgraph.checkpoint.memory import InMemorySaver
+
+from rag_pipeline.core import RAGPipeline
+from rag_pipeline.fakes import FakeChatModel, FakeEmbeddings
+
+DOCUMENTS = [
+    Document(
+        page_content=f"LangGraph chunk {i}: how to use checkpointers. " * 20,
+        metadata={"source": f"docs/page_{i}.md"},
+    )
+    for i in range(10)
+]
+
+
+@pytest.fixture
+def embeddings() -> FakeEmbeddings:
+    return FakeEmbeddings(size=32)
+
+
+@pytest.fixture
+def vector_store(embeddings):
+    """In-memory Qdrant store, its documents carry the point id in the
+    metadata (`_id`) like in production."""
+    from langchain_qdrant import QdrantVectorStore
+
+    return QdrantVectorStore.from_documents(
+        DOCUMENTS,
+        embeddings,
+        location=":memory:",
+        collection_name="test_docs",
+    )
+
+
+@pytest.fixture
+def make_pipeline(vector_store) -> Callable[..., RAGPipeline]:
+    """Factory of pipelines on the test documents, the keyword arguments
+    replace the defaults (in-memory checkpointer, `FakeChatModel`)."""
+
+    def make(**kwargs: Any) -> RAGPipeline:
+        arguments = {
+            "vectorstore": vector_store,
+            "checkpoint": InMemorySaver(),
+            "topic_guard_prompt": "Guard prompt",
+            "rag_system_prompt": "RAG prompt",
+            "llm": FakeChatModel(),
+            **kwargs,
+        }
+        return RAGPipeline(**arguments)
+
+    return make
+
+
+@pytest.fixture
+def pipeline(make_pipeline) -> RAGPipeline:
+    return make_pipeline()
+
+
+@pytest.fixture
+def postgres_uri():
+    """Connection string of a throwaway database, dropped after the test.
+
+    The server is taken from `TEST_POSTGRES_DB_URI`, the tests using this
+    fixture are skipped when it is not set or not reachable.
+    """
+    uri = os.getenv("TEST_POSTGRES_DB_URI")
+    if not uri:
+        pytest.skip("TEST_POSTGRES_DB_URI is not set")
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+
+    try:
+        admin = psycopg.connect(uri, autocommit=True, connect_timeout=5)
+    except psycopg.OperationalError as e:
+        pytest.skip(f"Postgres is not reachable: {e}")
+    dbname = f"test_{uuid.uuid4().hex[:12]}"
+    with admin:
+        admin.execute(f"CREATE DATABASE {dbname}")
+        try:
+            yield make_conninfo(uri, dbname=dbname)
+        finally:
+            admin.execute(f"DROP DATABASE {dbname} WITH (FORCE)")
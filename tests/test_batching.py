@@ -0,0 +1,102 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from rag_pipeline.batching import RetrievalBatcher
+
+
+class RecordingEmbeddings(Embeddings):
+    """Embeddings recording the texts of every request."""
+
+    def __init__(self, embeddings: Embeddings, error: Exception = None):
+        self.embeddings = embeddings
+        self.error = error
+        self.requests: list[list[str]] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.requests.append(list(texts))
+        if self.error is not None:
+            raise self.error
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+def _search_concurrently(batcher: RetrievalBatcher, queries: list[str], k: int = 2):
+    """Run the searches from as many chats in flight, started together."""
+    barrier = threading.Barrier(len(queries))
+
+    def search(query: str):
+        with batcher.track_request():
+            barrier.wait()
+            return batcher.search(query, k=k)
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        futures = [executor.submit(search, query) for query in queries]
+    return futures
+
+
+def test_concurrent_queries_share_one_embedding_request(vector_store, embeddings):
+    recording = RecordingEmbeddings(embeddings)
+    batcher = RetrievalBatcher(vector_store, embeddings=recording, max_wait=0.2)
+    queries = [f"question {i}" for i in range(6)] + ["question 0"]
+
+    futures = _search_concurrently(batcher, queries)
+
+    assert len(recording.requests) == 1
+    # identical queries are embedded once
+    assert sorted(recording.requests[0]) == sorted(set(queries))
+    for query, future in zip(queries, futures):
+        expected = vector_store.similarity_search(query, k=2)
+        assert [doc.page_content for doc in future.result()] == [
+            doc.page_content for doc in expected
+        ]
+
+
+def test_lone_query_is_not_delayed(vector_store, embeddings):
+    recording = RecordingEmbeddings(embeddings)
+    batcher = RetrievalBatcher(vector_store, embeddings=recording, max_wait=60)
+
+    with batcher.track_request():
+        docs = batcher.search("question", k=3)
+
+    assert len(docs) == 3
+    assert recording.requests == [["question"]]
+
+
+def test_embedding_error_is_raised_in_every_query(vector_store, embeddings):
+    recording = RecordingEmbeddings(embeddings, error=RuntimeError("rate limited"))
+    batcher = RetrievalBatcher(vector_store, embeddings=recording, max_wait=0.2)
+
+    futures = _search_concurrently(batcher, ["a", "b", "c"])
+
+    assert len(recording.requests) == 1
+    for future in futures:
+        with pytest.raises(RuntimeError, match="rate limited"):
+            future.result()
+    # the batcher is still usable after a failed batch
+    recording.error = None
+    assert batcher.search("a", k=1)
+
+
+def test_search_error_only_fails_its_query(vector_store, embeddings, monkeypatch):
+    batcher = RetrievalBatcher(vector_store, embeddings=embeddings, max_wait=0.2)
+    failing = embeddings.embed_query("b")
+    search_by_vector = vector_store.similarity_search_by_vector
+
+    def similarity_search_by_vector(vector, k):
+        if vector == failing:
+            raise ValueError("search failed")
+        return search_by_vector(vector, k=k)
+
+    monkeypatch.setattr(
+        vector_store, "similarity_search_by_vector", similarity_search_by_vector
+    )
+    futures = _search_concurrently(batcher, ["a", "b", "c"])
+
+    assert futures[0].result() and futures[2].result()
+    with pytest.raises(ValueError, match="search failed"):
+        futures[1].result()
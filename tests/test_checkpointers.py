@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+
+from rag_pipeline.checkpointers import AsyncPostgresSaverCustom
+
+
+def _config(thread_id: str, checkpoint_id: str = "") -> dict:
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ""}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def _run(postgres_uri: str, test) -> None:
+    async def run():
+        async with AsyncPostgresSaverCustom.from_conn_string(
+            postgres_uri, min_size=1, max_size=4
+        ) as saver:
+            await saver.setup()
+            await test(saver)
+
+    asyncio.run(run())
+
+
+async def _put_checkpoint(saver, thread_id: str, values: dict) -> dict:
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = values
+    checkpoint["channel_versions"] = {channel: 1 for channel in values}
+    return await saver.aput(
+        _config(thread_id), checkpoint, {"step": 0}, {channel: 1 for channel in values}
+    )
+
+
+def test_aput_stores_checkpoint_and_blobs(postgres_uri):
+    async def test(saver):
+        config = await _put_checkpoint(
+            saver, "t1", {"messages": ["hello"], "question": "How?"}
+        )
+
+        stored = await saver.aget_tuple(config)
+        assert stored.checkpoint["id"] == config["configurable"]["checkpoint_id"]
+        assert stored.checkpoint["channel_values"] == {
+            "messages": ["hello"],
+            "question": "How?",
+        }
+        assert stored.metadata["step"] == 0
+
+    _run(postgres_uri, test)
+
+
+def test_aput_writes_coalesces_concurrent_calls(postgres_uri):
+    async def test(saver):
+        config = await _put_checkpoint(saver, "t1", {"messages": []})
+        flushes = 0
+        flush_writes = saver._flush_writes
+
+        async def counting_flush():
+            nonlocal flushes
+            flushes += 1
+            await flush_writes()
+
+        saver._flush_writes = counting_flush
+        await asyncio.gather(
+            *(
+                saver.aput_writes(config, [("messages", f"write {i}")], f"task-{i}")
+                for i in range(5)
+            )
+        )
+
+        stored = await saver.aget_tuple(config)
+        assert flushes == 1
+        assert sorted(write[2] for write in stored.pending_writes) == [
+            f"write {i}" for i in range(5)
+        ]
+
+    _run(postgres_uri, test)
+
+
+def test_aput_writes_upsert_keeps_last_write(postgres_uri):
+    async def test(saver):
+        config = await _put_checkpoint(saver, "t1", {"messages": []})
+        # special channels (e.g. `__error__`) are upserted, both calls are
+        # flushed by the same statement
+        await asyncio.gather(
+            saver.aput_writes(config, [("__error__", "first")], "task"),
+            saver.aput_writes(config, [("__error__", "second")], "task"),
+        )
+
+        stored = await saver.aget_tuple(config)
+        assert [write[2] for write in stored.pending_writes] == ["second"]
+
+    _run(postgres_uri, test)
+
+
+@pytest.mark.parametrize("steps", [1, 2], ids=["before-start", "while-waiting"])
+def test_cancelled_flush_cancels_pending_writes(postgres_uri, steps):
+    async def test(saver):
+        config = await _put_checkpoint(saver, "t1", {"messages": []})
+        writes = [
+            asyncio.create_task(
+                saver.aput_writes(config, [("messages", "lost")], f"task-{i}")
+            )
+            for i in range(2)
+        ]
+        # let the writes queue up, then cancel the flush before it starts or
+        # while it waits for the other writes of the step
+        for _ in range(steps):
+            await asyncio.sleep(0)
+        for flush in list(saver._flush_tasks):
+            flush.cancel()
+
+        for write in writes:
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(write, timeout=5)
+
+        # the next writes schedule a new flush
+        await asyncio.wait_for(
+            saver.aput_writes(config, [("messages", "kept")], "task-2"), timeout=5
+        )
+        stored = await saver.aget_tuple(config)
+        assert [write[2] for write in stored.pending_writes] == ["kept"]
+
+    _run(postgres_uri, test)
@@ -0,0 +1,169 @@
+import asyncio
+from datetime import timedelta
+
+import psycopg
+import pytest
+from langgraph.checkpoint.postgres import PostgresSaver
+
+from rag_pipeline import maintenance
+from rag_pipeline.checkpointers import AsyncPostgresSaverCustom
+from rag_pipeline.maintenance import (
+    CompactionReport,
+    acompact_checkpoints,
+    compact_checkpoints,
+)
+
+
+def _config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _tool_messages(pipeline, thread_id: str) -> list:
+    state = pipeline.graph.get_state(_config(thread_id))
+    return [m for m in state.values["messages"] if m.type == "tool"]
+
+
+def test_tool_messages_store_qdrant_point_ids(pipeline, vector_store):
+    pipeline.chat("How do checkpointers work?", config=_config("t1"))
+
+    (message,) = _tool_messages(pipeline, "t1")
+    chunk_ids = message.artifact["chunk_ids"]
+    assert message.artifact["compacted"]
+    assert len(chunk_ids) == pipeline.num_retrieval_chunks
+    assert message.content == f"Retrieved chunks: {', '.join(chunk_ids)}"
+    assert "LangGraph chunk" not in message.content
+
+    texts = {
+        str(doc.metadata["_id"]): doc.page_content
+        for doc in vector_store.get_by_ids(chunk_ids)
+    }
+    assert pipeline._get_chunks(chunk_ids) == [texts[i] for i in chunk_ids]
+
+
+def test_get_chunks_reloads_evicted_chunks(pipeline, vector_store):
+    pipeline.chat("How do checkpointers work?", config=_config("t1"))
+    chunk_ids = _tool_messages(pipeline, "t1")[0].artifact["chunk_ids"]
+
+    pipeline.chunk_cache = type(pipeline.chunk_cache)(maxsize=1)
+    chunks = pipeline._get_chunks(chunk_ids)
+
+    assert all(chunk.startswith("LangGraph chunk") for chunk in chunks)
+
+
+def test_get_chunks_reports_missing_chunks(pipeline, capsys):
+    missing = "00000000-0000-0000-0000-000000000000"
+
+    (chunk,) = pipeline._get_chunks([missing])
+
+    assert missing in chunk and chunk.strip()
+    assert missing in capsys.readouterr().out
+
+
+def test_compact_in_memory_keeps_last_checkpoints(pipeline):
+    for question in ("First question", "Second question", "Third question"):
+        pipeline.chat(question, config=_config("t1"))
+    pipeline.chat("Other thread", config=_config("t2"))
+    checkpointer = pipeline.checkpoint
+    before = len(list(checkpointer.list(_config("t1"))))
+
+    report = compact_checkpoints(checkpointer, keep_last=2)
+
+    assert len(list(checkpointer.list(_config("t1")))) == 2
+    assert len(list(checkpointer.list(_config("t2")))) == 2
+    assert report.deleted_checkpoints >= before - 2
+    assert report.deleted_bytes > 0
+    # the last checkpoint is untouched, the conversation goes on
+    answer, _ = pipeline.chat("Fourth question", config=_config("t1"))
+    assert answer == pipeline.llm.answer
+
+
+def test_compact_in_memory_expires_idle_threads(pipeline):
+    pipeline.chat("First question", config=_config("t1"))
+
+    assert (
+        compact_checkpoints(pipeline.checkpoint, ttl=timedelta(hours=1)).expired_threads
+        == 0
+    )
+    report = compact_checkpoints(pipeline.checkpoint, ttl=timedelta(microseconds=1))
+
+    assert report.expired_threads == 1
+    assert not list(pipeline.checkpoint.list(_config("t1")))
+    assert not pipeline.checkpoint.blobs and not pipeline.checkpoint.writes
+
+
+@pytest.mark.parametrize("arguments", [{"keep_last": 0}, {"ttl": timedelta(0)}])
+def test_compact_rejects_invalid_arguments(pipeline, arguments):
+    with pytest.raises(ValueError):
+        compact_checkpoints(pipeline.checkpoint, **arguments)
+
+
+def _count(checkpointer, table: str) -> int:
+    with checkpointer._cursor() as cur:
+        return cur.execute(f"SELECT count(*) AS n FROM {table}").fetchone()["n"]
+
+
+def test_compact_postgres(postgres_uri, make_pipeline):
+    with PostgresSaver.from_conn_string(postgres_uri) as checkpointer:
+        checkpointer.setup()
+        pipeline = make_pipeline(checkpoint=checkpointer)
+        for question in ("First question", "Second question", "Third question"):
+            pipeline.chat(question, config=_config("t1"))
+        pipeline.chat("Other thread", config=_config("t2"))
+        checkpoints = _count(checkpointer, "checkpoints")
+
+        report = compact_checkpoints(checkpointer, keep_last=2, vacuum=True)
+
+        assert len(list(checkpointer.list(_config("t1")))) == 2
+        assert len(list(checkpointer.list(_config("t2")))) == 2
+        assert report.deleted_checkpoints == checkpoints - 4
+        assert report.deleted_writes > 0 and report.deleted_blobs > 0
+        assert report.deleted_bytes > 0
+        assert report.size_before > 0 and report.size_after > 0
+        # no write or blob is left without its checkpoint
+        assert compact_checkpoints(checkpointer, keep_last=2) == CompactionReport(
+            size_before=report.size_after, size_after=report.size_after
+        )
+        answer, _ = pipeline.chat("Fourth question", config=_config("t1"))
+        assert answer == pipeline.llm.answer
+
+        assert (
+            compact_checkpoints(checkpointer, ttl=timedelta(hours=1)).expired_threads
+            == 0
+        )
+        report = compact_checkpoints(checkpointer, ttl=timedelta(microseconds=1))
+        assert report.expired_threads == 2
+        for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+            assert _count(checkpointer, table) == 0
+
+
+def test_compact_postgres_rolls_back_on_error(postgres_uri, make_pipeline, monkeypatch):
+    with PostgresSaver.from_conn_string(postgres_uri) as checkpointer:
+        checkpointer.setup()
+        pipeline = make_pipeline(checkpoint=checkpointer)
+        for question in ("First question", "Second question"):
+            pipeline.chat(question, config=_config("t1"))
+        checkpoints = _count(checkpointer, "checkpoints")
+        monkeypatch.setattr(maintenance, "DELETE_ORPHAN_BLOBS_SQL", "SELECT 1 / 0")
+
+        with pytest.raises(psycopg.errors.DivisionByZero):
+            compact_checkpoints(checkpointer, keep_last=1)
+
+        assert _count(checkpointer, "checkpoints") == checkpoints
+
+
+def test_acompact_postgres(postgres_uri, make_pipeline):
+    async def run():
+        async with AsyncPostgresSaverCustom.from_conn_string(postgres_uri) as saver:
+            await saver.setup()
+            pipeline = make_pipeline(checkpoint=saver)
+            for question in ("First question", "Second question"):
+                await pipeline.achat(question, config=_config("t1"))
+
+            report = await acompact_checkpoints(saver, keep_last=1, vacuum=True)
+            remaining = [c async for c in saver.alist(_config("t1"))]
+            return report, remaining
+
+    report, remaining = asyncio.run(run())
+
+    assert len(remaining) == 1
+    assert report.deleted_checkpoints > 0 and report.deleted_writes > 0
@@ -0,0 +1,31 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from rag_pipeline.core import RetieveSchema
+
+
+def test_retrieve_schema_is_importable_from_core(pipeline):
+    (tool,) = [
+        tool
+        for tool in pipeline.graph.nodes["DB_retriever"].bound.tools_by_name.values()
+    ]
+
+    assert tool.args_schema is RetieveSchema
+    assert set(RetieveSchema.model_fields) == {"query", "state", "tool_call_id"}
+
+
+def test_core_import_does_not_load_langgraph():
+    code = (
+        "import sys, rag_pipeline.core; "
+        "print(any(m.startswith('langgraph') for m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    assert output.strip() == "False"
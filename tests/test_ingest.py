@@ -0,0 +1,202 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from vector_database.src import ingest, vector_store
+from vector_database.src.ingest import (
+    COLLECTION_NAME,
+    ShardLedger,
+    create_job,
+    iter_batches,
+    merge,
+    run_shard,
+)
+from vector_database.src.utils import load_config
+
+CONFIG_PATH = Path(__file__).parents[1] / "config.yaml"
+
+
+@pytest.fixture
+def config() -> dict:
+    return load_config(str(CONFIG_PATH))
+
+
+@pytest.fixture
+def docs_root(tmp_path) -> Path:
+    root = tmp_path / "docs"
+    for i in range(12):
+        page = root / f"section_{i % 3}" / f"page_{i}.md"
+        page.parent.mkdir(parents=True, exist_ok=True)
+        page.write_text(f"# Page {i}\n\n" + f"Content of the page {i}. " * 50)
+    return root
+
+
+@pytest.fixture
+def qdrant_path(tmp_path, monkeypatch) -> Path:
+    path = tmp_path / "qdrant"
+    monkeypatch.setattr(vector_store, "QDRANT_PATH", path)
+    return path
+
+
+def _run_job(job_dir: Path, config: dict, docs_root: Path) -> dict:
+    manifest = create_job(job_dir, config, str(docs_root), 2, 2, fake_embeddings=True)
+    for shard in range(manifest["num_shards"]):
+        run_shard(job_dir, shard, config)
+    return manifest
+
+
+def _alias_target(client) -> str:
+    aliases = {a.alias_name: a.collection_name for a in client.get_aliases().aliases}
+    return aliases.get(COLLECTION_NAME)
+
+
+def test_ledger_ignores_a_truncated_last_line(tmp_path):
+    ledger = ShardLedger(tmp_path / "ledger.jsonl")
+    ledger.append({"event": "start"})
+    ledger.append({"event": "batch", "batch": 0})
+    with open(ledger.path, "a") as f:
+        f.write('{"event": "batch", "ba')
+    content = ledger.path.read_bytes()
+
+    assert ledger.read() == [{"event": "start"}, {"event": "batch", "batch": 0}]
+    # reading (e.g. `status` while a worker writes) never modifies the file
+    assert ledger.path.read_bytes() == content
+
+    ledger.repair()
+    ledger.append({"event": "batch", "batch": 1})
+    assert [entry.get("batch") for entry in ledger.read()] == [None, 0, 1]
+
+
+def test_a_shard_is_processed_by_one_worker(tmp_path, config, docs_root):
+    job_dir = tmp_path / "job"
+    create_job(job_dir, config, str(docs_root), 1, 2, fake_embeddings=True)
+    shard_dir = job_dir / "shard-0000"
+    shard_dir.mkdir(parents=True)
+
+    with ingest._lock_shard(shard_dir, 0):
+        with pytest.raises(RuntimeError, match="another worker"):
+            run_shard(job_dir, 0, config)
+        assert not (shard_dir / ingest.LEDGER_FILE).exists()
+
+    # the lock is released when the worker is done
+    assert run_shard(job_dir, 0, config)["embedded"] > 0
+
+
+def test_run_shard_resumes_after_a_failure(tmp_path, config, docs_root, monkeypatch):
+    job_dir = tmp_path / "job"
+    manifest = create_job(job_dir, config, str(docs_root), 1, 2, fake_embeddings=True)
+    real_embeddings = ingest.get_embeddings(manifest)
+
+    class FailingEmbeddings:
+        calls = 0
+
+        def embed_documents(self, texts):
+            FailingEmbeddings.calls += 1
+            if FailingEmbeddings.calls == 3:
+                raise RuntimeError("embedding API down")
+            return real_embeddings.embed_documents(texts)
+
+    monkeypatch.setattr(ingest, "get_embeddings", lambda _: FailingEmbeddings())
+    with pytest.raises(RuntimeError, match="embedding API down"):
+        run_shard(job_dir, 0, config)
+    monkeypatch.undo()
+
+    result = run_shard(job_dir, 0, config)
+
+    assert result["batches"] > 3
+    assert result["embedded"] == result["batches"] - 2
+    records = [record for batch in iter_batches(job_dir) for record in batch]
+    assert len(records) == result["chunks"]
+    assert len({record["id"] for record in records}) == len(records)
+    # a finished shard is not embedded again
+    assert run_shard(job_dir, 0, config)["embedded"] == 0
+
+
+def test_jobs_created_in_the_same_second_have_distinct_ids(tmp_path, config, docs_root):
+    ids = {
+        create_job(tmp_path / f"job{i}", config, str(docs_root), 1, 2, True)["job_id"]
+        for i in range(5)
+    }
+
+    assert len(ids) == 5
+
+
+def test_merge_swaps_the_alias(tmp_path, config, docs_root, qdrant_path):
+    first = _run_job(tmp_path / "job1", config, docs_root)
+    second = _run_job(tmp_path / "job2", config, docs_root)
+
+    first_collection = merge(tmp_path / "job1")
+    second_collection = merge(tmp_path / "job2")
+    # merging a published job again does nothing
+    assert merge(tmp_path / "job2") == second_collection
+
+    client = vector_store.get_qdrant_client()
+    try:
+        assert first_collection == f"{COLLECTION_NAME}_{first['job_id']}"
+        assert second_collection == f"{COLLECTION_NAME}_{second['job_id']}"
+        assert _alias_target(client) == second_collection
+        # the alias answers the queries, the previous collection is kept
+        size = client.count(second_collection, exact=True).count
+        assert client.count(COLLECTION_NAME, exact=True).count == size > 0
+        assert client.collection_exists(first_collection)
+    finally:
+        client.close()
+
+    merge(tmp_path / "job1", delete_previous=True)
+    client = vector_store.get_qdrant_client()
+    try:
+        assert _alias_target(client) == first_collection
+        assert not client.collection_exists(second_collection)
+    finally:
+        client.close()
+
+
+def test_merge_requires_migrate_to_replace_a_collection(
+    tmp_path, config, docs_root, qdrant_path
+):
+    from qdrant_client import models
+
+    _run_job(tmp_path / "job", config, docs_root)
+    client = vector_store.get_qdrant_client()
+    client.create_collection(
+        COLLECTION_NAME,
+        vectors_config=models.VectorParams(size=4, distance=models.Distance.COSINE),
+    )
+    client.close()
+
+    with pytest.raises(RuntimeError, match="--migrate"):
+        merge(tmp_path / "job")
+    client = vector_store.get_qdrant_client()
+    try:
+        # nothing was deleted or published
+        assert COLLECTION_NAME in [c.name for c in client.get_collections().collections]
+        assert _alias_target(client) is None
+    finally:
+        client.close()
+
+    collection = merge(tmp_path / "job", migrate=True)
+    client = vector_store.get_qdrant_client()
+    try:
+        assert COLLECTION_NAME not in [
+            c.name for c in client.get_collections().collections
+        ]
+        assert _alias_target(client) == collection
+    finally:
+        client.close()
+
+
+def test_merge_refuses_the_collection_of_another_job(
+    tmp_path, config, docs_root, qdrant_path
+):
+    _run_job(tmp_path / "job", config, docs_root)
+    merge(tmp_path / "job")
+    # another job with the same id, e.g. copied from the first one
+    shutil.copytree(tmp_path / "job", tmp_path / "copy")
+    (tmp_path / "copy" / ingest.MERGE_FILE).unlink()
+
+    with pytest.raises(RuntimeError, match="not created by the job"):
+        merge(tmp_path / "copy")
+    state = json.loads((tmp_path / "job" / ingest.MERGE_FILE).read_text())
+    assert state["published"]
@@ -0,0 +1,50 @@
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph.state import CompiledStateGraph
+
+from rag_pipeline.instrumentation import RAGInstrumentation
+
+
+def test_chat_reports_to_the_instrumentation(make_pipeline):
+    instrumentation = RAGInstrumentation()
+    pipeline = make_pipeline(instrumentation=instrumentation)
+    config = {"configurable": {"thread_id": "t1"}}
+
+    pipeline.chat("How do checkpointers work?", config=config)
+    asyncio.run(pipeline.achat("And the stores?", config=config))
+
+    # the graph keeps its own methods, the callbacks are added per invocation
+    assert isinstance(pipeline.graph, CompiledStateGraph)
+    assert pipeline.graph.get_state(config).values["messages"]
+    exported = instrumentation.export_prometheus()
+    assert "rag_turn_duration_seconds_count 2" in exported
+    assert 'rag_node_duration_seconds_count{node="DB_retriever"} 2' in exported
+
+
+def test_turn_inside_another_chain_is_recorded(make_pipeline):
+    instrumentation = RAGInstrumentation()
+    pipeline = make_pipeline(instrumentation=instrumentation)
+    outer = RunnableLambda(
+        lambda question, config: pipeline.chat(question, config=config)[0]
+    )
+
+    answer = outer.invoke(
+        "How do checkpointers work?", {"configurable": {"thread_id": "t1"}}
+    )
+
+    assert answer == pipeline.llm.answer
+    (trace,) = instrumentation.traces
+    assert trace["thread_id"] == "t1"
+    assert trace["llm_calls"] == 3 and len(trace["retrievals"]) == 1
+    assert "rag_turn_duration_seconds_count 1" in instrumentation.export_prometheus()
+
+
+def test_prometheus_label_values_are_escaped():
+    instrumentation = RAGInstrumentation()
+    instrumentation._increment("rag_tool_calls_total", tool='say "hi"\\\nbye')
+
+    exported = instrumentation.export_prometheus()
+
+    assert 'rag_tool_calls_total{tool="say \\"hi\\"\\\\\\nbye"} 1' in exported
+    assert all(line.count('"') % 2 == 0 for line in exported.splitlines())
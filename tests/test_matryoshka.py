@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from rag_pipeline.fakes import FakeEmbeddings
+from vector_database.src.matryoshka import (
+    DocumentFile,
+    MatryoshkaIndex,
+    MatryoshkaVectorStore,
+)
+
+DIMENSION = 128
+COARSE_DIM = 32
+K = 10
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def vectors() -> np.ndarray:
+    """Unclustered vectors whose variance decreases along the dimensions, so
+    the prefixes carry most (but not all) of the information."""
+    rng = np.random.default_rng(0)
+    scales = (1 + np.arange(DIMENSION) / 16) ** -1
+    return (rng.standard_normal((2000, DIMENSION)) * scales).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def queries(vectors) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    noise = rng.standard_normal((50, DIMENSION)).astype(np.float32)
+    return vectors[:50] + 0.5 * noise * vectors.std(axis=0)
+
+
+def _exact_search(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = _normalize(vectors) @ _normalize(query)
+    return np.argsort(-scores)[:k]
+
+
+def _recall(index: MatryoshkaIndex, vectors, queries, candidates) -> float:
+    recalls = []
+    for query in queries:
+        expected = set(_exact_search(vectors, query, K))
+        positions, _ = index.search(query, k=K, candidates=candidates)
+        recalls.append(len(expected & set(positions)) / K)
+    return float(np.mean(recalls))
+
+
+def test_int8_codes_round_trip(vectors, tmp_path):
+    index = MatryoshkaIndex.build(vectors, tmp_path, COARSE_DIM, "int8")
+
+    prefix = _normalize(vectors[:, :COARSE_DIM])
+    assert index.coarse.dtype == np.int8
+    # dequantized codes are within half a quantization step of the prefix
+    error = np.abs(index.coarse * index.scales - prefix)
+    assert np.all(error <= index.scales / 2 + 1e-6)
+    assert index.memory_bytes == index.coarse.nbytes + index.scales.nbytes
+
+
+def test_binary_codes_are_the_signs(vectors, tmp_path):
+    index = MatryoshkaIndex.build(vectors, tmp_path, COARSE_DIM, "binary")
+
+    assert index.coarse.shape == (len(vectors), COARSE_DIM // 8)
+    signs = np.unpackbits(index.coarse, axis=1)[:, :COARSE_DIM]
+    np.testing.assert_array_equal(signs, vectors[:, :COARSE_DIM] > 0)
+    assert index.memory_bytes == index.coarse.nbytes
+
+
+@pytest.mark.parametrize("precision", ["float32", "int8", "binary"])
+def test_rescoring_returns_exact_scores(vectors, queries, tmp_path, precision):
+    index = MatryoshkaIndex.build(vectors, tmp_path, COARSE_DIM, precision)
+
+    # the full vectors are read from disk, not loaded in memory
+    assert isinstance(index.full, np.memmap)
+    positions, scores = index.search(queries[0], k=K, candidates=len(vectors))
+
+    # rescoring every vector is the exact search
+    np.testing.assert_array_equal(positions, _exact_search(vectors, queries[0], K))
+    expected = _normalize(vectors[positions]) @ _normalize(queries[0])
+    np.testing.assert_allclose(scores, expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "precision, candidates, min_recall",
+    # measured: 0.72, 1.0, 0.21 and 0.82 (32 bits lose much more than int8)
+    [
+        ("int8", 0, 0.6),
+        ("int8", 10 * K, 0.95),
+        ("binary", 0, 0.15),
+        ("binary", 40 * K, 0.75),
+    ],
+)
+def test_recall_against_exact_search(
+    vectors, queries, tmp_path, precision, candidates, min_recall
+):
+    index = MatryoshkaIndex.build(vectors, tmp_path, COARSE_DIM, precision)
+
+    recall = _recall(index, vectors, queries, candidates)
+
+    assert recall >= min_recall
+    if candidates:
+        # the rescoring recovers what the coarse search misses
+        assert recall > _recall(index, vectors, queries, 0)
+
+
+@pytest.mark.parametrize("precision", ["int8", "binary"])
+def test_index_reload_gives_the_same_results(vectors, queries, tmp_path, precision):
+    index = MatryoshkaIndex.build(vectors, tmp_path, COARSE_DIM, precision)
+
+    reloaded = MatryoshkaIndex(tmp_path)
+
+    assert (reloaded.coarse_dim, reloaded.precision) == (COARSE_DIM, precision)
+    for query in queries[:5]:
+        for expected, result in zip(index.search(query), reloaded.search(query)):
+            np.testing.assert_array_equal(expected, result)
+
+
+def test_build_rejects_invalid_settings(vectors, tmp_path):
+    with pytest.raises(ValueError, match="precision"):
+        MatryoshkaIndex.build(vectors, tmp_path, COARSE_DIM, "int4")
+    with pytest.raises(ValueError, match="coarse_dim"):
+        MatryoshkaIndex.build(vectors, tmp_path, DIMENSION + 1)
+
+
+@pytest.fixture
+def store(tmp_path) -> MatryoshkaVectorStore:
+    texts = [f"chunk {i} about topic {i % 7}, café" for i in range(100)]
+    return MatryoshkaVectorStore.from_texts(
+        texts,
+        FakeEmbeddings(size=64),
+        metadatas=[{"position": i} for i in range(100)],
+        directory=tmp_path,
+        coarse_dim=16,
+    )
+
+
+def test_store_search_and_get_by_ids(store):
+    doc = store.get_by_ids(["42"])[0]
+
+    results = store.similarity_search_with_score(doc.page_content, k=3)
+
+    # the fake embedding of a text is the vector of its chunk
+    assert results[0][0] == doc
+    assert results[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert doc.metadata == {"position": 42}
+    assert [d.id for d in store.get_by_ids(["7", "missing", "99"])] == ["7", "99"]
+
+
+def test_store_reload_reads_the_documents_from_disk(store, tmp_path):
+    reloaded = MatryoshkaVectorStore.load(tmp_path, store.embedding)
+
+    assert isinstance(reloaded.documents, DocumentFile)
+    assert isinstance(reloaded.documents._data, np.memmap)
+    assert len(reloaded.documents) == 100
+    assert reloaded.documents[3] == store.documents[3]
+    query = store.documents[5].page_content
+    assert reloaded.similarity_search(query, k=4) == store.similarity_search(query, k=4)
+    assert reloaded.memory_bytes == reloaded.index.memory_bytes
+
+
+def test_document_ids_with_colliding_hashes(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "vector_database.src.matryoshka._id_hash", lambda id_: np.uint64(0)
+    )
+    documents = [Document(id=f"doc-{i}", page_content=str(i)) for i in range(5)]
+    DocumentFile.write(tmp_path, documents)
+
+    document_file = DocumentFile(tmp_path)
+
+    assert [document_file.position(f"doc-{i}") for i in range(5)] == list(range(5))
+    assert document_file.position("doc-5") is None
+
+
+def test_store_is_read_only(store):
+    with pytest.raises(NotImplementedError, match="read-only"):
+        store.add_texts(["new chunk"])
+    with pytest.raises(NotImplementedError, match="read-only"):
+        store.add_documents([Document(page_content="new chunk")])
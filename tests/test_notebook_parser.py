@@ -0,0 +1,164 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from vector_database.src.documentation_loader import load_notebook_cells
+from vector_database.src.notebook_parser import JSONStream, iter_notebook_cells
+
+ROOT = Path(__file__).parents[1]
+REPO_NOTEBOOKS = [
+    ROOT / "test_end_to_end.ipynb",
+    ROOT / "test_notebooks" / "rag_example.ipynb",
+    ROOT / "test_notebooks" / "prompt_template_example.ipynb",
+]
+BLOCK_SIZES = [1, 2, 3, 7, 64, 65536]
+
+
+def _text(value) -> str:
+    return value if isinstance(value, str) else "".join(value or [])
+
+
+def _expected_cells(path: Path, include_outputs: bool) -> list[dict]:
+    """The cells read with `json.load`, the reference of the streaming reader."""
+    with open(path, encoding="utf-8") as f:
+        notebook = json.load(f)
+    cells = []
+    for index, cell in enumerate(notebook["cells"]):
+        texts = []
+        for output in cell.get("outputs", []) if include_outputs else []:
+            texts.append(_text(output.get("text")))
+            texts.append(_text(output.get("data", {}).get("text/plain")))
+            texts.extend(
+                str(output[key]) for key in ("ename", "evalue") if key in output
+            )
+        cells.append(
+            {
+                "index": index,
+                "cell_type": cell.get("cell_type"),
+                "source": _text(cell.get("source")),
+                "outputs": "\n".join(t.strip("\n") for t in texts if t.strip()),
+            }
+        )
+    return cells
+
+
+@pytest.fixture
+def tricky_notebook(tmp_path) -> Path:
+    """A notebook whose strings are full of escapes, brackets and quotes."""
+    notebook = {
+        "metadata": {"kernelspec": {"name": "python3"}, "odd": ["}", "]", '"{[']},
+        "nbformat": 4,
+        "cells": [
+            {
+                "cell_type": "markdown",
+                "metadata": {},
+                "source": ['# Title "quoted" \\ back\\slash\n', "é ü 😀 \t tab"],
+            },
+            {
+                "cell_type": "code",
+                "execution_count": 1,
+                "metadata": {"tags": ["[", "{"]},
+                "source": 'print("}]\\\\n")\n',
+                "outputs": [
+                    {"name": "stdout", "output_type": "stream", "text": ["a\\b\n"]},
+                    {
+                        "output_type": "display_data",
+                        "data": {
+                            "image/png": "iVBORw0KGgo" * 5000,
+                            "text/plain": ['<Figure "}{">'],
+                        },
+                        "metadata": {"needs_background": "light"},
+                    },
+                    {
+                        "output_type": "error",
+                        "ename": "ValueError",
+                        "evalue": 'bad "value" \\ 😀',
+                        "traceback": ["\u001b[0;31m}]", "\\\\"],
+                    },
+                ],
+            },
+            {"cell_type": "raw", "metadata": {}, "source": []},
+            {"cell_type": "code", "metadata": {}, "source": "", "outputs": []},
+        ],
+        "nbformat_minor": 5,
+    }
+    path = tmp_path / "tricky.ipynb"
+    # ensure_ascii escapes the unicode characters (é, surrogate pairs)
+    path.write_text(json.dumps(notebook, ensure_ascii=True), encoding="utf-8")
+    return path
+
+
+@pytest.mark.parametrize("path", REPO_NOTEBOOKS, ids=lambda path: path.name)
+@pytest.mark.parametrize("include_outputs", [False, True])
+def test_repo_notebooks_match_json_load(path, include_outputs):
+    expected = _expected_cells(path, include_outputs)
+    for block_size in BLOCK_SIZES:
+        cells = list(iter_notebook_cells(path, include_outputs, block_size))
+        assert cells == expected, f"block size {block_size}"
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_escapes_split_across_blocks(tricky_notebook, block_size):
+    cells = list(iter_notebook_cells(tricky_notebook, True, block_size))
+
+    assert cells == _expected_cells(tricky_notebook, include_outputs=True)
+    assert cells[0]["source"].endswith("é ü 😀 \t tab")
+    assert '<Figure "}{">' in cells[1]["outputs"]
+    assert "iVBORw0KGgo" not in cells[1]["outputs"]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"skip": [1, "x\\\\\\"]", {"b": [[], {}]}], "s": "}{", "keep": 2}',
+        '{"skip": -12.5e-3, "n": null, "t": true, "keep": 2}',
+        '{"skip": "\\u00e9\\ud83d\\ude00[", "keep": 2}',
+    ],
+)
+@pytest.mark.parametrize("block_size", [1, 2, 3, 5, 100])
+def test_skip_and_value_across_blocks(text, block_size):
+    stream = JSONStream(io.StringIO(text), block_size)
+    values = {}
+    for key in stream.keys():
+        if key == "keep":
+            values[key] = stream.value()
+        else:
+            stream.skip()
+
+    assert values == {"keep": 2}
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 100])
+def test_numbers_split_across_blocks(block_size):
+    text = "[3.5e10, -0.25, 12345678901234567890]"
+    stream = JSONStream(io.StringIO(text), block_size)
+
+    assert [stream.value() for _ in stream.elements()] == [
+        3.5e10,
+        -0.25,
+        12345678901234567890,
+    ]
+
+
+def test_truncated_file_raises(tmp_path):
+    path = tmp_path / "truncated.ipynb"
+    path.write_text('{"cells": [{"cell_type": "code", "source": "x", "outputs": [')
+
+    with pytest.raises(ValueError):
+        list(iter_notebook_cells(path))
+
+
+def test_notebook_cells_apply_the_config(tricky_notebook):
+    config = {
+        "include_outputs": True,
+        "max_cell_length": 10,
+        "extract_markdown_cells": False,
+    }
+    documents = list(load_notebook_cells(tricky_notebook, config))
+
+    assert {doc.metadata["cell_type"] for doc in documents} == {"code"}
+    assert {doc.metadata["cell_index"] for doc in documents} == {1}
+    assert "Output:" in documents[-1].page_content
+    assert all("Output:" not in doc.page_content for doc in documents[:-1])
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from prompts.core import PromptBuilder
+from prompts.registry import PromptRegistry
+
+PROMPTS_DIR = Path(__file__).resolve().parent.parent / "prompts"
+
+
+@pytest.fixture
+def prompts_dir(tmp_path) -> Path:
+    for name in ("config.yaml", "topic_guard.yml"):
+        shutil.copy(PROMPTS_DIR / name, tmp_path / name)
+    return tmp_path
+
+
+@pytest.fixture
+def builds(monkeypatch) -> list[str]:
+    """Paths of the prompts compiled by the `PromptBuilder`."""
+    paths = []
+    build_prompt = PromptBuilder.build_prompt
+
+    def counting_build_prompt(self, file_path, *args, **kwargs):
+        paths.append(file_path)
+        return build_prompt(self, file_path, *args, **kwargs)
+
+    monkeypatch.setattr(PromptBuilder, "build_prompt", counting_build_prompt)
+    return paths
+
+
+def _registry(prompts_dir: Path, check_interval: float = 0) -> PromptRegistry:
+    return PromptRegistry(
+        prompts_dir, prompts_dir / "config.yaml", check_interval=check_interval
+    )
+
+
+def _bump_mtime(path: Path) -> None:
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_prompt_is_compiled_once(prompts_dir, builds):
+    registry = _registry(prompts_dir)
+
+    prompt = registry.get("topic_guard")
+
+    assert registry.get("topic_guard") is prompt
+    assert registry.loader("topic_guard")() is prompt.text
+    assert len(builds) == 1
+    assert prompt.version == hashlib.sha256(prompt.text.encode()).hexdigest()[:12]
+
+
+def test_modified_yaml_gets_a_new_version(prompts_dir, builds):
+    registry = _registry(prompts_dir)
+    path = prompts_dir / "topic_guard.yml"
+    prompt = registry.get("topic_guard")
+
+    path.write_text(
+        path.read_text().replace("You are a assistant", "You are an assistant")
+    )
+    _bump_mtime(path)
+    reloaded = registry.get("topic_guard")
+
+    assert "You are an assistant" in reloaded.text
+    assert reloaded.version != prompt.version
+    assert reloaded.mtime > prompt.mtime
+    assert len(builds) == 2
+
+
+def test_mtime_bump_reloads_with_the_same_version(prompts_dir, builds):
+    registry = _registry(prompts_dir)
+    prompt = registry.get("topic_guard")
+
+    _bump_mtime(prompts_dir / "config.yaml")
+    reloaded = registry.get("topic_guard")
+
+    # compiled again, but the text did not change so neither does the version
+    assert len(builds) == 2
+    assert reloaded is not prompt
+    assert reloaded.text == prompt.text and reloaded.version == prompt.version
+
+
+def test_check_interval_delays_the_reload(prompts_dir, builds):
+    registry = _registry(prompts_dir, check_interval=3600)
+    prompt = registry.get("topic_guard")
+
+    _bump_mtime(prompts_dir / "topic_guard.yml")
+
+    assert registry.get("topic_guard") is prompt
+    assert len(builds) == 1
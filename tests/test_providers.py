@@ -0,0 +1,36 @@
+import pytest
+from langchain_core.rate_limiters import BaseRateLimiter, InMemoryRateLimiter
+
+from rag_pipeline.fakes import FakeChatModel
+
+
+class CountingRateLimiter(BaseRateLimiter):
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        self.acquired += 1
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        return self.acquire(blocking=blocking)
+
+
+def test_rate_limiter_applies_to_the_injected_llm(make_pipeline):
+    rate_limiter = CountingRateLimiter()
+    pipeline = make_pipeline(
+        llm=FakeChatModel(retrievals_per_turn=1), rate_limiter=rate_limiter
+    )
+
+    answer, _ = pipeline.chat("How do checkpointers work?")
+
+    assert answer == pipeline.llm.answer
+    # topic guard, retrieval call and answer, plus the query embedding
+    assert rate_limiter.acquired == 4
+
+
+def test_injected_llm_with_another_rate_limiter_is_rejected(make_pipeline):
+    llm = FakeChatModel(rate_limiter=InMemoryRateLimiter())
+
+    with pytest.raises(ValueError, match="rate limiter"):
+        make_pipeline(llm=llm, rate_limiter=CountingRateLimiter())
@@ -0,0 +1,90 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.prebuilt import ToolNode
+
+from rag_pipeline.fakes import FakeChatModel
+
+QUERY = "checkpointers store graph state"
+
+
+def _chunk_ids(docs) -> list[str]:
+    return [str(doc.metadata["_id"]) for doc in docs]
+
+
+def test_retrievals_of_a_turn_return_new_chunks(make_pipeline):
+    pipeline = make_pipeline(llm=FakeChatModel(retrievals_per_turn=3))
+    config = {"configurable": {"thread_id": "t1"}}
+
+    pipeline.chat("How do checkpointers work?", config=config)
+
+    messages = pipeline.graph.get_state(config).values["messages"]
+    retrievals = [m.artifact for m in messages if m.type == "tool"]
+    chunk_ids = [chunk_id for r in retrievals for chunk_id in r["chunk_ids"]]
+    # the follow-up queries of the fake model are not memoized
+    assert len(retrievals) == 3
+    assert pipeline.retrieval_batcher.searches == 3
+    assert len(chunk_ids) == len(set(chunk_ids)) == 3 * pipeline.num_retrieval_chunks
+
+
+def test_over_fetch_returns_k_new_chunks(pipeline, vector_store):
+    k = pipeline.num_retrieval_chunks
+    ranked = _chunk_ids(vector_store.similarity_search(QUERY, k=2 * k))
+    previous = [{"query": "unrelated words", "chunk_ids": ranked[:k]}]
+
+    message, references = pipeline._retrieve(QUERY, previous, "call")
+
+    # the seen chunks are the best matches, the next ones are returned
+    assert message.artifact["chunk_ids"] == ranked[k:]
+    assert len(references) == k
+
+
+@pytest.mark.parametrize(
+    "threshold, memoized",
+    # the Jaccard similarity of the two queries is exactly 0.8
+    [(0.8, True), (0.81, False)],
+)
+def test_similar_query_threshold(make_pipeline, threshold, memoized):
+    pipeline = make_pipeline(similar_query_threshold=threshold)
+    previous = [{"query": QUERY, "chunk_ids": []}]
+
+    message, _ = pipeline._retrieve(f"{QUERY} durably", previous, "call")
+
+    assert pipeline.retrieval_batcher.searches == (0 if memoized else 1)
+    assert (message.artifact["chunk_ids"] == []) == memoized
+    assert ("A similar query was already retrieved" in message.content) == memoized
+
+
+def test_no_new_chunks_stops_the_retrieval(pipeline, vector_store):
+    every_chunk = _chunk_ids(vector_store.similarity_search(QUERY, k=100))
+    previous = [{"query": "unrelated words", "chunk_ids": every_chunk}]
+
+    message, references = pipeline._retrieve(QUERY, previous, "call")
+
+    assert message.content.startswith("The query did not retrieve any new information")
+    assert message.artifact == {"query": QUERY, "chunk_ids": []}
+    assert references == []
+
+
+def test_parallel_tool_calls_share_their_retrievals(pipeline):
+    tool_node = ToolNode([pipeline._create_retrieval_tool()])
+    calls = [
+        {"name": "retrieve_tool", "args": {"query": query}, "id": f"call_{i}"}
+        for i, query in enumerate([QUERY, QUERY, "memory stores and threads"])
+    ]
+    state = {
+        "messages": [
+            HumanMessage("How do checkpointers work?"),
+            AIMessage("", tool_calls=calls, id="ai-1"),
+        ],
+        "num_calls": [],
+    }
+
+    commands = tool_node.invoke(state)
+
+    artifacts = [command.update["messages"][0].artifact for command in commands]
+    by_query = sorted(len(a["chunk_ids"]) for a in artifacts if a["query"] == QUERY)
+    # the same query is searched once, the other one skips its chunks
+    assert by_query == [0, pipeline.num_retrieval_chunks]
+    chunk_ids = [chunk_id for a in artifacts for chunk_id in a["chunk_ids"]]
+    assert len(chunk_ids) == len(set(chunk_ids)) == 2 * pipeline.num_retrieval_chunks
+    assert pipeline.retrieval_batcher.searches == 2
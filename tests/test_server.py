@@ -0,0 +1,161 @@
+import asyncio
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from rag_pipeline import server as server_module
+from rag_pipeline.server import RAGServer, ServerSettings, is_fork_safe_index
+
+
+async def _post(server: RAGServer, payload: dict) -> tuple[int, dict, dict]:
+    """Return the status, the headers and the body of the response."""
+    messages = [{"type": "http.request", "body": json.dumps(payload).encode()}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/chat"}
+    await server(scope, receive, send)
+    headers = {key.decode(): value.decode() for key, value in sent[0]["headers"]}
+    return sent[0]["status"], headers, json.loads(sent[1]["body"])
+
+
+async def _post_chat(server: RAGServer, payload: dict) -> tuple[int, dict]:
+    status, _, body = await _post(server, payload)
+    return status, body
+
+
+def _server(vector_store, **settings) -> RAGServer:
+    settings = ServerSettings(fake_providers=True, fake_latency_ms=0, **settings)
+    return RAGServer(settings, vector_store, (lambda: "Guard", lambda: "RAG"))
+
+
+@pytest.fixture
+def server(vector_store) -> RAGServer:
+    return _server(vector_store)
+
+
+def _block_achat(server: RAGServer, monkeypatch) -> asyncio.Event:
+    """Make the questions wait until the returned event is set."""
+    release = asyncio.Event()
+    achat = server.rag.achat
+
+    async def blocked_achat(*args, **kwargs):
+        await release.wait()
+        return await achat(*args, **kwargs)
+
+    monkeypatch.setattr(server.rag, "achat", blocked_achat)
+    return release
+
+
+def test_several_workers_require_a_database():
+    with pytest.raises(ValidationError, match="db_uri"):
+        ServerSettings(workers=2)
+    assert ServerSettings(workers=2, db_uri="postgresql://localhost/db").workers == 2
+    assert ServerSettings(workers=1).db_uri is None
+
+
+def test_chat_answers_after_the_warmup(server):
+    async def run():
+        await server.startup()
+        return await _post_chat(server, {"question": "What is a checkpointer?"})
+
+    status, body = asyncio.run(run())
+
+    assert status == 200
+    assert body["answer"] and body["thread_id"]
+
+
+def test_internal_errors_are_not_sent_to_clients(server, monkeypatch, capsys):
+    async def failing_achat(*args, **kwargs):
+        raise RuntimeError("connection to postgresql://user:secret@db failed")
+
+    async def run():
+        await server.startup()
+        monkeypatch.setattr(server.rag, "achat", failing_achat)
+        return await _post_chat(server, {"question": "What is a checkpointer?"})
+
+    status, body = asyncio.run(run())
+
+    assert status == 500
+    assert body["error"] == "Internal server error"
+    assert "secret" not in json.dumps(body)
+    logs = capsys.readouterr().out
+    assert body["request_id"] in logs and "secret" in logs
+
+
+@pytest.mark.parametrize(
+    "settings, error",
+    [
+        ({"max_queue": 0}, "The queue is full."),
+        ({"max_queue": 1, "queue_timeout": 0.05}, "Timeout waiting in the queue."),
+    ],
+)
+def test_overload_is_rejected_with_retry_after(
+    vector_store, monkeypatch, settings, error
+):
+    server = _server(vector_store, max_concurrency=1, **settings)
+    question = {"question": "What is a checkpointer?"}
+
+    async def run():
+        await server.startup()
+        release = _block_achat(server, monkeypatch)
+        first = asyncio.create_task(_post(server, question))
+        await asyncio.sleep(0.01)
+        rejected = await _post(server, question)
+        release.set()
+        return await first, rejected
+
+    (status, _, _), (rejected_status, headers, body) = asyncio.run(run())
+
+    assert status == 200
+    assert rejected_status == 503
+    assert headers["retry-after"] == "1"
+    assert body["error"] == error
+    assert server.limiter.rejected == 1
+    assert server.limiter.in_flight == server.limiter.queued == 0
+
+
+def test_failed_question_releases_its_slot(vector_store, monkeypatch):
+    server = _server(vector_store, max_concurrency=1, max_queue=0)
+    question = {"question": "What is a checkpointer?"}
+
+    async def run():
+        await server.startup()
+        achat = server.rag.achat
+
+        async def failing_achat(*args, **kwargs):
+            raise RuntimeError("LLM unavailable")
+
+        monkeypatch.setattr(server.rag, "achat", failing_achat)
+        failed = await _post_chat(server, question)
+        monkeypatch.setattr(server.rag, "achat", achat)
+        return failed, await _post_chat(server, question)
+
+    (failed_status, _), (status, _) = asyncio.run(run())
+
+    assert failed_status == 500
+    # with a single slot and no queue, a leaked slot would reject the question
+    assert status == 200
+    assert server.limiter.in_flight == 0 and server.limiter.rejected == 0
+
+
+def test_index_is_loaded_by_the_worker_when_not_fork_safe(vector_store, monkeypatch):
+    settings = ServerSettings(workers=2, db_uri="postgresql://localhost/db")
+    assert not is_fork_safe_index(settings)
+    assert is_fork_safe_index(ServerSettings(fake_providers=True))
+
+    server = _server(vector_store)
+    server.vectorstore = None
+    monkeypatch.setattr(
+        server_module, "load_vectorstore", lambda settings: vector_store
+    )
+
+    asyncio.run(server.startup())
+
+    assert server.vectorstore is vector_store and server.ready
@@ -1,11 +1,12 @@
-import json
-from git import Repo, GitCommandError
 import os
 import stat
 import shutil
 from pathlib import Path
+from typing import Iterator, Optional
 from langchain_core.documents import Document
 
+from vector_database.src.notebook_parser import iter_notebook_cells
+
 
 def handle_remove_readonly(func, path, exc):
     """Handle read-only files during directory removal."""
@@ -36,6 +37,8 @@ def clone_repo(config: dict):
         shutil.copytree(local_cache, target_path)
 
     else:
+        from git import GitCommandError, Repo
+
         print(f"Cloning from {clone_url} to {target_path}...")
         try:
             Repo.clone_from(clone_url, target_path)
@@ -55,59 +58,162 @@ def cleanup_old_outputs(file_path="outputs/source_docs"):
         shutil.rmtree(base_output)
 
 
-def ipynb_to_markdown_string(file_path):
-    """Converts an .ipynb file to a markdown string using only
-    the markdown and code cells (ignoring the output cells).
+# settings of `document_processing.chunking.notebook` in config.yaml, the
+# defaults keep the markdown and code cells of a notebook in one document
+DEFAULT_NOTEBOOK_CONFIG = {
+    "extract_code_cells": True,
+    "extract_markdown_cells": True,
+    "preserve_cell_boundaries": False,
+    "include_outputs": False,
+    "max_cell_length": None,
+}
+
+
+def _split_lines(text: str, max_length: int) -> list[str]:
+    """Splits a text into parts of at most `max_length` characters, at line
+    boundaries when possible."""
+
+    parts, current = [], ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_length:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:max_length])
+            line = line[max_length:]
+        if len(current) + len(line) > max_length:
+            parts.append(current)
+            current = ""
+        current += line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def load_notebook_cells(
+    file_path, notebook_config: Optional[dict] = None
+) -> Iterator[Document]:
+    """Loads the cells of a notebook one by one, as documents with the
+    `cell_type` and `cell_index` in their metadata.
+
+    The notebook is streamed: the cell outputs (images, logs) are skipped
+    without being loaded, so the memory depends on the largest cell.
+
+    Args:
+        file_path: Path of the .ipynb file.
+        notebook_config (dict, optional): The notebook settings of the
+            config (`extract_code_cells`, `extract_markdown_cells`,
+            `include_outputs`, `max_cell_length`). Longer sources are split
+            into several documents and outputs are truncated.
     """
 
-    with open(file_path, encoding="utf-8") as f:
-        notebook = json.load(f)
+    notebook_config = {**DEFAULT_NOTEBOOK_CONFIG, **(notebook_config or {})}
+    cell_types = []
+    if notebook_config["extract_markdown_cells"]:
+        cell_types.append("markdown")
+    if notebook_config["extract_code_cells"]:
+        cell_types.append("code")
+    max_length = notebook_config["max_cell_length"]
+
+    for cell in iter_notebook_cells(file_path, notebook_config["include_outputs"]):
+        source = cell["source"].strip()
+        if cell["cell_type"] not in cell_types or not source:
+            continue
+
+        parts = _split_lines(source, max_length) if max_length else [source]
+        outputs = cell["outputs"][:max_length] if max_length else cell["outputs"]
+        for i, part in enumerate(parts):
+            text = part.strip()
+            if cell["cell_type"] == "code":
+                text = f"```python\n{text}\n```"
+                if outputs and i == len(parts) - 1:
+                    text += f"\n\nOutput:\n```\n{outputs}\n```"
+            yield Document(
+                page_content=text,
+                metadata={
+                    "file_path": str(file_path),
+                    "file_type": ".ipynb",
+                    "cell_type": cell["cell_type"],
+                    "cell_index": cell["index"],
+                },
+            )
 
-    output_text = []
 
-    for cell in notebook.get("cells", []):
-        cell_type = cell.get("cell_type")
-        source = "".join(cell.get("source", []))
+def ipynb_to_markdown_string(file_path, notebook_config: Optional[dict] = None):
+    """Converts an .ipynb file to a markdown string using only
+    the markdown and code cells (ignoring the output cells by default).
+    """
 
-        if cell_type == "markdown":
-            output_text.append(source.strip())
-        elif cell_type == "code":
-            output_text.append(f"```python\n{source.strip()}\n```")
+    return "\n\n".join(
+        cell.page_content for cell in load_notebook_cells(file_path, notebook_config)
+    )
 
-    return "\n\n".join(output_text)
 
+DEFAULT_IGNORE_FILES = [
+    "docs/source_docs/reference",
+    "docs/source_docs/adopters.md",
+    "docs/source_docs/index.md",
+    "docs/source_docs/llms-txt-overview.md",
+]
 
-def load_documents(
+
+def list_documents(
     docs_root: str,
     extensions=(".md", ".ipynb"),
-    ignore_files: list[str | Path] = [
-        "docs/source_docs/reference",
-        "docs/source_docs/adopters.md",
-        "docs/source_docs/index.md",
-        "docs/source_docs/llms-txt-overview.md",
-    ],
-) -> list[Document]:
-    """Loads documents from a directory."""
+    ignore_files: list[str | Path] = DEFAULT_IGNORE_FILES,
+) -> list[Path]:
+    """Lists the paths of the documents of a directory, sorted."""
 
-    docs = []
     root = Path(docs_root)
 
     ignore_paths = [Path(p).resolve() for p in ignore_files]
 
+    paths = []
     for path in root.rglob("*"):
         if path.is_file() and path.suffix in extensions:
             if any(str(ignored) in str(path.resolve()) for ignored in ignore_paths):
                 continue
+            paths.append(path)
+    return sorted(paths)
 
-            if path.suffix == ".ipynb":
-                content = ipynb_to_markdown_string(path)
-            else:
-                with open(path, encoding="utf-8") as f:
-                    content = f.read()
-            docs.append(
-                Document(
-                    page_content=content,
-                    metadata={"file_path": str(path), "file_type": path.suffix},
-                )
-            )
-    return docs
+
+def load_file(path: Path, notebook_config: Optional[dict] = None) -> list[Document]:
+    """Loads a single file. A notebook is loaded as one document per cell
+    when `preserve_cell_boundaries` is set in `notebook_config`."""
+
+    if path.suffix == ".ipynb":
+        if (notebook_config or {}).get("preserve_cell_boundaries"):
+            return list(load_notebook_cells(path, notebook_config))
+        content = ipynb_to_markdown_string(path, notebook_config)
+    else:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+    return [
+        Document(
+            page_content=content,
+            metadata={"file_path": str(path), "file_type": path.suffix},
+        )
+    ]
+
+
+def load_documents(
+    docs_root: str,
+    extensions=(".md", ".ipynb"),
+    ignore_files: list[str | Path] = DEFAULT_IGNORE_FILES,
+    notebook_config: Optional[dict] = None,
+) -> list[Document]:
+    """Loads documents from a directory.
+
+    Args:
+        docs_root (str): Directory of the documentation.
+        extensions (tuple): Extensions of the files loaded.
+        ignore_files (list): Files and directories skipped.
+        notebook_config (dict, optional): The notebook settings of the config
+            (`document_processing.chunking.notebook`).
+    """
+
+    return [
+        document
+        for path in list_documents(docs_root, extensions, ignore_files)
+        for document in load_file(path, notebook_config)
+    ]
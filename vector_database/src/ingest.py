@@ -0,0 +1,660 @@
+"""Sharded and resumable ingestion of the documentation into Qdrant.
+
+The documents are split into shards by the hash of their path. Every shard
+is chunked and embedded by batches independently of the others, so the
+shards can run as parallel workers, on one machine or on several machines
+sharing the job directory. Every embedded batch is saved in the job
+directory and recorded in the ledger of its shard: a rerun skips the
+recorded batches and resumes at the first unfinished one.
+
+Once every shard is done, `merge` loads the batches into a new version of
+the collection and points the `COLLECTION_NAME` alias to it in one atomic
+operation, so queries never see a half-built index.
+
+Usage:
+    python -m vector_database.src.ingest run --job-dir ingest_jobs/v1 --num-shards 8 --workers 4
+    python -m vector_database.src.ingest status --job-dir ingest_jobs/v1
+    python -m vector_database.src.ingest merge --job-dir ingest_jobs/v1
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from langchain_core.documents import Document
+
+from vector_database.src.documentation_loader import list_documents, load_file
+from vector_database.src.text_splitter import chunk_documents
+from vector_database.src.utils import load_config
+from vector_database.src.vector_store import (
+    COLLECTION_NAME,
+    DIMENSION,
+    EMBED_MODEL,
+    get_qdrant_client,
+)
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+    from qdrant_client import QdrantClient
+
+MANIFEST_FILE = "job.json"
+LEDGER_FILE = "ledger.jsonl"
+# held by the worker processing the shard
+LOCK_FILE = "shard.lock"
+# collection built by `merge` from the job and whether it was published
+MERGE_FILE = "merge.json"
+# settings that must not change while a job is resumed
+JOB_SETTINGS = (
+    "docs_root",
+    "num_shards",
+    "batch_size",
+    "chunk_size",
+    "chunk_overlap",
+    "embedding_model",
+    "dimension",
+)
+
+
+def shard_of(path: str, num_shards: int) -> int:
+    """Return the shard of a document, from the hash of its relative path.
+
+    The hash does not depend on the machine or on the Python process (unlike
+    `hash`), so every worker computes the same shards.
+    """
+    digest = hashlib.sha1(path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    # the file is either missing or complete, even after a crash
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ShardLedger:
+    """Append-only log of the progress of a shard.
+
+    Every entry is a JSON line flushed to disk (`fsync`) before the next
+    batch starts, so a batch is only skipped on rerun when its embeddings
+    were saved. A last line truncated by a crash (or being written) is
+    ignored when reading, and removed by `repair`.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def read(self) -> list[dict]:
+        """Return the complete entries, the file is not modified."""
+        if not self.path.exists():
+            return []
+        data = self.path.read_bytes()
+        data = data[: data.rfind(b"\n") + 1]
+        return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+    def repair(self) -> None:
+        """Remove a last line truncated by a crash, the next entries must not
+        be appended to it. Only the worker holding the shard lock calls it."""
+        if not self.path.exists():
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def append(self, entry: dict) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+@contextmanager
+def _lock_shard(shard_dir: Path, shard: int) -> Iterator[None]:
+    """Hold an exclusive lock on the shard while the context is active.
+
+    The lock is released by the system when the worker dies, so a crashed
+    shard can be rerun right away. On NFS, Linux emulates `flock` with
+    byte-range locks, so it also holds between machines.
+
+    Raises:
+        RuntimeError: If another worker holds the lock of the shard.
+    """
+    with open(shard_dir / LOCK_FILE, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(
+                f"Shard {shard} is being processed by another worker"
+            ) from None
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def create_job(
+    job_dir: Path,
+    config: dict,
+    docs_root: str,
+    num_shards: int,
+    batch_size: int,
+    fake_embeddings: bool = False,
+) -> dict:
+    """Create the manifest of the job, or load it when resuming the job.
+
+    Args:
+        job_dir: Directory of the job, shared by all the workers.
+        config: Configuration loaded from config.yaml.
+        docs_root: Directory of the documentation.
+        num_shards: Number of shards.
+        batch_size: Number of chunks embedded per request.
+        fake_embeddings: Use deterministic fake embeddings (no API key).
+
+    Returns:
+        dict: The manifest of the job.
+
+    Raises:
+        ValueError: If the job already exists with other settings.
+    """
+    chunking = config["document_processing"]["chunking"]
+    manifest = {
+        # the random suffix keeps apart the jobs started in the same second
+        "job_id": f"{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}",
+        "docs_root": str(docs_root),
+        "num_shards": num_shards,
+        "batch_size": batch_size,
+        "chunk_size": chunking.get("chunk_size", 5000),
+        "chunk_overlap": chunking.get("chunk_overlap", 600),
+        "embedding_model": "fake" if fake_embeddings else EMBED_MODEL,
+        "dimension": DIMENSION,
+    }
+    job_dir.mkdir(parents=True, exist_ok=True)
+    path = job_dir / MANIFEST_FILE
+    tmp_path = job_dir / f".{MANIFEST_FILE}.{os.getpid()}.tmp"
+    _write_atomic(tmp_path, json.dumps(manifest, indent=2).encode())
+    try:
+        # link fails if another worker already created the job
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+
+    existing = load_job(job_dir)
+    changed = [key for key in JOB_SETTINGS if existing[key] != manifest[key]]
+    if changed:
+        raise ValueError(
+            f"The job in {job_dir} was created with other settings ({changed}), "
+            "use a new job directory"
+        )
+    return existing
+
+
+def load_job(job_dir: Path) -> dict:
+    with open(job_dir / MANIFEST_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _shard_dir(job_dir: Path, shard: int) -> Path:
+    return job_dir / f"shard-{shard:04d}"
+
+
+def _chunk_ids(chunks: list[Document]) -> list[str]:
+    # stable ids (source and position in the source), reruns overwrite points
+    positions: Counter[str] = Counter()
+    ids = []
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "unknown")
+        name = f"{source}#{positions[source]}"
+        ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, name)))
+        positions[source] += 1
+    return ids
+
+
+def get_embeddings(manifest: dict) -> "Embeddings":
+    if manifest["embedding_model"] == "fake":
+        from rag_pipeline.fakes import FakeEmbeddings
+
+        return FakeEmbeddings(size=manifest["dimension"])
+
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(
+        model=manifest["embedding_model"], dimensions=manifest["dimension"]
+    )
+
+
+def run_shard(job_dir: Path, shard: int, config: dict) -> dict:
+    """Chunk and embed the documents of a shard, skipping the batches already
+    recorded in its ledger.
+
+    Args:
+        job_dir: Directory of the job, created with `create_job`.
+        shard: Index of the shard.
+        config: Configuration loaded from config.yaml.
+
+    Returns:
+        dict: The number of files, chunks and batches of the shard, and the
+            number of batches embedded by this run.
+
+    Raises:
+        ValueError: If the documents of the shard changed since the shard
+            was started.
+        RuntimeError: If another worker is processing the shard.
+    """
+    manifest = load_job(job_dir)
+    root = Path(manifest["docs_root"])
+    paths = [
+        path
+        for path in list_documents(manifest["docs_root"])
+        if shard_of(path.relative_to(root).as_posix(), manifest["num_shards"]) == shard
+    ]
+    notebook_config = config["document_processing"]["chunking"].get("notebook")
+    documents = [
+        document for path in paths for document in load_file(path, notebook_config)
+    ]
+    chunks = chunk_documents(documents, config)
+    ids = _chunk_ids(chunks)
+    batch_size = manifest["batch_size"]
+    num_batches = (len(chunks) + batch_size - 1) // batch_size
+
+    fingerprint = hashlib.sha256()
+    for document in documents:
+        fingerprint.update(document.metadata["file_path"].encode())
+        fingerprint.update(document.page_content.encode())
+
+    shard_dir = _shard_dir(job_dir, shard)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    # two workers must not append to the same ledger
+    with _lock_shard(shard_dir, shard):
+        ledger = ShardLedger(shard_dir / LEDGER_FILE)
+        ledger.repair()
+        entries = ledger.read()
+        start = next((entry for entry in entries if entry["event"] == "start"), None)
+        if start is None:
+            ledger.append(
+                {
+                    "event": "start",
+                    "fingerprint": fingerprint.hexdigest(),
+                    "files": len(paths),
+                    "chunks": len(chunks),
+                    "batches": num_batches,
+                }
+            )
+        elif start["fingerprint"] != fingerprint.hexdigest():
+            raise ValueError(
+                f"The documents of shard {shard} changed since the job started, "
+                "use a new job directory"
+            )
+        done = {entry["batch"] for entry in entries if entry["event"] == "batch"}
+
+        embedded = 0
+        embeddings = None
+        for batch in range(num_batches):
+            if batch in done:
+                continue
+            if embeddings is None:
+                embeddings = get_embeddings(manifest)
+            batch_chunks = chunks[batch * batch_size : (batch + 1) * batch_size]
+            vectors = embeddings.embed_documents(
+                [chunk.page_content for chunk in batch_chunks]
+            )
+            records = [
+                {
+                    "id": point_id,
+                    "page_content": chunk.page_content,
+                    "metadata": chunk.metadata,
+                    "vector": vector,
+                }
+                for point_id, chunk, vector in zip(
+                    ids[batch * batch_size :], batch_chunks, vectors
+                )
+            ]
+            _write_atomic(
+                shard_dir / f"batch-{batch:05d}.json",
+                json.dumps(records, ensure_ascii=False).encode("utf-8"),
+            )
+            ledger.append({"event": "batch", "batch": batch, "chunks": len(records)})
+            embedded += 1
+            print(f"Shard {shard}: batch {batch + 1}/{num_batches} embedded")
+
+        if not any(entry["event"] == "done" for entry in entries):
+            ledger.append({"event": "done"})
+        return {
+            "shard": shard,
+            "files": len(paths),
+            "chunks": len(chunks),
+            "batches": num_batches,
+            "embedded": embedded,
+        }
+
+
+def job_status(job_dir: Path) -> list[dict]:
+    """Return the progress of every shard of the job, read from the ledgers."""
+    manifest = load_job(job_dir)
+    status = []
+    for shard in range(manifest["num_shards"]):
+        entries = ShardLedger(_shard_dir(job_dir, shard) / LEDGER_FILE).read()
+        start = next((entry for entry in entries if entry["event"] == "start"), {})
+        status.append(
+            {
+                "shard": shard,
+                "chunks": start.get("chunks"),
+                "batches": start.get("batches"),
+                "embedded": sum(entry["event"] == "batch" for entry in entries),
+                "done": any(entry["event"] == "done" for entry in entries),
+            }
+        )
+    return status
+
+
+def iter_batches(job_dir: Path) -> Iterator[list[dict]]:
+    """Yield the embedded batches of every shard of a finished job.
+
+    Every record of a batch has the `id`, `page_content`, `metadata` and
+    `vector` of a chunk.
+
+    Raises:
+        RuntimeError: If some shards are not done.
+    """
+    status = job_status(job_dir)
+    unfinished = [shard["shard"] for shard in status if not shard["done"]]
+    if unfinished:
+        raise RuntimeError(f"Shards {unfinished} are not done, run them first")
+
+    def read_batches() -> Iterator[list[dict]]:
+        for shard in status:
+            shard_dir = _shard_dir(job_dir, shard["shard"])
+            for batch in range(shard["batches"]):
+                path = shard_dir / f"batch-{batch:05d}.json"
+                with open(path, encoding="utf-8") as f:
+                    yield json.load(f)
+
+    # the shards are checked when called, not on the first iteration
+    return read_batches()
+
+
+def _read_merge_state(job_dir: Path) -> Optional[dict]:
+    path = job_dir / MERGE_FILE
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_merge_state(
+    job_dir: Path, collection: str, manifest: dict, published: bool
+) -> None:
+    state = {"collection": collection, "manifest": manifest, "published": published}
+    _write_atomic(job_dir / MERGE_FILE, json.dumps(state, indent=2).encode())
+
+
+def merge(
+    job_dir: Path,
+    qdrant_url: Optional[str] = None,
+    delete_previous: bool = False,
+    migrate: bool = False,
+) -> str:
+    """Load the embedded batches of every shard into a new collection and
+    publish it by pointing the `COLLECTION_NAME` alias to it.
+
+    The alias is switched in a single `update_collection_aliases` request, so
+    the queries use either the previous collection or the complete new one.
+
+    Args:
+        job_dir: Directory of the job.
+        qdrant_url: Url of the Qdrant server, the local database is used if
+            not set.
+        delete_previous: Delete the collection previously published.
+        migrate: Delete a `COLLECTION_NAME` collection built before the
+            aliases, so the alias can take its name. It is needed only once.
+
+    Returns:
+        str: The name of the published collection.
+
+    Raises:
+        RuntimeError: If some shards are not done, if `COLLECTION_NAME` is a
+            collection and `migrate` is not set, or if the collection of the
+            job was created by another job.
+    """
+    from qdrant_client import models
+
+    manifest = load_job(job_dir)
+    batches = iter_batches(job_dir)
+    collection = f"{COLLECTION_NAME}_{manifest['job_id']}"
+    state = _read_merge_state(job_dir)
+    # the collection was created by this job, not by another one with the
+    # same id
+    owned = (
+        state is not None
+        and state["collection"] == collection
+        and state["manifest"] == manifest
+    )
+
+    client = get_qdrant_client(qdrant_url)
+    try:
+        aliases = {
+            alias.alias_name: alias.collection_name
+            for alias in client.get_aliases().aliases
+        }
+        previous = aliases.get(COLLECTION_NAME)
+        if previous == collection or client.collection_exists(collection):
+            if not owned:
+                raise RuntimeError(
+                    f"The collection {collection} was not created by the job in "
+                    f"{job_dir}, run the job again in a new job directory"
+                )
+            if previous == collection:
+                _write_merge_state(job_dir, collection, manifest, published=True)
+                print(f"{collection} is already published")
+                return collection
+
+        legacy = COLLECTION_NAME in [
+            col.name for col in client.get_collections().collections
+        ]
+        if legacy:
+            points = client.count(collection_name=COLLECTION_NAME, exact=True).count
+            if not migrate:
+                raise RuntimeError(
+                    f"{COLLECTION_NAME} is a collection ({points} points) built "
+                    "before the aliases, the alias cannot take its name. Merge "
+                    "once with --migrate to delete it and publish the alias."
+                )
+            print(
+                f"Migration: the collection {COLLECTION_NAME} ({points} points) "
+                f"will be deleted and replaced by an alias to {collection}"
+            )
+
+        _write_merge_state(job_dir, collection, manifest, published=False)
+        collection_size = _build_collection(client, collection, manifest, batches)
+
+        if legacy:
+            # Qdrant does not accept an alias with the name of a collection, the
+            # queries fail until the alias is created just below
+            client.delete_collection(COLLECTION_NAME)
+            print(f"Deleted the collection {COLLECTION_NAME}")
+
+        operations = []
+        if previous is not None:
+            operations.append(
+                models.DeleteAliasOperation(
+                    delete_alias=models.DeleteAlias(alias_name=COLLECTION_NAME)
+                )
+            )
+        operations.append(
+            models.CreateAliasOperation(
+                create_alias=models.CreateAlias(
+                    collection_name=collection, alias_name=COLLECTION_NAME
+                )
+            )
+        )
+        client.update_collection_aliases(change_aliases_operations=operations)
+        _write_merge_state(job_dir, collection, manifest, published=True)
+        print(f"Published {collection} ({collection_size} chunks) as {COLLECTION_NAME}")
+
+        if delete_previous and previous is not None and previous != collection:
+            client.delete_collection(previous)
+            print(f"Deleted the previous collection {previous}")
+        return collection
+    finally:
+        client.close()
+
+
+def _build_collection(
+    client: "QdrantClient",
+    collection: str,
+    manifest: dict,
+    batches: Iterator[list[dict]],
+) -> int:
+    """Create `collection` and load the batches into it, return its size."""
+    from qdrant_client import models
+
+    # leftover of an interrupted merge of this job, it was never published
+    if client.collection_exists(collection):
+        client.delete_collection(collection)
+    client.create_collection(
+        collection_name=collection,
+        vectors_config=models.VectorParams(
+            size=manifest["dimension"], distance=models.Distance.COSINE
+        ),
+    )
+    total = 0
+    for records in batches:
+        # same payload as `QdrantVectorStore.add_documents`
+        client.upsert(
+            collection_name=collection,
+            points=[
+                models.PointStruct(
+                    id=record["id"],
+                    vector=record["vector"],
+                    payload={
+                        "page_content": record["page_content"],
+                        "metadata": record["metadata"],
+                    },
+                )
+                for record in records
+            ],
+            wait=True,
+        )
+        total += len(records)
+
+    count = client.count(collection_name=collection, exact=True).count
+    if count != total:
+        raise RuntimeError(f"{collection} has {count} points instead of {total}")
+    return total
+
+
+def _run(args: argparse.Namespace) -> int:
+    config = load_config(args.config)
+    docs_root = args.docs_root or config["data_source"]["github"]["target_path"]
+    manifest = create_job(
+        args.job_dir,
+        config,
+        docs_root,
+        args.num_shards,
+        args.batch_size,
+        args.fake_embeddings,
+    )
+    shards = args.shards if args.shards else range(manifest["num_shards"])
+    if any(not 0 <= shard < manifest["num_shards"] for shard in shards):
+        raise ValueError(f"Shards must be in [0, {manifest['num_shards']})")
+
+    failed = False
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as executor:
+        futures = {
+            shard: executor.submit(run_shard, args.job_dir, shard, config)
+            for shard in shards
+        }
+        for shard, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Shard {shard} failed, rerun to resume it: {e}")
+                failed = True
+                continue
+            print(
+                f"Shard {shard} done: {result['files']} files, {result['chunks']} "
+                f"chunks, {result['embedded']}/{result['batches']} batches embedded "
+                "by this run"
+            )
+    return 1 if failed else 0
+
+
+def _status(args: argparse.Namespace) -> int:
+    for shard in job_status(args.job_dir):
+        batches = "?" if shard["batches"] is None else shard["batches"]
+        state = "done" if shard["done"] else "pending"
+        print(
+            f"shard {shard['shard']:>4}: {shard['embedded']}/{batches} batches, {state}"
+        )
+    return 0
+
+
+def _merge(args: argparse.Namespace) -> int:
+    merge(args.job_dir, args.qdrant_url, args.delete_previous, args.migrate)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(required=True)
+
+    run_parser = subparsers.add_parser("run", help="Chunk and embed shards")
+    run_parser.set_defaults(command=_run)
+    run_parser.add_argument("--job-dir", type=Path, required=True)
+    run_parser.add_argument("--config", default="config.yaml")
+    run_parser.add_argument(
+        "--docs-root", help="Documentation folder, from the config by default"
+    )
+    run_parser.add_argument("--num-shards", type=int, default=8)
+    run_parser.add_argument(
+        "--shards",
+        type=int,
+        nargs="*",
+        help="Shards run by this worker, all the shards by default",
+    )
+    run_parser.add_argument(
+        "--workers", type=int, default=1, help="Shards run in parallel"
+    )
+    run_parser.add_argument("--batch-size", type=int, default=64)
+    run_parser.add_argument(
+        "--fake-embeddings",
+        action="store_true",
+        help="Deterministic fake embeddings, to test without an API key",
+    )
+
+    status_parser = subparsers.add_parser("status", help="Progress of the shards")
+    status_parser.set_defaults(command=_status)
+    status_parser.add_argument("--job-dir", type=Path, required=True)
+
+    merge_parser = subparsers.add_parser("merge", help="Publish the collection")
+    merge_parser.set_defaults(command=_merge)
+    merge_parser.add_argument("--job-dir", type=Path, required=True)
+    merge_parser.add_argument(
+        "--qdrant-url", help="Qdrant server, the local database by default"
+    )
+    merge_parser.add_argument("--delete-previous", action="store_true")
+    merge_parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help=f"Delete a {COLLECTION_NAME} collection built before the aliases",
+    )
+
+    args = parser.parse_args()
+    sys.exit(args.command(args))
@@ -0,0 +1,499 @@
+"""Two-stage retrieval on Matryoshka embeddings.
+
+`text-embedding-3-large` is trained with Matryoshka representation learning:
+the first dimensions of a vector are a good (renormalized) embedding on
+their own. The index keeps only a short prefix of every vector in memory,
+quantized to int8 or to bits, and searches it for candidates. The candidates
+are then rescored with the full float32 vectors, read from a memory-mapped
+file, so only the rows of the candidates are loaded from disk. The documents
+are also read from disk, only the ones of the results are parsed.
+
+Usage:
+    python -m vector_database.src.matryoshka --job-dir ingest_jobs/v1 --index-dir matryoshka_index
+"""
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable, Optional, Sequence, Union
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+COARSE_DIM = 256
+PRECISIONS = ("float32", "int8", "binary")
+# rows scored at once in the coarse search, bounds the temporary memory
+BLOCK_SIZE = 65536
+# number of bits set in every byte, to compute hamming distances
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+DOCUMENTS_FILE = "documents.jsonl"
+# byte offset of every line of the documents file, and one for its end
+OFFSETS_FILE = "documents_offsets.npy"
+# sorted hashes of the document ids and the position of their document
+ID_HASHES_FILE = "documents_id_hashes.npy"
+ID_POSITIONS_FILE = "documents_id_positions.npy"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class MatryoshkaIndex:
+    """Immutable two-stage nearest neighbour index (cosine similarity).
+
+    The index directory contains:
+        - `coarse.npy`: the first `coarse_dim` dimensions of every vector,
+          renormalized and stored as float32, int8 or packed bits. It is the
+          only part loaded in memory.
+        - `scales.npy`: the scale of every coarse dimension (int8 only).
+        - `full.npy`: the full normalized float32 vectors, memory-mapped.
+        - `index.json`: the settings of the index.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        """Load an index built with `MatryoshkaIndex.build`.
+
+        Args:
+            directory: Directory of the index.
+        """
+        self.directory = Path(directory)
+        with open(self.directory / "index.json", encoding="utf-8") as f:
+            settings = json.load(f)
+        self.coarse_dim: int = settings["coarse_dim"]
+        self.precision: str = settings["precision"]
+        self.coarse = np.load(self.directory / "coarse.npy")
+        self.scales = (
+            np.load(self.directory / "scales.npy") if self.precision == "int8" else None
+        )
+        self.full = np.load(self.directory / "full.npy", mmap_mode="r")
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        directory: Union[str, Path],
+        coarse_dim: int = COARSE_DIM,
+        precision: str = "int8",
+    ) -> "MatryoshkaIndex":
+        """Build an index from the full vectors and save it in `directory`.
+
+        Args:
+            vectors: Full vectors, one row per document.
+            directory: Directory of the index, created if needed.
+            coarse_dim: Number of dimensions kept for the coarse search.
+            precision: Storage of the coarse vectors: "float32", "int8"
+                (scalar quantization, 4x smaller than float32) or "binary"
+                (sign of every dimension, 32x smaller than float32).
+
+        Returns:
+            MatryoshkaIndex: The loaded index.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}")
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not 0 < coarse_dim <= vectors.shape[1]:
+            raise ValueError(f"coarse_dim must be in ]0, {vectors.shape[1]}]")
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "full.npy", _normalize(vectors))
+
+        prefix = _normalize(vectors[:, :coarse_dim])
+        if precision == "int8":
+            scales = np.maximum(np.abs(prefix).max(axis=0), 1e-12) / 127
+            coarse = np.round(prefix / scales).astype(np.int8)
+            np.save(directory / "scales.npy", scales.astype(np.float32))
+        elif precision == "binary":
+            coarse = np.packbits(prefix > 0, axis=1)
+        else:
+            coarse = prefix
+        np.save(directory / "coarse.npy", coarse)
+
+        with open(directory / "index.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "coarse_dim": coarse_dim,
+                    "precision": precision,
+                    "size": len(vectors),
+                    "dimension": vectors.shape[1],
+                },
+                f,
+                indent=2,
+            )
+        return cls(directory)
+
+    def __len__(self) -> int:
+        return len(self.full)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Size of the part of the index held in memory (the coarse vectors)."""
+        return self.coarse.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def _coarse_scores(self, query: np.ndarray) -> np.ndarray:
+        prefix = _normalize(query[: self.coarse_dim])
+        if self.precision == "binary":
+            code = np.packbits(prefix > 0)
+            scores = np.empty(len(self.coarse), dtype=np.float32)
+            for start in range(0, len(self.coarse), BLOCK_SIZE):
+                block = self.coarse[start : start + BLOCK_SIZE]
+                # the fewer different bits, the higher the score
+                distances = POPCOUNT[np.bitwise_xor(block, code)].sum(axis=1)
+                scores[start : start + len(block)] = -distances.astype(np.float32)
+            return scores
+
+        if self.precision == "int8":
+            prefix = prefix * self.scales
+        scores = np.empty(len(self.coarse), dtype=np.float32)
+        for start in range(0, len(self.coarse), BLOCK_SIZE):
+            block = self.coarse[start : start + BLOCK_SIZE]
+            scores[start : start + len(block)] = block.astype(np.float32) @ prefix
+        return scores
+
+    def search(
+        self, query: Sequence[float], k: int = 4, candidates: Optional[int] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the `k` nearest vectors of `query`.
+
+        Args:
+            query: Full query vector.
+            k: Number of results.
+            candidates: Number of candidates of the coarse search rescored
+                with the full vectors, `10 * k` by default (`40 * k` for
+                binary codes). With `candidates=0` the coarse scores are
+                returned without rescoring.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The positions of the results in
+                the index and their cosine similarity, best first.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if candidates is None:
+            candidates = (40 if self.precision == "binary" else 10) * k
+
+        scores = self._coarse_scores(query)
+        if candidates == 0:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return top, scores[top]
+
+        candidates = min(max(candidates, k), len(self))
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        # sorted rows are read sequentially from the memory-mapped file
+        top.sort()
+        full_scores = self.full[top] @ _normalize(query)
+        best = np.argsort(-full_scores)[:k]
+        return top[best], full_scores[best]
+
+
+def _id_hash(id_: str) -> np.uint64:
+    return np.uint64(
+        int.from_bytes(hashlib.blake2b(id_.encode(), digest_size=8).digest(), "big")
+    )
+
+
+class DocumentFile:
+    """Documents of an index, read from disk when they are returned.
+
+    `documents.jsonl` holds one document per line. The file, the offsets of
+    its lines and the sorted hashes of the ids are memory-mapped, so neither
+    the texts nor the ids are loaded in memory: a document is parsed when it
+    is accessed, and the operating system caches the pages read.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        """Open the documents saved with `DocumentFile.write`.
+
+        Args:
+            directory: Directory of the index.
+        """
+        directory = Path(directory)
+        path = directory / DOCUMENTS_FILE
+        # an empty file cannot be memory-mapped
+        self._data = (
+            np.memmap(path, dtype=np.uint8, mode="r")
+            if path.stat().st_size
+            else np.empty(0, dtype=np.uint8)
+        )
+        self._offsets = np.load(directory / OFFSETS_FILE, mmap_mode="r")
+        self._id_hashes = np.load(directory / ID_HASHES_FILE, mmap_mode="r")
+        self._id_positions = np.load(directory / ID_POSITIONS_FILE, mmap_mode="r")
+
+    @staticmethod
+    def write(directory: Union[str, Path], documents: Iterable[Document]) -> None:
+        """Save `documents` in `directory`, one JSON line per document."""
+        directory = Path(directory)
+        offsets, id_hashes = [0], []
+        with open(directory / DOCUMENTS_FILE, "wb") as f:
+            for doc in documents:
+                record = {
+                    "id": doc.id,
+                    "page_content": doc.page_content,
+                    "metadata": doc.metadata,
+                }
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode()
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+                id_hashes.append(_id_hash(str(doc.id)))
+        id_hashes = np.array(id_hashes, dtype=np.uint64)
+        order = np.argsort(id_hashes, kind="stable")
+        np.save(directory / OFFSETS_FILE, np.array(offsets, dtype=np.int64))
+        np.save(directory / ID_HASHES_FILE, id_hashes[order])
+        np.save(directory / ID_POSITIONS_FILE, order.astype(np.int64))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, position: int) -> Document:
+        start, end = self._offsets[position], self._offsets[position + 1]
+        record = json.loads(self._data[start:end].tobytes())
+        return Document(
+            id=record["id"],
+            page_content=record["page_content"],
+            metadata=record["metadata"],
+        )
+
+    def position(self, id_: str) -> Optional[int]:
+        """Return the position of the document `id_`, None if it is missing."""
+        id_hash = _id_hash(id_)
+        start = np.searchsorted(self._id_hashes, id_hash, side="left")
+        end = np.searchsorted(self._id_hashes, id_hash, side="right")
+        # the documents of colliding hashes are compared by id
+        for position in self._id_positions[start:end]:
+            if self[int(position)].id == id_:
+                return int(position)
+        return None
+
+
+class MatryoshkaVectorStore(VectorStore):
+    """Vector store searching a `MatryoshkaIndex`, to use it in `RAGPipeline`
+    like any LangChain vector store.
+
+    The store is read-only: the quantization of the coarse vectors is fitted
+    on the whole index when it is built. To add documents, build a new index
+    with `from_texts` or `build_from_job` and load it instead.
+    """
+
+    def __init__(
+        self,
+        index: MatryoshkaIndex,
+        documents: DocumentFile,
+        embedding: "Embeddings",
+        candidates: Optional[int] = None,
+    ):
+        """Initialize the vector store.
+
+        Args:
+            index: Index of the vectors of `documents`, in the same order.
+            documents: Documents of the index, with their `id`.
+            embedding: Embeddings of the queries, the model (and dimensions)
+                used to embed the documents.
+            candidates: Candidates rescored by `MatryoshkaIndex.search`.
+        """
+        if len(index) != len(documents):
+            raise ValueError("The index and the documents have different sizes")
+        self.index = index
+        self.documents = documents
+        self.embedding = embedding
+        self.candidates = candidates
+
+    @property
+    def memory_bytes(self) -> int:
+        """Memory allocated by the store: the coarse vectors of the index.
+
+        The full vectors and the documents are memory-mapped, the pages read
+        by the searches are held in the page cache of the operating system
+        (and shared by the processes) and are not counted.
+        """
+        return self.index.memory_bytes
+
+    @property
+    def embeddings(self) -> "Embeddings":
+        return self.embedding
+
+    @classmethod
+    def load(
+        cls,
+        directory: Union[str, Path],
+        embedding: "Embeddings",
+        candidates: Optional[int] = None,
+    ) -> "MatryoshkaVectorStore":
+        """Load a vector store saved with `from_texts` or `build_from_job`."""
+        return cls(
+            MatryoshkaIndex(directory), DocumentFile(directory), embedding, candidates
+        )
+
+    @classmethod
+    def save(
+        cls,
+        directory: Union[str, Path],
+        vectors: np.ndarray,
+        documents: Iterable[Document],
+        embedding: "Embeddings",
+        coarse_dim: int = COARSE_DIM,
+        precision: str = "int8",
+    ) -> "MatryoshkaVectorStore":
+        """Build the index of `vectors` and save it with `documents`.
+
+        Returns:
+            MatryoshkaVectorStore: The loaded vector store.
+        """
+        MatryoshkaIndex.build(vectors, directory, coarse_dim, precision)
+        DocumentFile.write(directory, documents)
+        return cls.load(directory, embedding)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: "Embeddings",
+        metadatas: Optional[list[dict]] = None,
+        *,
+        ids: Optional[list[str]] = None,
+        directory: Union[str, Path] = "matryoshka_index",
+        coarse_dim: int = COARSE_DIM,
+        precision: str = "int8",
+        **kwargs: Any,
+    ) -> "MatryoshkaVectorStore":
+        """Embed `texts` and save their index in `directory`."""
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(i) for i in range(len(texts))]
+        documents = [
+            Document(id=id_, page_content=text, metadata=metadata)
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        ]
+        vectors = np.array(embedding.embed_documents(texts), dtype=np.float32)
+        return cls.save(directory, vectors, documents, embedding, coarse_dim, precision)
+
+    def add_texts(self, texts: Iterable[str], *args: Any, **kwargs: Any) -> list[str]:
+        """Not supported (also `add_documents`), the store is read-only.
+
+        Raises:
+            NotImplementedError: Always.
+        """
+        raise NotImplementedError(
+            "MatryoshkaVectorStore is read-only: build a new index with "
+            "`MatryoshkaVectorStore.from_texts` or `build_from_job` and load it"
+        )
+
+    def get_by_ids(self, ids: Sequence[str], /) -> list[Document]:
+        positions = [self.documents.position(id_) for id_ in ids]
+        return [self.documents[p] for p in positions if p is not None]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        positions, scores = self.index.search(
+            embedding, k=k, candidates=kwargs.get("candidates", self.candidates)
+        )
+        return [
+            (self.documents[int(position)], float(score))
+            for position, score in zip(positions, scores)
+        ]
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            )
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self.embedding.embed_query(query), k, **kwargs
+        )
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return self.similarity_search_by_vector(
+            self.embedding.embed_query(query), k, **kwargs
+        )
+
+    def _select_relevance_score_fn(self):
+        # cosine similarity in [-1, 1]
+        return self._cosine_relevance_score_fn
+
+
+def build_from_job(
+    job_dir: Union[str, Path],
+    directory: Union[str, Path],
+    embedding: "Embeddings",
+    coarse_dim: int = COARSE_DIM,
+    precision: str = "int8",
+) -> MatryoshkaVectorStore:
+    """Build a two-stage index from the embeddings of a finished ingest job
+    (see `vector_database.src.ingest`), without embedding the chunks again.
+
+    Args:
+        job_dir: Directory of the ingest job.
+        directory: Directory of the index.
+        embedding: Embeddings of the queries.
+        coarse_dim: Number of dimensions kept for the coarse search.
+        precision: Storage of the coarse vectors, see `MatryoshkaIndex.build`.
+
+    Returns:
+        MatryoshkaVectorStore: The loaded vector store.
+    """
+    from vector_database.src.ingest import iter_batches
+
+    vectors, documents = [], []
+    for records in iter_batches(Path(job_dir)):
+        for record in records:
+            vectors.append(record["vector"])
+            documents.append(
+                Document(
+                    id=record["id"],
+                    page_content=record["page_content"],
+                    metadata=record["metadata"],
+                )
+            )
+    return MatryoshkaVectorStore.save(
+        directory,
+        np.array(vectors, dtype=np.float32),
+        documents,
+        embedding,
+        coarse_dim,
+        precision,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--job-dir", type=Path, required=True)
+    parser.add_argument("--index-dir", type=Path, default=Path("matryoshka_index"))
+    parser.add_argument("--coarse-dim", type=int, default=COARSE_DIM)
+    parser.add_argument("--precision", choices=PRECISIONS, default="int8")
+    args = parser.parse_args()
+
+    from vector_database.src.ingest import get_embeddings, load_job
+
+    store = build_from_job(
+        args.job_dir,
+        args.index_dir,
+        get_embeddings(load_job(args.job_dir)),
+        args.coarse_dim,
+        args.precision,
+    )
+    full_bytes = store.index.full.nbytes
+    print(
+        f"Built {args.index_dir} ({len(store.index)} chunks): "
+        f"{store.memory_bytes / 2**20:.1f} MB of coarse vectors in memory instead "
+        f"of {full_bytes / 2**20:.1f} MB of full vectors "
+        f"({full_bytes / store.memory_bytes:.0f}x). The full vectors and the "
+        "documents are memory-mapped and read from disk for the results."
+    )
@@ -0,0 +1,233 @@
+import json
+import re
+from pathlib import Path
+from typing import IO, Any, Iterator, Union
+
+# when skipping a value: a run of complete strings and characters that do
+# not change the nesting, a bracket, or a lone quote (a string continuing in
+# the next block)
+_TOKEN = re.compile(r'(?:"[^"\\]*+(?:\\.[^"\\]*+)*+"|[^"{}\[\]]++)++|[{}\[\]]|"')
+_DEPTH = {"{": 1, "[": 1, "}": -1, "]": -1}
+_WHITESPACE = re.compile(r"\s*")
+_NUMBER = re.compile(r"[-+.eE0-9]*")
+
+
+class JSONStream:
+    """Incremental reader of a JSON file, which walks the objects and arrays
+    key by key and element by element.
+
+    Only the values that are read are decoded. Skipped values are scanned
+    block by block and never held in memory, so the memory depends on the
+    largest value read, not on the size of the file.
+    """
+
+    def __init__(self, file: IO[str], block_size: int = 65536):
+        """Initialize the reader.
+
+        Args:
+            file: File opened in text mode.
+            block_size: Number of characters read at once.
+        """
+        self.file = file
+        self.block_size = block_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _read(self, size: int = 0) -> bool:
+        # append the next block, dropping the part of the buffer consumed
+        if self.eof:
+            return False
+        data = self.file.read(max(size, self.block_size))
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Return the next non-whitespace character, without consuming it."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                raise ValueError("Unexpected end of the JSON file")
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in the JSON file, found {found!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Read and decode the next value."""
+        if self._peek() in "-0123456789":
+            # a number at the end of the buffer can continue in the next block
+            while _NUMBER.match(self.buffer, self.pos).end() == len(self.buffer):
+                if not self._read():
+                    break
+        while True:
+            try:
+                value, self.pos = self._decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # double the buffer, a large value is decoded a few times at most
+            self._read(len(self.buffer) - self.pos)
+
+    def skip(self) -> None:
+        """Skip the next value without decoding it."""
+        char = self._peek()
+        if char == '"':
+            self.pos += 1
+            self._skip_string()
+            return
+        if char not in "{[":
+            self.value()
+            return
+
+        depth = 0
+        while True:
+            for match in _TOKEN.finditer(self.buffer, self.pos):
+                self.pos = match.end()
+                token = match.group()
+                if token == '"':
+                    self._skip_string()
+                    break
+                depth += _DEPTH.get(token, 0)
+                if depth == 0:
+                    return
+            else:
+                self.pos = len(self.buffer)
+                if not self._read():
+                    raise ValueError("Unexpected end of the JSON file")
+
+    def _skip_string(self) -> None:
+        # called after the opening quote, `find` is much faster than a regex
+        while True:
+            quote = self.buffer.find('"', self.pos)
+            end = len(self.buffer) if quote == -1 else quote
+            backslash = self.buffer.find("\\", self.pos, end)
+            if backslash != -1:
+                if backslash + 1 < len(self.buffer):
+                    self.pos = backslash + 2
+                    continue
+                # the escaped character is in the next block
+                self.pos = backslash
+            elif quote != -1:
+                self.pos = quote + 1
+                return
+            else:
+                self.pos = len(self.buffer)
+            if not self._read():
+                raise ValueError("Unexpected end of the JSON file")
+
+    def keys(self) -> Iterator[str]:
+        """Iterate over the keys of the next object. The value of every key
+        must be read (`value`, `keys`, `elements`) or skipped before the
+        next iteration."""
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(":")
+            yield key
+            char = self._peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(
+                    f"Expected ',' or '}}' in the JSON file, found {char!r}"
+                )
+
+    def elements(self) -> Iterator[int]:
+        """Iterate over the indices of the next array. Every element must be
+        read or skipped before the next iteration."""
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            char = self._peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(
+                    f"Expected ',' or ']' in the JSON file, found {char!r}"
+                )
+
+
+def _text(value: Union[str, list[str], None]) -> str:
+    # notebook strings are either strings or lists of lines
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else "".join(value)
+
+
+def _read_outputs(stream: JSONStream) -> str:
+    """Read the text of the outputs of a code cell: the streams, the plain
+    text results and the errors. Images and rich outputs are skipped."""
+    texts = []
+    for _ in stream.elements():
+        for key in stream.keys():
+            if key == "text":
+                texts.append(_text(stream.value()))
+            elif key == "data":
+                for mime_type in stream.keys():
+                    if mime_type == "text/plain":
+                        texts.append(_text(stream.value()))
+                    else:
+                        stream.skip()
+            elif key in ("ename", "evalue"):
+                texts.append(str(stream.value()))
+            else:
+                stream.skip()
+    return "\n".join(text.strip("\n") for text in texts if text.strip())
+
+
+def iter_notebook_cells(
+    file_path: Union[str, Path], include_outputs: bool = False, block_size: int = 65536
+) -> Iterator[dict]:
+    """Read the cells of a notebook one by one, without loading the file.
+
+    The outputs of the cells are skipped without being decoded, or only
+    their text is read when `include_outputs` is set.
+
+    Args:
+        file_path: Path of the .ipynb file.
+        include_outputs: Read the text of the outputs of the code cells.
+        block_size: Number of characters read at once.
+
+    Returns:
+        Iterator[dict]: The `index`, `cell_type`, `source` and `outputs` (the
+            text of the outputs, empty if not included) of every cell.
+    """
+    with open(file_path, encoding="utf-8") as f:
+        stream = JSONStream(f, block_size)
+        for key in stream.keys():
+            if key != "cells":
+                stream.skip()
+                continue
+            for index in stream.elements():
+                cell = {"index": index, "cell_type": None, "source": "", "outputs": ""}
+                for cell_key in stream.keys():
+                    if cell_key == "cell_type":
+                        cell["cell_type"] = stream.value()
+                    elif cell_key == "source":
+                        cell["source"] = _text(stream.value())
+                    elif cell_key == "outputs" and include_outputs:
+                        cell["outputs"] = _read_outputs(stream)
+                    else:
+                        stream.skip()
+                yield cell
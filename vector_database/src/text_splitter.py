@@ -1,21 +1,50 @@
 from typing import List
-from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.docstore.document import Document
+from langchain_core.documents import Document
 from pathlib import Path
 import json
 
 
-load_dotenv()
+def _pack_cells(documents: list, chunk_size: int) -> list:
+    """Packs consecutive notebook cells of the same file into documents of at
+    most `chunk_size` characters, so a cell is only split when it is longer
+    than a chunk. The `cell_type` of a pack is "mixed" when it holds markdown
+    and code cells."""
+
+    packed = []
+    for doc in documents:
+        previous = packed[-1] if packed else None
+        if (
+            isinstance(doc, Document)
+            and "cell_type" in doc.metadata
+            and previous is not None
+            and "cell_type" in previous.metadata
+            and previous.metadata.get("file_path") == doc.metadata.get("file_path")
+            and len(previous.page_content) + len(doc.page_content) + 2 <= chunk_size
+        ):
+            cell_type = previous.metadata["cell_type"]
+            if cell_type != doc.metadata["cell_type"]:
+                cell_type = "mixed"
+            packed[-1] = Document(
+                page_content=f"{previous.page_content}\n\n{doc.page_content}",
+                metadata={**previous.metadata, "cell_type": cell_type},
+            )
+        else:
+            packed.append(doc)
+    return packed
 
 
 def chunk_documents(documents: list[Document], config: dict) -> List[Document]:
-    """Chunks documents into smaller segments."""
+    """Chunks documents into smaller segments. The cells of a notebook loaded
+    with `preserve_cell_boundaries` are packed into chunks without being cut,
+    and the chunks keep their `cell_type`."""
 
     chunking_config = config["document_processing"]["chunking"]
     chunk_size = chunking_config.get("chunk_size", 5000)
     chunk_overlap = chunking_config.get("chunk_overlap", 600)
 
+    # the text splitters take a while to import, only load them when chunking
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     all_chunks = []
 
     splitter = RecursiveCharacterTextSplitter(
@@ -35,11 +64,13 @@ def chunk_documents(documents: list[Document], config: dict) -> List[Document]:
         )
     ]
 
-    for doc in filtered_docs:
+    for doc in _pack_cells(filtered_docs, chunk_size):
         metadata = {
             "source": doc.metadata.get("file_path", "unknown"),
             "file_type": doc.metadata.get("file_type", "unknown"),
         }
+        if "cell_type" in doc.metadata:
+            metadata["cell_type"] = doc.metadata["cell_type"]
         try:
             content = doc["page_content"] if isinstance(doc, dict) else doc.page_content
             # metadata = (
@@ -1,10 +1,12 @@
 from functools import lru_cache
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
-from langchain_qdrant import QdrantVectorStore
+from typing import TYPE_CHECKING, Optional
 
 from pathlib import Path
-from langchain_openai import OpenAIEmbeddings
+
+if TYPE_CHECKING:
+    from langchain_openai import OpenAIEmbeddings
+    from langchain_qdrant import QdrantVectorStore
+    from qdrant_client import QdrantClient
 
 
 EMBED_MODEL = "text-embedding-3-large"
@@ -16,17 +18,39 @@ EMBEDDINGS_FILE = EMBEDDINGS_DIR / "embeddings.npy"
 METADATA_FILE = EMBEDDINGS_DIR / "chunk_metadata.json"
 
 
+def get_qdrant_client(url: Optional[str] = None) -> "QdrantClient":
+    """
+    Returns a client of the Qdrant server at `url`, or of the local database
+    in `QDRANT_PATH` when no url is given.
+    """
+    from qdrant_client import QdrantClient
+
+    return QdrantClient(url=url) if url else QdrantClient(path=str(QDRANT_PATH))
+
+
+def get_embeddings() -> "OpenAIEmbeddings":
+    """
+    Returns the embeddings of the documents and of the queries.
+    """
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(model=EMBED_MODEL, dimensions=DIMENSION)
+
+
 @lru_cache(maxsize=1)
-def get_vector_store() -> QdrantVectorStore:
+def get_vector_store() -> "QdrantVectorStore":
     """
     Initializes and returns a Qdrant vector store instance.
     This function uses caching to ensure that the vector store is only created once.
     """
-    client = QdrantClient(path=str(QDRANT_PATH))
-    embeddings = OpenAIEmbeddings(model=EMBED_MODEL, dimensions=DIMENSION)
-    if COLLECTION_NAME not in [
-        col.name for col in client.get_collections().collections
-    ]:
+    # qdrant and openai clients take seconds to import, load them on first use
+    from langchain_qdrant import QdrantVectorStore
+    from qdrant_client.models import Distance, VectorParams
+
+    client = get_qdrant_client()
+    embeddings = get_embeddings()
+    # the collection can also be an alias published by the ingest command
+    if not client.collection_exists(COLLECTION_NAME):
         client.create_collection(
             collection_name=COLLECTION_NAME,
             vectors_config=VectorParams(size=DIMENSION, distance=Distance.COSINE),
@@ -25,7 +25,10 @@ if __name__ == "__main__":
     clone_repo(config)
     docs_path = config["data_source"]["github"]["target_path"]
 
-    all_docs = load_documents(docs_path)
+    all_docs = load_documents(
+        docs_path,
+        notebook_config=config["document_processing"]["chunking"].get("notebook"),
+    )
     chunks = chunk_documents(all_docs, config)
     save_chunks_to_disk(chunks)
 